@@ -1,22 +1,78 @@
 from django.contrib import admin
 
+from .expiry import close_listings, reopen_listings
 from .models import User, Listing, Bid, Comment, Watchlist
+from .pagination import EstimatedCountPaginator
 
-class ListingAdmin(admin.ModelAdmin):
-    list_display = ('id', 'title', 'active')
 
-class BidAdmin(admin.ModelAdmin):
-    list_display = ('user', 'listing', 'price')
+class LargeTableAdmin(admin.ModelAdmin):
+    """Change lists that stay fast as the tables grow.
 
-class CommentAdmin(admin.ModelAdmin):
-    list_display = ('user', 'listing', 'text_comment')
+    Related objects are joined into the page query instead of being fetched
+    per row, related fields are raw id inputs or autocompletes instead of
+    dropdowns with every row of the other table, and nothing counts the
+    whole table (see EstimatedCountPaginator).
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
 
-class WatchlistAdmin(admin.ModelAdmin):
-    list_display = ('user', 'listing', 'active')
+    def get_queryset(self, request):
+        # The __str__ of bids, comments and watchlist entries names their user
+        # and listing, so join them on the delete and history pages too
+        queryset = super().get_queryset(request)
+        return queryset.select_related(*self.list_select_related) if self.list_select_related else queryset
+
+
+class UserAdmin(LargeTableAdmin):
+    list_display = ('id', 'username', 'email', 'first_name', 'last_name', 'is_staff')
+    list_filter = ('is_staff', 'is_active')
+    search_fields = ('username', 'email')
+
+
+class ListingAdmin(LargeTableAdmin):
+    list_display = ('id', 'title', 'category', 'user', 'current_price', 'number_of_bids', 'active', 'created', 'ends_at')
+    list_select_related = ('user',)
+    list_filter = ('active', 'category')
+    date_hierarchy = 'created'
+    autocomplete_fields = ('user', 'winner', 'current_bidder')
+    actions = ('close', 'reopen')
+
+    @admin.action(description="Close selected listings")
+    def close(self, request, queryset):
+        closed = close_listings(queryset)
+        self.message_user(request, f"Closed {closed} listing(s).")
+
+    @admin.action(description="Reopen selected listings")
+    def reopen(self, request, queryset):
+        reopened = reopen_listings(queryset)
+        self.message_user(request, f"Reopened {reopened} listing(s).")
+
+
+class BidAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'listing', 'price', 'created')
+    list_select_related = ('user', 'listing')
+    autocomplete_fields = ('user',)
+    raw_id_fields = ('listing',)
+
+
+class CommentAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'listing', 'text_comment', 'created')
+    list_select_related = ('user', 'listing')
+    autocomplete_fields = ('user',)
+    raw_id_fields = ('listing',)
+
+
+class WatchlistAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'listing', 'active')
+    list_select_related = ('user', 'listing')
+    list_filter = ('active',)
+    autocomplete_fields = ('user',)
+    raw_id_fields = ('listing',)
 
 # Register your models here.
-admin.site.register(User)
+admin.site.register(User, UserAdmin)
 admin.site.register(Listing, ListingAdmin)
 admin.site.register(Bid, BidAdmin)
 admin.site.register(Comment, CommentAdmin)
-admin.site.register(Watchlist, WatchlistAdmin)
\ No newline at end of file
+admin.site.register(Watchlist, WatchlistAdmin)
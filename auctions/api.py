@@ -0,0 +1,329 @@
+import hashlib
+import json
+from functools import wraps
+
+from django.http import JsonResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, quote_etag
+from django.views.decorators.cache import never_cache
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition
+
+from .bidding import BidError, place_bid, place_proxy_bid
+from .cache import listing_version
+from .comments import add_comment, comment_page
+from .db import read_only
+from .forms import CreateBid, CreateComment, CreateProxyBid
+from .history import listing_history
+from .models import ArchivedListing, Listing
+from .pagination import keyset_paginate
+from .templatetags.listing_images import thumbnail
+from .throttle import idempotent, rate_limit
+from .trending import trending_listings
+from .watchlist import set_watched
+
+PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+
+def _username(user):
+    return user.username if user else None
+
+
+def _money(value):
+    return f"{value:.2f}" if value is not None else None
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+# Field -> (columns to load, value). Loading only the requested columns keeps
+# sparse requests cheap, and sellers and bidders are only joined when asked for
+LISTING_FIELDS = {
+    "id": ((), lambda listing: listing.id),
+    "title": (("title",), lambda listing: listing.title),
+    "description": (("description",), lambda listing: listing.description),
+    "image": (("image", "image_digest"), lambda listing: thumbnail(listing, "detail")),
+    "category": (("category",), lambda listing: listing.category),
+    "starting_price": (("starting_price",), lambda listing: _money(listing.starting_price)),
+    "current_price": (("current_price",), lambda listing: _money(listing.current_price)),
+    "number_of_bids": (("number_of_bids",), lambda listing: listing.number_of_bids),
+    "comment_count": (("comment_count",), lambda listing: listing.comment_count),
+    "active": (("active",), lambda listing: listing.active),
+    "created": (("created",), lambda listing: _isoformat(listing.created)),
+    "ends_at": (("ends_at",), lambda listing: _isoformat(listing.ends_at)),
+    "seller": (("user__username",), lambda listing: listing.user.username),
+    "current_bidder": (("current_bidder__username",), lambda listing: _username(listing.current_bidder)),
+    "winner": (("winner__username",), lambda listing: _username(listing.winner)),
+}
+
+BID_FIELDS = {
+    "id": ((), lambda bid: bid.id),
+    "price": ((), lambda bid: _money(bid.price)),
+    "created": ((), lambda bid: _isoformat(bid.created)),
+    "bidder": ((), lambda bid: bid.user.username),
+}
+
+COMMENT_FIELDS = {
+    "id": ((), lambda comment: comment.id),
+    "text": ((), lambda comment: comment.text_comment),
+    "created": ((), lambda comment: _isoformat(comment.created)),
+    "author": ((), lambda comment: comment.user.username),
+}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, **details):
+        super().__init__(message)
+        self.status = status
+        self.body = {"error": message, **details}
+
+
+def endpoint(*methods):
+    """Common handling for API views.
+
+    Answers other methods with 405, unauthenticated writes with 401 and
+    ApiError with its status, all as JSON. Responses are gzipped for clients
+    that accept it. Writes are authenticated by the session, so they need
+    the CSRF token like the HTML forms do; clients that never load a page
+    get it from the csrf endpoint and send it in an X-CSRFToken header.
+    """
+    allowed = methods + ("HEAD",) if "GET" in methods else methods
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in allowed:
+                response = JsonResponse({"error": "Method not allowed."}, status=405)
+                response["Allow"] = ", ".join(allowed)
+                return response
+            if request.method not in ("GET", "HEAD") and not request.user.is_authenticated:
+                return JsonResponse({"error": "Authentication required."}, status=401)
+            try:
+                return view(request, *args, **kwargs)
+            except ApiError as error:
+                return JsonResponse(error.body, status=error.status)
+        return gzip_page(wrapper)
+    return decorator
+
+
+def requested_fields(request, available):
+    """The fields named by ?fields=, or all of them."""
+    names = [name.strip() for name in request.GET.get("fields", "").split(",") if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ApiError(400, f"Unknown field(s): {', '.join(unknown)}.", fields=list(available))
+    return names or list(available)
+
+
+def page_size(request):
+    try:
+        return max(1, min(int(request.GET.get("limit", PAGE_SIZE)), MAX_PAGE_SIZE))
+    except ValueError:
+        raise ApiError(400, "limit must be a number.")
+
+
+def sparse(queryset, fields, spec, always=()):
+    """Load only the columns and relations the requested fields need."""
+    columns = {column for name in fields for column in spec[name][0]} | set(always)
+    relations = {column.split("__")[0] for column in columns if "__" in column}
+    if relations:
+        queryset = queryset.select_related(*relations)
+    return queryset.only(*columns)
+
+
+def serialize(item, fields, spec):
+    return {name: spec[name][1](item) for name in fields}
+
+
+def page_body(page, fields, spec):
+    return {"results": [serialize(item, fields, spec) for item in page], "next_cursor": page.next_cursor}
+
+
+def conditional(request, response):
+    """Tag a GET response with the hash of its body and answer 304 if the client has it.
+
+    For lists with no cheaper version to compare; the query still runs but the
+    body is not sent again.
+    """
+    if request.method == "GET" and response.status_code == 200:
+        etag = quote_etag(hashlib.md5(response.content).hexdigest())
+        response["ETag"] = etag
+        return get_conditional_response(request, etag=etag, response=response)
+    return response
+
+
+def listing_etag(request, listing_id):
+    # The version is bumped whenever the listing, its bids or its comments
+    # change, and is read from the cache
+    version = f"{listing_id}:{listing_version(listing_id)}:{request.GET.urlencode()}"
+    return hashlib.sha1(version.encode()).hexdigest()
+
+
+def read_condition(etag_func):
+    """condition() for reads only.
+
+    Writes to the same URL are not checked against the ETag and do not look
+    up the version they would not use.
+    """
+    def decorator(view):
+        conditional_view = condition(etag_func=etag_func)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method in ("GET", "HEAD"):
+                return conditional_view(request, *args, **kwargs)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def request_data(request):
+    if request.content_type == "application/json":
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            raise ApiError(400, "The body is not valid JSON.")
+        if not isinstance(data, dict):
+            raise ApiError(400, "The body must be a JSON object.")
+        return data
+    return request.POST
+
+
+def _existing(listing_id):
+    if not Listing.objects.filter(pk=listing_id).exists():
+        raise ApiError(404, "Listing does not exist.")
+
+
+@endpoint("GET")
+@read_only
+def listings(request):
+    fields = requested_fields(request, LISTING_FIELDS)
+    queryset = Listing.objects.filter(active=True)
+    category = request.GET.get("category")
+    if category:
+        queryset = queryset.filter(category=category)
+    queryset = sparse(queryset, fields, LISTING_FIELDS, always=("created",))
+    page = keyset_paginate(queryset, request.GET.get("cursor"), page_size(request))
+    return conditional(request, JsonResponse(page_body(page, fields, LISTING_FIELDS)))
+
+
+def detail_etag(request, listing_id):
+    # Closed listings are shown to some users only, so the user is part of the tag
+    return listing_etag(request, listing_id) + (f"-{request.user.id}" if request.user.is_authenticated else "")
+
+
+@endpoint("GET")
+@condition(etag_func=detail_etag)
+@read_only
+def listing(request, listing_id):
+    fields = requested_fields(request, LISTING_FIELDS)
+    item = sparse(Listing.objects.filter(pk=listing_id), fields, LISTING_FIELDS, always=("active", "user", "winner")).first()
+    if item is None:
+        # Long closed listings are moved to the archive tables (see auctions.archive),
+        # which have no active column
+        archived = [name for name in fields if name != "active"]
+        item = sparse(ArchivedListing.objects.filter(pk=listing_id), archived, LISTING_FIELDS, always=("user", "winner")).first()
+    # As on the listing page, closed listings are only shown to the seller and the
+    # winner; an anonymous user's id is None, like the winner of an unsold listing
+    if item is None or not item.active and not (request.user.is_authenticated and request.user.id in (item.user_id, item.winner_id)):
+        raise ApiError(404, "Listing does not exist.")
+    return JsonResponse(serialize(item, fields, LISTING_FIELDS))
+
+
+@endpoint("GET", "POST")
+@read_condition(listing_etag)
+@idempotent("bid")
+@rate_limit("bid")
+def bids(request, listing_id):
+    if request.method == "POST":
+        data = request_data(request)
+        # A maximum instead of a price sets a proxy bid
+        proxy = "maximum" in data
+        form = CreateProxyBid(data) if proxy else CreateBid(data)
+        if not form.is_valid():
+            raise ApiError(400, "Invalid bid.", errors=form.errors)
+        try:
+            if proxy:
+                placed = place_proxy_bid(listing_id, request.user, form.cleaned_data["maximum"])
+            else:
+                placed = [place_bid(listing_id, request.user, form.cleaned_data["price"])]
+        except Listing.DoesNotExist:
+            raise ApiError(404, "Listing does not exist.")
+        except BidError as error:
+            raise ApiError(409, str(error))
+        if not proxy:
+            return JsonResponse(serialize(placed[0], BID_FIELDS, BID_FIELDS), status=201)
+        return JsonResponse({
+            "maximum": _money(form.cleaned_data["maximum"]),
+            "bids": [{"id": bid.id, "price": _money(bid.price), "created": _isoformat(bid.created), "bidder_id": bid.user_id} for bid in placed],
+        }, status=201 if placed else 200)
+
+    fields = requested_fields(request, BID_FIELDS)
+    page = listing_history(listing_id, request.GET.get("cursor"), page_size(request))
+    if not page.items:
+        # Long closed listings keep their bids in the archive tables (see auctions.archive)
+        if ArchivedListing.objects.filter(pk=listing_id).exists():
+            page = listing_history(listing_id, request.GET.get("cursor"), page_size(request), archived=True)
+        else:
+            _existing(listing_id)
+    return JsonResponse(page_body(page, fields, BID_FIELDS))
+
+
+@endpoint("GET")
+@never_cache
+def csrf(request):
+    # Also sets the csrftoken cookie the token is checked against
+    return JsonResponse({"csrf_token": get_token(request)})
+
+
+@endpoint("GET", "POST")
+@read_condition(listing_etag)
+@idempotent("comment")
+@rate_limit("comment")
+def comments(request, listing_id):
+    if request.method == "POST":
+        form = CreateComment(request_data(request))
+        if not form.is_valid():
+            raise ApiError(400, "Invalid comment.", errors=form.errors)
+        _existing(listing_id)
+        comment = add_comment(listing_id, request.user, form.cleaned_data["text_comment"])
+        return JsonResponse(serialize(comment, COMMENT_FIELDS, COMMENT_FIELDS), status=201)
+
+    fields = requested_fields(request, COMMENT_FIELDS)
+    page = comment_page(listing_id, request.GET.get("cursor"), page_size(request))
+    if not page.items:
+        _existing(listing_id)
+    return JsonResponse(page_body(page, fields, COMMENT_FIELDS))
+
+
+@endpoint("GET")
+@read_only
+def trending(request):
+    fields = requested_fields(request, LISTING_FIELDS)
+    category = request.GET.get("category", "")
+    if category and category not in dict(Listing.CATEGORY_CHOICES):
+        raise ApiError(400, "Unknown category.", categories=[code for code, name in Listing.CATEGORY_CHOICES])
+    listings = trending_listings(category, sparse(Listing.objects.all(), fields, LISTING_FIELDS, always=("active",)), page_size(request))
+    results = [{**serialize(listing, fields, LISTING_FIELDS), "score": round(score, 3)} for listing, score in listings]
+    return conditional(request, JsonResponse({"results": results}))
+
+
+@endpoint("GET")
+def watchlist(request):
+    if not request.user.is_authenticated:
+        raise ApiError(401, "Authentication required.")
+    fields = requested_fields(request, LISTING_FIELDS)
+    queryset = Listing.objects.filter(watchlisted__user=request.user, watchlisted__active=True)
+    queryset = sparse(queryset, fields, LISTING_FIELDS, always=("created",))
+    page = keyset_paginate(queryset, request.GET.get("cursor"), page_size(request))
+    return conditional(request, JsonResponse(page_body(page, fields, LISTING_FIELDS)))
+
+
+@endpoint("PUT", "DELETE")
+@rate_limit("watchlist")
+def watchlist_item(request, listing_id):
+    _existing(listing_id)
+    set_watched(request.user, listing_id, request.method == "PUT")
+    return JsonResponse({"listing": listing_id, "watched": request.method == "PUT"})
@@ -0,0 +1,108 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import Exists, OuterRef, Value
+from django.utils import timezone
+
+from .models import (
+    ArchivedBid, ArchivedComment, ArchivedListing, ArchivedWatchlist,
+    Bid, CategoryStats, Comment, Event, Listing, ProxyBid, TrendingListing, TrendingScore, Watchlist,
+)
+
+# Hot table -> archive table and the column naming the listing
+ARCHIVES = [
+    (Listing, ArchivedListing, "id"),
+    (Bid, ArchivedBid, "listing_id"),
+    (Comment, ArchivedComment, "listing_id"),
+    (Watchlist, ArchivedWatchlist, "listing_id"),
+]
+
+# Rows that are dropped rather than archived, children before parents
+DROPPED = [(Event, "listing_id"), (ProxyBid, "listing_id"), (TrendingScore, "listing_id"), (TrendingListing, "listing_id")]
+
+KINDS = {Listing: "listings", Bid: "bids", Comment: "comments", Watchlist: "watchlists"}
+
+
+def archive_after():
+    return timedelta(days=getattr(settings, "ARCHIVE_AFTER_DAYS", 90))
+
+
+def archivable(now=None, after=None):
+    """Closed listings that ended more than after (default ARCHIVE_AFTER_DAYS) ago.
+
+    Listings with notifications still to be sent wait for the outbox.
+    """
+    cutoff = (now or timezone.now()) - (after or archive_after())
+    pending = Event.objects.filter(listing=OuterRef("pk"), processed_at__isnull=True)
+    return Listing.objects.filter(active=False, ends_at__lt=cutoff).exclude(Exists(pending))
+
+
+def plan(now=None, after=None):
+    """How many rows of each kind an archive run would move, without moving any."""
+    listings = archivable(now, after)
+    counts = {"listings": listings.count()}
+    for hot, archive, column in ARCHIVES[1:]:
+        counts[KINDS[hot]] = hot.objects.filter(listing__in=listings.values("id")).count()
+    return counts
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def _copy(hot, archive, rows):
+    # INSERT ... SELECT, so rows never travel through Python
+    columns = [field.column for field in archive._meta.concrete_fields]
+    sql, params = rows.values_list(*columns).query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {_quote(archive._meta.db_table)} ({', '.join(map(_quote, columns))}) {sql}", params)
+        return cursor.rowcount
+
+
+def _delete(model, column, ids):
+    # A plain DELETE: the ORM's would load every row to run the delete signals
+    # and cascades, which are all handled here
+    placeholders = ", ".join(["%s"] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {_quote(model._meta.db_table)} WHERE {_quote(column)} IN ({placeholders})", ids)
+
+
+def _archive(listing_ids, now):
+    moved = {}
+    # The listings are copied first: on SQLite that write takes the lock, and a
+    # listing reopened since it was picked is left alone
+    listings = Listing.objects.filter(pk__in=listing_ids, active=False).annotate(archived=Value(now, output_field=models.DateTimeField()))
+    moved["listings"] = _copy(Listing, ArchivedListing, listings)
+    listing_ids = list(ArchivedListing.objects.filter(pk__in=listing_ids).values_list("id", flat=True))
+    if not listing_ids:
+        return moved
+    for hot, archive, column in ARCHIVES[1:]:
+        moved[KINDS[hot]] = _copy(hot, archive, hot.objects.filter(listing_id__in=listing_ids))
+    CategoryStats.objects.filter(latest_listing_id__in=listing_ids).update(latest_listing=None)
+    for model, column in DROPPED + [(hot, column) for hot, archive, column in reversed(ARCHIVES)]:
+        _delete(model, column, listing_ids)
+    return moved
+
+
+def archive_batches(batch_size=500, limit=None, now=None, after=None):
+    """Move archivable listings with their bids, comments and watchlists to the archive tables.
+
+    Yields the rows moved by each batch. A batch is copied and deleted in one
+    transaction, so an interrupted run leaves every listing either hot or
+    archived, and the next run carries on with what is left. limit caps the
+    listings moved by this run. Outbox events, proxy bids and trending rows of
+    archived listings are deleted.
+    """
+    candidates = archivable(now, after).order_by("ends_at", "id").values_list("id", flat=True)
+    done = 0
+    while limit is None or done < limit:
+        size = batch_size if limit is None else min(batch_size, limit - done)
+        # Picked outside the transaction so it starts with a write, as in close_listings
+        listing_ids = list(candidates[:size])
+        if not listing_ids:
+            return
+        with transaction.atomic():
+            moved = _archive(listing_ids, timezone.now())
+        done += moved["listings"]
+        yield moved
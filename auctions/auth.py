@@ -0,0 +1,120 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, register
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .models import User
+
+# What request.user is used for on most requests: the templates, the session
+# check (which hashes the password hash) and the permission flags. Other
+# fields are loaded from the database the first time they are read
+SLIM_FIELDS = ("id", "password", "username", "first_name", "last_name", "is_active", "is_staff", "is_superuser")
+
+# In the order User.from_db expects them
+USER_FIELDS = [field.attname for field in User._meta.concrete_fields if field.attname in SLIM_FIELDS]
+
+USER_CACHE_TIMEOUT = 60 * 60
+
+
+def _cache():
+    return caches[getattr(settings, "USER_CACHE", "default")]
+
+
+def _version_key(user_id):
+    return f"user:{user_id}:version"
+
+
+def _user_version(user_id):
+    # As with listing_version, seeded from the clock so an evicted version
+    # never comes back with a number old data was cached under
+    key = _version_key(user_id)
+    version = _cache().get(key)
+    if version is None:
+        _cache().add(key, time.time_ns(), None)
+        version = _cache().get(key)
+    return version
+
+
+def _user_key(user_id):
+    return f"user:{user_id}:{_user_version(user_id)}"
+
+
+def cached_user(user_id):
+    """The slim User with user_id, from the cache or else loaded into it. None if there is none."""
+    key = _user_key(user_id)
+    users = User.objects.filter(pk=user_id)
+    values = _cache().get(key)
+    if values is None:
+        values = users.values_list(*USER_FIELDS).first()
+        if values is None:
+            return None
+        _cache().set(key, values, USER_CACHE_TIMEOUT)
+    return User.from_db(users.db, USER_FIELDS, values)
+
+
+def remember_user(user):
+    """Cache a user that was just read from the database, so the next request need not."""
+    _cache().set(_user_key(user.id), tuple(getattr(user, name) for name in USER_FIELDS), USER_CACHE_TIMEOUT)
+
+
+def forget_user(user_id):
+    """Make a cached user unreachable, now and again once the surrounding transaction commits.
+
+    Bumping the version rather than deleting the entry, and bumping it again
+    on commit, means a request that read the old row in between cannot leave
+    it cached under the current key.
+    """
+    def bump():
+        try:
+            _cache().incr(_version_key(user_id))
+        except ValueError:
+            _user_version(user_id)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+class CachedUserBackend(ModelBackend):
+    """ModelBackend that loads request.user with cached_user instead of a query per request."""
+
+    def get_user(self, user_id):
+        user = cached_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
+
+
+# Session engines that read a session from the cache before the database
+CACHED_SESSION_ENGINES = ("django.contrib.sessions.backends.cache", "django.contrib.sessions.backends.cached_db")
+
+
+@register()
+def check_shared_caches(app_configs, **kwargs):
+    """Cached users and sessions need a cache every server process shares.
+
+    CachedUserBackend caches the password hash and is_active, and forget_user
+    only reaches the cache of the process that saved the user; logging out
+    only clears the session from the cache of the process that handled it.
+    With a per-process cache the other processes would keep accepting
+    sessions that a logout, password change or deactivation should have ended.
+    """
+    errors = []
+    if any(issubclass(import_string(path), CachedUserBackend) for path in settings.AUTHENTICATION_BACKENDS):
+        alias = getattr(settings, "USER_CACHE", "default")
+        if isinstance(caches[alias], LocMemCache):
+            errors.append(Error(
+                f"USER_CACHE ({alias!r}) is a per-process LocMemCache.",
+                hint="Point USER_CACHE at a cache all server processes share, or use ModelBackend.",
+                obj=CachedUserBackend,
+                id="auctions.E001",
+            ))
+    if settings.SESSION_ENGINE in CACHED_SESSION_ENGINES and isinstance(caches[settings.SESSION_CACHE_ALIAS], LocMemCache):
+        errors.append(Error(
+            f"SESSION_CACHE_ALIAS ({settings.SESSION_CACHE_ALIAS!r}) is a per-process LocMemCache.",
+            hint="Point SESSION_CACHE_ALIAS at a cache all server processes share, or use the db session engine.",
+            id="auctions.E002",
+        ))
+    return errors
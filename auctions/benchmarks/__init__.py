@@ -0,0 +1,6 @@
+"""Load-test and benchmark tooling for the auctions app.
+
+``data`` bulk-creates a deterministic data set, ``runner`` drives the views
+and records latency percentiles, queries per request and throughput. The
+``benchmark`` management command ties them together.
+"""
@@ -0,0 +1,107 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import User, Listing, Bid, Comment, Watchlist
+from ..stats import rebuild_category_stats
+
+WORDS = [
+    "vintage", "brass", "lamp", "guitar", "novel", "chair", "camera", "watch", "bicycle", "jacket",
+    "record", "table", "puzzle", "racket", "helmet", "poster", "kettle", "drone", "sofa", "boots",
+]
+
+
+class DataSet:
+    """What generate() created, for scenarios to pick targets from."""
+
+    def __init__(self, users, listings, password):
+        self.users = users
+        self.listings = listings
+        self.password = password
+
+
+def _new_ids(model, after):
+    return list(model.objects.filter(id__gt=after).order_by("id").values_list("id", flat=True))
+
+
+def _last_id(model):
+    return model.objects.order_by("-id").values_list("id", flat=True).first() or 0
+
+
+def generate(listings=1000, seed=0, bids_per_listing=5, comments_per_listing=2, watchlists_per_user=20, batch_size=5000):
+    """Bulk-create users, listings, bids, comments and watchlists.
+
+    The same arguments always produce the same data. Denormalized columns
+    (current price, bid count, current bidder, comment count, category stats) are written
+    consistently with the generated bids.
+    """
+    generator = random.Random(seed)
+    categories = [code for code, name in Listing.CATEGORY_CHOICES]
+    now = timezone.now()
+    password = "benchmark"
+
+    with transaction.atomic():
+        # Hashing is deliberately slow, so every user shares one hash
+        hashed = make_password(password)
+        first_user = _last_id(User)
+        user_count = max(10, listings // 10)
+        User.objects.bulk_create(
+            (User(username=f"bench{seed}-{number}", email=f"bench{seed}-{number}@example.com", password=hashed, first_name="Bench", last_name=f"User {number}") for number in range(user_count)),
+            batch_size=batch_size
+        )
+        users = _new_ids(User, first_user)
+
+        # Work out each listing's bids first so the listing row can carry the results
+        plans = []
+        for number in range(listings):
+            starting_price = Decimal(generator.randint(1, 500))
+            bidders = [generator.choice(users) for _ in range(generator.randint(0, bids_per_listing * 2))]
+            prices = [starting_price + step for step in range(len(bidders))]
+            comments = generator.randint(0, comments_per_listing * 2)
+            plans.append((starting_price, bidders, prices, comments))
+
+        first_listing = _last_id(Listing)
+        Listing.objects.bulk_create(
+            (Listing(
+                user_id=generator.choice(users),
+                title=" ".join(generator.sample(WORDS, 3)),
+                description=" ".join(generator.choices(WORDS, k=20)),
+                image="",
+                active=True,
+                starting_price=starting_price,
+                current_price=prices[-1] if prices else starting_price,
+                number_of_bids=len(prices),
+                current_bidder_id=bidders[-1] if bidders else None,
+                comment_count=comments,
+                category=generator.choice(categories),
+                ends_at=now + timedelta(hours=generator.randint(1, 24 * 10)),
+            ) for starting_price, bidders, prices, comments in plans),
+            batch_size=batch_size
+        )
+        listing_ids = _new_ids(Listing, first_listing)
+
+        Bid.objects.bulk_create(
+            (Bid(listing_id=listing_id, user_id=bidder, price=price)
+             for listing_id, (starting_price, bidders, prices, comments) in zip(listing_ids, plans)
+             for bidder, price in zip(bidders, prices)),
+            batch_size=batch_size
+        )
+        Comment.objects.bulk_create(
+            (Comment(listing_id=listing_id, user_id=generator.choice(users), text_comment=" ".join(generator.choices(WORDS, k=12)))
+             for listing_id, (starting_price, bidders, prices, comments) in zip(listing_ids, plans)
+             for _ in range(comments)),
+            batch_size=batch_size
+        )
+        Watchlist.objects.bulk_create(
+            (Watchlist(user_id=user_id, listing_id=listing_id, active=True)
+             for user_id in users
+             for listing_id in generator.sample(listing_ids, min(watchlists_per_user, len(listing_ids)))),
+            batch_size=batch_size
+        )
+        rebuild_category_stats()
+
+    return DataSet(users, listing_ids, password)
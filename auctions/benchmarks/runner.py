@@ -0,0 +1,133 @@
+import itertools
+import json
+import platform
+import random
+import time
+
+import django
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from ..models import Listing
+
+
+class Scenario:
+    """One kind of request to measure.
+
+    make_request(client, number) performs request number ``number`` and
+    returns the response; login names the user to sign in as, if any.
+    """
+
+    def __init__(self, name, make_request, login=True):
+        self.name = name
+        self.make_request = make_request
+        self.login = login
+
+
+def default_scenarios(data, seed=0):
+    generator = random.Random(seed)
+    listing_ids = list(data.listings)
+    hot_listing = listing_ids[0]
+    categories = [code for code, name in Listing.CATEGORY_CHOICES]
+
+    # Every bid outbids the previous one on the same hot listing
+    prices = itertools.count(int(Listing.objects.values_list("current_price", flat=True).get(pk=hot_listing)) + 1)
+
+    def bid(client, number):
+        return client.post(reverse("bid", args=[hot_listing]), {"price": next(prices)})
+
+    return [
+        Scenario("index", lambda client, number: client.get(reverse("index")), login=False),
+        Scenario("listing", lambda client, number: client.get(reverse("listing", args=[generator.choice(listing_ids)]))),
+        Scenario("bid", bid),
+        Scenario("watchlist_page", lambda client, number: client.get(reverse("watchlist_page"))),
+        Scenario("category", lambda client, number: client.get(reverse("category", args=[generator.choice(categories)])), login=False),
+        Scenario("search", lambda client, number: client.get(reverse("search"), {"q": generator.choice(["lamp", "guitar", "vintage brass"])}), login=False),
+    ]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_scenario(scenario, requests, user=None, warmup=5):
+    client = Client()
+    if scenario.login and user is not None:
+        client.force_login(user)
+
+    for number in range(warmup):
+        scenario.make_request(client, number)
+
+    latencies = []
+    queries = 0
+    began = time.perf_counter()
+    for number in range(requests):
+        with CaptureQueriesContext(connection) as captured:
+            request_began = time.perf_counter()
+            response = scenario.make_request(client, number)
+            latencies.append(time.perf_counter() - request_began)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{scenario.name} returned {response.status_code}")
+        queries += len(captured)
+    elapsed = time.perf_counter() - began
+
+    return {
+        "requests": requests,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "queries_per_request": queries / requests,
+        "requests_per_second": requests / elapsed,
+    }
+
+
+def run(scenarios, requests=200, user=None, meta=None):
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "requests": requests,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            **(meta or {}),
+        },
+        "scenarios": {},
+    }
+    # One client hammering one endpoint is exactly what the write rate limits
+    # stop; lift them to measure the views themselves
+    with override_settings(RATE_LIMITS={}):
+        for scenario in scenarios:
+            results["scenarios"][scenario.name] = run_scenario(scenario, requests, user)
+    return results
+
+
+def compare(results, baseline, threshold=1.2):
+    """List the scenarios that regressed against a baseline run.
+
+    A scenario regresses when its p95 latency grows by more than the
+    threshold factor, or when it runs more queries per request.
+    """
+    regressions = []
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * threshold:
+            regressions.append(f"{name}: p95 {previous['p95_ms']:.1f} ms -> {current['p95_ms']:.1f} ms")
+        if current["queries_per_request"] > previous["queries_per_request"] + 0.01:
+            regressions.append(f"{name}: queries/request {previous['queries_per_request']:.1f} -> {current['queries_per_request']:.1f}")
+    return regressions
+
+
+def load(path):
+    with open(path) as results:
+        return json.load(results)
+
+
+def save(results, path):
+    with open(path, "w") as output:
+        json.dump(results, output, indent=2, sort_keys=True)
@@ -0,0 +1,175 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Exists, F, OuterRef, Q, Subquery, Value, When
+from django.utils import timezone
+
+from .models import Bid, Event, Listing, ProxyBid, User
+from .pubsub import broker, listing_channel
+from .cache import touch_category
+from .stats import refresh_category_prices
+from .trending import record_activity
+
+
+class BidError(Exception):
+    pass
+
+
+def bid_increment():
+    """How far a proxy bids above the bid it beats."""
+    return Decimal(str(getattr(settings, "BID_INCREMENT", "1.00")))
+
+
+def _record(listing_id, category, bids, number_of_bids, bidder):
+    """Write the bids' outbox events, refresh the category and trending score and tell the live feed."""
+    Event.objects.bulk_create(Event(kind=Event.BID, listing_id=listing_id, bid=bid) for bid in bids)
+    refresh_category_prices(category, bids[-1].price)
+    touch_category(category)
+    record_activity(listing_id, "bid", len(bids))
+    update = {
+        "price": str(bids[-1].price),
+        "number_of_bids": number_of_bids,
+        "current_bidder": f"{bidder.first_name} {bidder.last_name}",
+        "current_bidder_id": bidder.id,
+        "active": True,
+    }
+    # Live feeds only hear about bids that actually committed
+    transaction.on_commit(lambda: broker.publish(listing_channel(listing_id), update))
+
+
+def place_bid(listing_id, user, price):
+    """Validate and apply a bid in one transaction.
+
+    The price check and the listing update are a single conditional UPDATE, so
+    the database serializes concurrent bids on the row and only one of two equal
+    bids can win. The cost does not depend on how many bids the listing has.
+
+    If another user's proxy maximum is at or above the price, the same UPDATE
+    hands the lead to that proxy, one increment up or at its maximum, and its
+    answer is recorded as a second bid. A bid equal to the maximum leaves the
+    proxy leading at that price, since the earlier of equal maxima wins.
+    """
+    increment = bid_increment()
+    rival = ProxyBid.objects.filter(listing=OuterRef("pk"), maximum__gte=price).exclude(user=user).order_by("-maximum", "placed", "id")
+    answered = Exists(rival)
+    with transaction.atomic():
+        updated = Listing.objects.filter(pk=listing_id, active=True, ends_at__gt=timezone.now()).filter(
+            Q(number_of_bids=0, starting_price__lte=price) | Q(number_of_bids__gt=0, current_price__lt=price)
+        ).update(
+            current_price=Case(
+                When(Exists(rival.filter(maximum__gte=price + increment)), then=Value(price + increment)),
+                When(answered, then=Subquery(rival.values("maximum")[:1])),
+                default=Value(price),
+                output_field=models.DecimalField(),
+            ),
+            current_bidder=Case(When(answered, then=Subquery(rival.values("user")[:1])), default=Value(user.id), output_field=models.IntegerField()),
+            number_of_bids=F("number_of_bids") + Case(When(answered, then=Value(2)), default=Value(1)),
+        )
+        if updated:
+            state = Listing.objects.filter(pk=listing_id).values("current_price", "current_bidder_id", "number_of_bids", "category").get()
+            bid = Bid.objects.create(price=price, user=user, listing_id=listing_id)
+            bids = [bid]
+            bidder = user
+            if state["current_bidder_id"] != user.id:
+                bidder = User.objects.only("first_name", "last_name").get(pk=state["current_bidder_id"])
+                bids.append(Bid.objects.create(price=state["current_price"], user=bidder, listing_id=listing_id))
+            _record(listing_id, state["category"], bids, state["number_of_bids"], bidder)
+            return bid
+
+    # Work out why the bid was rejected only on the slow path
+    listing = Listing.objects.only("active", "ends_at", "number_of_bids").get(pk=listing_id)
+    if not listing.active or listing.ends_at <= timezone.now():
+        raise BidError("The listing is closed!")
+    if not listing.number_of_bids:
+        raise BidError("The bid must be greater than or equal to the initial price!")
+    raise BidError("The bid must be greater than the current bid!")
+
+
+def resolve_proxies(listing, leader, runner_up, increment):
+    """The bids a listing's two leading proxies make against its standing bid.
+
+    leader and runner_up are (user id, maximum) pairs, runner_up possibly
+    None. Returns (user id, price) pairs in bidding order: the runner-up's
+    last bid at its maximum, if that beat the standing bid, then the leader's
+    answer one increment above it, capped at the leader's own maximum. Empty
+    if nothing changes.
+    """
+    standing = listing.current_price
+    bidder = listing.current_bidder_id
+    has_bids = bool(listing.number_of_bids)
+    leader_id, leader_max = leader
+
+    def beats_standing(amount):
+        return amount > standing if has_bids else amount >= listing.starting_price
+
+    bids = []
+    if runner_up is not None and beats_standing(runner_up[1]):
+        bids.append(runner_up)
+        second = runner_up[1]
+    elif has_bids and bidder != leader_id:
+        second = standing
+    else:
+        second = None
+
+    if second is None:
+        if has_bids:
+            return []
+        price = listing.starting_price
+    else:
+        price = min(leader_max, second + increment)
+    if bids and bids[0][1] >= price:
+        # Equal maxima: the earlier proxy leads at that price, and the later one
+        # adds no bid of its own
+        bids = []
+    if bidder == leader_id and price <= standing:
+        return []
+    return bids + [(leader_id, price)]
+
+
+def place_proxy_bid(listing_id, user, maximum):
+    """Store user's hidden maximum for a listing and bid up to it on their behalf.
+
+    Competing maxima are resolved at once at the bid increment: the highest
+    maximum (the earliest of equal ones) leads, one increment above the
+    runner-up's maximum or at its own. Only the outcome is written: at most
+    two bids and one listing UPDATE, however long the manual bid war would
+    have been. The two leading proxies are a seek on the (listing, -maximum)
+    index, so the cost grows with the log of the number of proxies.
+
+    Returns the bids written, which is empty when a leader only raised its
+    maximum. Raises BidError if the maximum cannot take the lead.
+    """
+    increment = bid_increment()
+    now = timezone.now()
+    with transaction.atomic():
+        # Write first, as in place_bid, so SQLite takes the lock before the reads below
+        if not ProxyBid.objects.filter(listing_id=listing_id, user=user, maximum__lt=maximum).update(maximum=maximum, placed=now):
+            try:
+                with transaction.atomic():
+                    ProxyBid.objects.create(listing_id=listing_id, user=user, maximum=maximum, placed=now)
+            except IntegrityError:
+                raise BidError("Your maximum bid can only be raised!")
+        listing = Listing.objects.select_for_update().only(
+            "active", "ends_at", "category", "starting_price", "current_price", "current_bidder", "number_of_bids"
+        ).get(pk=listing_id)
+        if not listing.active or listing.ends_at <= now:
+            raise BidError("The listing is closed!")
+        if not listing.number_of_bids:
+            if maximum < listing.starting_price:
+                raise BidError("The bid must be greater than or equal to the initial price!")
+        elif maximum <= listing.current_price:
+            raise BidError("The bid must be greater than the current bid!")
+
+        leading = [(proxy["user_id"], proxy["maximum"]) for proxy in ProxyBid.objects.filter(listing_id=listing_id).order_by("-maximum", "placed", "id").values("user_id", "maximum")[:2]]
+        steps = resolve_proxies(listing, leading[0], leading[1] if len(leading) > 1 else None, increment)
+        bids = [Bid.objects.create(listing_id=listing_id, user_id=user_id, price=price) for user_id, price in steps]
+        if bids:
+            Listing.objects.filter(pk=listing_id).update(
+                current_price=bids[-1].price,
+                current_bidder_id=bids[-1].user_id,
+                number_of_bids=F("number_of_bids") + len(bids),
+            )
+            bidder = user if bids[-1].user_id == user.id else User.objects.only("first_name", "last_name").get(pk=bids[-1].user_id)
+            _record(listing_id, listing.category, bids, (listing.number_of_bids or 0) + len(bids), bidder)
+        return bids
@@ -0,0 +1,60 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+# How long a rendered listing fragment lives if nothing invalidates it first
+LISTING_CACHE_TIMEOUT = 60 * 60
+
+
+def _version_key(listing_id):
+    return f"listing:{listing_id}:version"
+
+
+def listing_version(listing_id):
+    # Seed new versions from the clock so a version key that was evicted never
+    # comes back with a number an old fragment was cached under
+    key = _version_key(listing_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_listing(listing_id):
+    """Make every cached fragment of a listing unreachable.
+
+    The bump waits for the surrounding transaction to commit, otherwise a reader
+    could cache the old data under the new version in between.
+    """
+    def bump():
+        try:
+            cache.incr(_version_key(listing_id))
+        except ValueError:
+            listing_version(listing_id)
+
+    transaction.on_commit(bump)
+
+
+def _category_key(category):
+    return f"category:{category}:changed"
+
+
+def category_changed(category):
+    """When a bid last changed a price on a category's pages, in clock nanoseconds.
+
+    Kept in the cache rather than on the stats row so bids in one category do
+    not all queue up to write the same row.
+    """
+    key = _category_key(category)
+    changed = cache.get(key)
+    if changed is None:
+        cache.add(key, time.time_ns(), None)
+        changed = cache.get(key)
+    return changed
+
+
+def touch_category(category):
+    # As with invalidate_listing, only once the new prices are visible
+    transaction.on_commit(lambda: cache.set(_category_key(category), time.time_ns(), None))
@@ -0,0 +1,27 @@
+from django.db import transaction
+
+from .models import Comment
+from .pagination import keyset_paginate
+from .trending import record_activity
+
+COMMENT_ORDERING = ("-created", "-id")
+
+
+def comment_page(listing_id, cursor=None, page_size=10):
+    """A page of a listing's comments, newest first, with their authors.
+
+    One query that reads the (listing, created) index from the cursor
+    position, however many comments the listing has.
+    """
+    comments = Comment.objects.filter(listing_id=listing_id).select_related("user").only(
+        "text_comment", "created", "listing_id", "user__username", "user__first_name", "user__last_name"
+    )
+    return keyset_paginate(comments, cursor, page_size, COMMENT_ORDERING)
+
+
+def add_comment(listing_id, user, text):
+    # The post_save signal bumps the listing's comment count in the same transaction
+    with transaction.atomic():
+        comment = Comment.objects.create(text_comment=text, user=user, listing_id=listing_id)
+        record_activity(listing_id, "comment")
+    return comment
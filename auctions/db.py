@@ -0,0 +1,57 @@
+import contextvars
+from functools import wraps
+
+from django.conf import settings
+
+REPLICA = "replica"
+
+_read_only = contextvars.ContextVar("read_only", default=False)
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """Apply settings.SQLITE_PRAGMAS to every new SQLite connection.
+
+    In WAL mode readers see the last committed data while a writer holds its
+    lock, instead of queueing behind it.
+    """
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, "SQLITE_PRAGMAS", {}).items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+def read_only(view):
+    """Run a view's queries against the read replica, when one is configured.
+
+    Only for pages that can show data a moment behind the primary: a user
+    who just wrote something should be sent to a view reading the primary.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = _read_only.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _read_only.reset(token)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    """Send reads from read_only views to the replica; everything else to default."""
+
+    def db_for_read(self, model, **hints):
+        if _read_only.get() and REPLICA in settings.DATABASES:
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
@@ -0,0 +1,123 @@
+from django.db import connection, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .cache import invalidate_listing
+from .models import AUCTION_DURATION, Event, Listing
+from .pubsub import broker, listing_channel
+from .stats import adjust_category_stats, adjust_listing_category
+
+
+def _announce_closed(listing_ids):
+    # Winners and watchers are notified from the outbox once this commits
+    Event.objects.bulk_create(Event(kind=Event.CLOSED, listing_id=listing_id) for listing_id in listing_ids)
+    # update() bypasses the model signals, so invalidate the cached pages here
+    for listing_id in listing_ids:
+        invalidate_listing(listing_id)
+    transaction.on_commit(lambda: [broker.publish(listing_channel(listing_id), {"active": False}) for listing_id in listing_ids])
+
+
+def close_by_seller(listing_id, seller):
+    """Close a listing on its seller's request. Returns whether it was closed."""
+    with transaction.atomic():
+        # The current bidder is only ever moved by the bid service's conditional
+        # UPDATE on this same row, so whoever holds it at close time has won
+        closed = Listing.objects.filter(pk=listing_id, user=seller, active=True).update(active=False, winner=F("current_bidder"))
+        if closed:
+            adjust_listing_category(listing_id, -1)
+            _announce_closed([listing_id])
+    return bool(closed)
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def _close(listings, listing_ids):
+    # UPDATE ... RETURNING reports exactly the rows this statement closed. A
+    # listing closed by its seller in between is not among them, whatever
+    # closes and reopens it had before
+    sql, params = listings.filter(pk__in=listing_ids).values("pk").query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {_quote(Listing._meta.db_table)} SET {_quote('active')} = %s, {_quote('winner_id')} = {_quote('current_bidder_id')} "
+            f"WHERE {_quote('id')} IN ({sql}) RETURNING {_quote('id')}",
+            [False, *params],
+        )
+        return [listing_id for listing_id, in cursor.fetchall()]
+
+
+def close_listings(listings, batch_size=500):
+    """Close the active listings among listings, one batch per transaction.
+
+    Each batch is one set-based UPDATE that copies current_bidder into winner,
+    so the cost per listing is independent of its number of bids. It returns
+    the ids it closed, which give the category stats their exact counts and
+    get the close events. Returns the number of listings closed.
+    """
+    listings = listings.filter(active=True)
+    total = 0
+    while True:
+        # Picking the batch happens outside the transaction so the transaction
+        # starts with its write: on SQLite a read-then-write transaction can fail
+        # with "database is locked" instead of waiting for a concurrent bid
+        batch = dict(listings.order_by("ends_at").values_list("id", "category")[:batch_size])
+        if not batch:
+            return total
+        with transaction.atomic():
+            closed = _close(listings, list(batch))
+            deltas = {}
+            for listing_id in closed:
+                deltas[batch[listing_id]] = deltas.get(batch[listing_id], 0) - 1
+            adjust_category_stats(deltas)
+            _announce_closed(closed)
+        total += len(closed)
+
+
+def close_expired_listings(now=None, batch_size=500):
+    """Close every listing whose end time has passed. Returns the number closed."""
+    now = now or timezone.now()
+    return close_listings(Listing.objects.filter(ends_at__lte=now), batch_size)
+
+
+def reopen_listings(listings):
+    """Put closed listings among listings back up for auction.
+
+    The winner is cleared and an end time that has passed is moved a full
+    auction duration ahead, so the listing is not closed again straight away.
+    One UPDATE per category. Returns the number reopened.
+    """
+    listings = listings.filter(active=False)
+    by_category = {}
+    for listing_id, category in listings.values_list("id", "category"):
+        by_category.setdefault(category, []).append(listing_id)
+    now = timezone.now()
+    with transaction.atomic():
+        deltas = {}
+        for category, listing_ids in by_category.items():
+            deltas[category] = listings.filter(pk__in=listing_ids).update(
+                active=True,
+                winner=None,
+                ends_at=Case(When(ends_at__lte=now, then=Value(now + AUCTION_DURATION)), default=F("ends_at")),
+            )
+        adjust_category_stats(deltas)
+        reopened = [listing_id for listing_ids in by_category.values() for listing_id in listing_ids]
+        for listing_id in reopened:
+            invalidate_listing(listing_id)
+        # Live feeds get the whole state back, as after a bid, since pages that
+        # saw the close have dropped theirs
+        states = Listing.objects.filter(pk__in=reopened).values(
+            "id", "starting_price", "current_price", "number_of_bids", "current_bidder_id", "current_bidder__first_name", "current_bidder__last_name"
+        )
+        updates = {
+            state["id"]: {
+                "price": str(state["current_price"] if state["current_price"] is not None else state["starting_price"]),
+                "number_of_bids": state["number_of_bids"],
+                "current_bidder": f"{state['current_bidder__first_name']} {state['current_bidder__last_name']}" if state["current_bidder_id"] else None,
+                "current_bidder_id": state["current_bidder_id"],
+                "active": True,
+            }
+            for state in states
+        }
+        transaction.on_commit(lambda: [broker.publish(listing_channel(listing_id), update) for listing_id, update in updates.items()])
+    return sum(deltas.values())
@@ -1,7 +1,20 @@
+from datetime import timedelta
+
 from django import forms
-from .models import User, Listing, Bid, Comment, Watchlist
+from django.utils import timezone
+
+from .models import User, Listing, Bid, Comment, ProxyBid
 
 class CreateListing(forms.ModelForm):
+    DURATION_CHOICES = [
+        (1, '1 day'),
+        (3, '3 days'),
+        (5, '5 days'),
+        (7, '7 days'),
+        (10, '10 days'),
+    ]
+    duration = forms.TypedChoiceField(coerce=int, choices=DURATION_CHOICES, initial=7, label="Duration", widget=forms.Select(attrs={'class':'form-control'}))
+
     class Meta:
         model = Listing
         fields = [
@@ -18,6 +31,22 @@ class CreateListing(forms.ModelForm):
             'image': "URL of an image (optional)",
             'starting_price': "Starting price in USD"
         }
+
+    def build_listing(self, user, now=None):
+        """An unsaved, open listing from the cleaned data."""
+        data = self.cleaned_data
+        now = now or timezone.now()
+        return Listing(
+            user=user,
+            title=data["title"],
+            description=data["description"],
+            image=data["image"],
+            active=True,
+            starting_price=data["starting_price"],
+            current_price=data["starting_price"],
+            category=data["category"],
+            ends_at=now + timedelta(days=data["duration"]),
+        )
 class CreateBid(forms.ModelForm):
     class Meta:
         model = Bid
@@ -30,6 +59,21 @@ class CreateBid(forms.ModelForm):
         labels = {
             'price': ''
         }
+class CreateProxyBid(forms.ModelForm):
+    class Meta:
+        model = ProxyBid
+        fields = [
+            'maximum'
+        ]
+        widgets = {
+            'maximum': forms.NumberInput(attrs={'class':'form-control','placeholder':'Maximum bid'})
+        }
+        labels = {
+            'maximum': ''
+        }
+        help_texts = {
+            'maximum': "Kept hidden; we bid for you, one increment at a time, up to this amount."
+        }
 class CreateComment(forms.ModelForm):
     class Meta:
         model = Comment
@@ -41,4 +85,13 @@ class CreateComment(forms.ModelForm):
         }
         labels ={
             'text_comment': ''
-        }
\ No newline at end of file
+        }
+class SearchForm(forms.Form):
+    q = forms.CharField(max_length=200, required=False, widget=forms.TextInput(attrs={'class':'form-control','placeholder':'Search listings','type':'search'}))
+    category = forms.ChoiceField(choices=[('', 'All categories')] + Listing.CATEGORY_CHOICES, required=False, widget=forms.Select(attrs={'class':'form-control'}))
+    min_price = forms.DecimalField(min_value=0, max_digits=19, decimal_places=2, required=False, widget=forms.NumberInput(attrs={'class':'form-control','placeholder':'Min price'}))
+    max_price = forms.DecimalField(min_value=0, max_digits=19, decimal_places=2, required=False, widget=forms.NumberInput(attrs={'class':'form-control','placeholder':'Max price'}))
+class ImportListings(forms.Form):
+    file = forms.FileField(label="CSV or JSON Lines file", widget=forms.ClearableFileInput(attrs={'class':'form-control-file'}))
+    format = forms.ChoiceField(choices=[('', 'From the file name'), ('csv', 'CSV'), ('jsonl', 'JSON Lines')], required=False, widget=forms.Select(attrs={'class':'form-control'}))
+    seller = forms.ModelChoiceField(queryset=User.objects.all(), to_field_name="username", required=False, help_text="Username to list the items under; defaults to you.", widget=forms.TextInput(attrs={'class':'form-control'}))
@@ -0,0 +1,85 @@
+from django.db.models import Count, Exists, Max, OuterRef
+
+from .models import ArchivedBid, ArchivedListing, Bid, Listing
+from .pagination import KeysetPage, encode_cursor, keyset_paginate
+
+HISTORY_ORDERING = ("-created", "-id")
+
+
+def listing_history(listing_id, cursor=None, page_size=25, archived=False):
+    """A page of a listing's bids, newest first, with the bidders.
+
+    Reads the (listing, created, id, ...) index from the cursor position, so a
+    page costs the same however many bids the listing has. archived reads the
+    bids of a listing moved to the archive tables (see auctions.archive).
+    """
+    bids = (ArchivedBid if archived else Bid).objects.filter(listing_id=listing_id).select_related("user").only(
+        "created", "price", "listing_id", "user__username", "user__first_name", "user__last_name"
+    )
+    return keyset_paginate(bids, cursor, page_size, HISTORY_ORDERING)
+
+
+def bid_status(listing, user):
+    if listing.active:
+        return "winning" if listing.current_bidder_id == user.id else "outbid"
+    return "won" if listing.winner_id == user.id else "lost"
+
+
+def _latest_bids(bids, user, cursor, page_size):
+    # A page of the user's latest bid on each listing, newest first
+    later = bids.filter(user=user, listing_id=OuterRef("listing_id"), id__gt=OuterRef("id"))
+    latest = bids.filter(user=user).exclude(Exists(later)).values("id", "listing_id", "created")
+    return keyset_paginate(latest, cursor, page_size, HISTORY_ORDERING)
+
+
+def _summaries(bids, listings, user, page):
+    listing_ids = [bid["listing_id"] for bid in page]
+    if not listing_ids:
+        return {}
+    totals = {
+        total["listing_id"]: total
+        for total in bids.filter(user=user, listing_id__in=listing_ids).values("listing_id").annotate(highest_bid=Max("price"), bids=Count("id"))
+    }
+    listings = listings.in_bulk(listing_ids)
+    return {
+        bid["id"]: {
+            "listing_id": bid["listing_id"],
+            "listing": listings[bid["listing_id"]],
+            "last_bid_id": bid["id"],
+            "last_bid_at": bid["created"],
+            "highest_bid": totals[bid["listing_id"]]["highest_bid"],
+            "bids": totals[bid["listing_id"]]["bids"],
+            "status": bid_status(listings[bid["listing_id"]], user),
+        } for bid in page
+    }
+
+
+def user_bids(user, cursor=None, page_size=25):
+    """A page of the listings a user has bid on, most recently bid on first.
+
+    Each item is a dict with the listing, the user's highest bid, their
+    number of bids, when they last bid and whether they are winning.
+
+    The page walks the user's bids newest first on the (user, created, id)
+    index, keeping each listing's latest bid, which a seek on the (user,
+    listing, id) index confirms. Only the page's listings are then
+    aggregated, so a page costs the same however many bids the user has made.
+
+    Bids on archived listings are walked the same way in the archive tables
+    and merged in. Archiving keeps ids, so (created, id) orders both together
+    and one cursor continues both walks.
+    """
+    live = _latest_bids(Bid.objects.all(), user, cursor, page_size)
+    archived = _latest_bids(ArchivedBid.objects.all(), user, cursor, page_size)
+    latest = sorted([*live, *archived], key=lambda bid: (bid["created"], bid["id"]), reverse=True)
+
+    next_cursor = None
+    if len(latest) > page_size or live.has_next or archived.has_next:
+        latest = latest[:page_size]
+        next_cursor = encode_cursor([latest[-1]["created"], latest[-1]["id"]])
+    kept = {bid["id"] for bid in latest}
+    summaries = {
+        **_summaries(Bid.objects.all(), Listing.objects.all(), user, [bid for bid in live if bid["id"] in kept]),
+        **_summaries(ArchivedBid.objects.all(), ArchivedListing.objects.all(), user, [bid for bid in archived if bid["id"] in kept]),
+    }
+    return KeysetPage([summaries[bid["id"]] for bid in latest], next_cursor)
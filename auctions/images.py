@@ -0,0 +1,337 @@
+import hashlib
+import http.client
+import io
+import ipaddress
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+import urllib.parse
+import urllib.request
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core import checks
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+
+from .cache import invalidate_listing
+from .models import Listing
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Name -> the box a thumbnail is scaled down to fit in
+THUMBNAIL_SIZES = {
+    "card": (400, 300),
+    "detail": (1000, 750),
+}
+
+# Without Pillow nothing can be resized: the original is stored once, under
+# this name, and served for every size
+ORIGINAL = "original"
+
+# File signatures of the formats stored as-is when Pillow is not installed
+SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"RIFF", "image/webp"),
+]
+
+_executor = None
+_executor_lock = threading.Lock()
+_last_eviction = 0
+
+
+class ImageError(Exception):
+    pass
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def store_dir():
+    return _setting("IMAGE_STORE_DIR", os.path.join(settings.BASE_DIR, "image_store"))
+
+
+def thumbnail_path(digest, size):
+    # Content addressed: the name is the hash of the original, so a file never
+    # changes once written and can be cached forever
+    if Image is None:
+        size = ORIGINAL
+    return os.path.join(store_dir(), digest[:2], f"{digest}-{size}")
+
+
+def content_type(path):
+    with open(path, "rb") as image:
+        head = image.read(12)
+    for signature, mime in SIGNATURES:
+        if head.startswith(signature):
+            return mime
+    return "application/octet-stream"
+
+
+def _is_public(address):
+    return address.is_global
+
+
+def _connect_public(address, timeout, source_address=None):
+    # Image URLs come from users, so the server must not be made to fetch from
+    # itself or its network: every address the host resolves to has to be a
+    # public one, and the connection goes to the address that was checked
+    host, port = address
+    try:
+        resolved = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as error:
+        raise ImageError(f"Could not resolve {host}: {error}")
+    for family, kind, proto, canonname, sockaddr in resolved:
+        if not _is_public(ipaddress.ip_address(sockaddr[0].split("%")[0])):
+            raise ImageError(f"Refusing to fetch from {host}: {sockaddr[0]} is not a public address")
+    error = None
+    for family, kind, proto, canonname, sockaddr in resolved:
+        try:
+            return socket.create_connection(sockaddr[:2], timeout, source_address)
+        except OSError as failure:
+            error = failure
+    raise error
+
+
+class _PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, request):
+        return self.do_open(_PublicHTTPConnection, request)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, request):
+        return self.do_open(_PublicHTTPSConnection, request, context=self._context)
+
+
+def _opener():
+    # Only http and https, no proxies from the environment; redirects go through
+    # the same handlers, so where they lead is checked too
+    opener = urllib.request.OpenerDirector()
+    for handler in [_PublicHTTPHandler(), _PublicHTTPSHandler(), urllib.request.HTTPRedirectHandler(),
+                    urllib.request.HTTPDefaultErrorHandler(), urllib.request.HTTPErrorProcessor()]:
+        opener.add_handler(handler)
+    return opener
+
+
+def fetch_url(url):
+    """Download an image, refusing anything slow or larger than IMAGE_MAX_BYTES.
+
+    Only http and https URLs on public addresses are fetched, after redirects too.
+    """
+    if urllib.parse.urlsplit(url).scheme not in ("http", "https"):
+        raise ImageError(f"Could not fetch {url}: only http and https URLs are allowed")
+    limit = _setting("IMAGE_MAX_BYTES", 10 * 2 ** 20)
+    request = urllib.request.Request(url, headers={"User-Agent": "commerce-image-fetcher"})
+    try:
+        with _opener().open(request, timeout=_setting("IMAGE_FETCH_TIMEOUT", 5)) as response:
+            data = response.read(limit + 1)
+    except (OSError, ValueError) as error:
+        raise ImageError(f"Could not fetch {url}: {error}")
+    if len(data) > limit:
+        raise ImageError(f"{url} is larger than {limit} bytes")
+    return data
+
+
+def placeholder_png(width, height, color):
+    """A solid-colour PNG, built without Pillow."""
+    row = b"\x00" + bytes(color) * width
+    pixels = zlib.compress(row * height)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", pixels) + chunk(b"IEND", b"")
+
+
+def stub_fetch(url):
+    """A fetcher for tests: a small PNG whose colour depends on the URL, no network."""
+    if "missing" in url:
+        raise ImageError(f"Could not fetch {url}")
+    return placeholder_png(8, 6, hashlib.sha256(url.encode()).digest()[:3])
+
+
+def make_thumbnails(data):
+    """Map each thumbnail size to the bytes to store for it.
+
+    Without Pillow only the original is stored, once, as long as it is a
+    recognised image format, so pages still load it from here.
+    """
+    if Image is None:
+        if not any(data.startswith(signature) for signature, mime in SIGNATURES):
+            raise ImageError("Not a recognised image format")
+        return {ORIGINAL: data}
+    try:
+        original = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+        original = original.convert("RGB")
+    except Exception as error:
+        raise ImageError(f"Not a readable image: {error}")
+    thumbnails = {}
+    for size, box in THUMBNAIL_SIZES.items():
+        thumbnail = original.copy()
+        thumbnail.thumbnail(box)
+        output = io.BytesIO()
+        thumbnail.save(output, "JPEG", quality=85, optimize=True)
+        thumbnails[size] = output.getvalue()
+    return thumbnails
+
+
+@checks.register()
+def check_pillow(app_configs, **kwargs):
+    if Image is None:
+        return [checks.Warning(
+            "Pillow is not installed, so listing images are stored and served at full size.",
+            hint="pip install Pillow to store fixed-size thumbnails.",
+            id="auctions.W001",
+        )]
+    return []
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename, so a reader never sees half a file
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary, "wb") as output:
+        output.write(data)
+    os.replace(temporary, path)
+
+
+def _stored(digest):
+    return all(os.path.exists(thumbnail_path(digest, size)) for size in THUMBNAIL_SIZES)
+
+
+def store_image(url):
+    """Fetch an image and store its thumbnails. Returns the content digest.
+
+    A URL another listing already uses is not fetched again.
+    """
+    known = Listing.objects.filter(image=url).exclude(image_digest="").values_list("image_digest", flat=True).first()
+    if known and _stored(known):
+        return known
+    data = import_string(_setting("IMAGE_FETCHER", "auctions.images.fetch_url"))(url)
+    digest = hashlib.sha256(data).hexdigest()
+    if not _stored(digest):
+        for size, thumbnail in make_thumbnails(data).items():
+            _write(thumbnail_path(digest, size), thumbnail)
+        _maybe_evict()
+    return digest
+
+
+def refresh_listing_image(listing_id):
+    """Bring a listing's stored thumbnails in line with its image URL."""
+    url = Listing.objects.filter(pk=listing_id).values_list("image", flat=True).first()
+    if url is None:
+        return
+    digest = ""
+    if url:
+        try:
+            digest = store_image(url)
+        except ImageError as error:
+            logger.warning("Listing %s: %s", listing_id, error)
+    with transaction.atomic():
+        # Only if the URL is still the one that was fetched
+        if Listing.objects.filter(pk=listing_id, image=url).exclude(image_digest=digest).update(image_digest=digest):
+            invalidate_listing(listing_id)
+
+
+def _refresh_in_background(listing_id):
+    try:
+        refresh_listing_image(listing_id)
+    except Exception:
+        logger.exception("Listing %s: image refresh failed", listing_id)
+    finally:
+        connections.close_all()
+
+
+def schedule_refresh(listing_id):
+    """Refresh a listing's image once the current transaction commits.
+
+    With IMAGE_FETCH_ASYNC the fetch runs on a small thread pool, so a slow
+    image host never holds up the request that saved the listing.
+    """
+    def submit():
+        global _executor
+        if not _setting("IMAGE_FETCH_ASYNC", True):
+            refresh_listing_image(listing_id)
+            return
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=_setting("IMAGE_FETCH_WORKERS", 2), thread_name_prefix="image-fetch")
+        _executor.submit(_refresh_in_background, listing_id)
+
+    transaction.on_commit(submit)
+
+
+def evict(max_bytes=None):
+    """Delete the least recently used thumbnails until the store fits in max_bytes.
+
+    Eviction goes down to 90% of the limit so it does not run on every write.
+    Returns the number of files removed.
+    """
+    max_bytes = _setting("IMAGE_STORE_MAX_BYTES", 512 * 2 ** 20) if max_bytes is None else max_bytes
+    files = []
+    total = 0
+    for directory, subdirectories, names in os.walk(store_dir()):
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                status = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((status.st_mtime, status.st_size, path))
+            total += status.st_size
+    if total <= max_bytes:
+        return 0
+    removed = 0
+    for mtime, size, path in sorted(files):
+        if total <= max_bytes * 0.9:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+def _maybe_evict():
+    # Walking the store costs a stat per file, so do it at most once a minute
+    global _last_eviction
+    if time.monotonic() - _last_eviction > 60:
+        _last_eviction = time.monotonic()
+        evict()
+
+
+def touch(path):
+    """Mark a thumbnail as used, for eviction; at most once an hour per file."""
+    try:
+        if time.time() - os.stat(path).st_mtime > 3600:
+            os.utime(path)
+    except OSError:
+        pass
@@ -0,0 +1,32 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from auctions import archive
+
+
+class Command(BaseCommand):
+    help = "Move closed auctions past the retention window, with their bids, comments and watchlists, to the archive tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=float, help="Archive listings that ended longer ago than this (default ARCHIVE_AFTER_DAYS)")
+        parser.add_argument("--batch-size", type=int, default=500, help="Listings moved per transaction")
+        parser.add_argument("--limit", type=int, help="Stop after this many listings; the next run carries on")
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be moved")
+
+    def handle(self, *args, **options):
+        after = timedelta(days=options["days"]) if options["days"] is not None else None
+        if options["dry_run"]:
+            counts = archive.plan(after=after)
+            self.stdout.write("Would archive " + ", ".join(f"{count} {kind}" for kind, count in counts.items()))
+            return
+
+        began = time.perf_counter()
+        totals = {}
+        for moved in archive.archive_batches(options["batch_size"], options["limit"], after=after):
+            for kind, count in moved.items():
+                totals[kind] = totals.get(kind, 0) + count
+            self.stdout.write(f"Archived {moved['listings']} listing(s), {totals['listings']} so far")
+        summary = ", ".join(f"{count} {kind}" for kind, count in totals.items()) or "nothing"
+        self.stdout.write(f"Archived {summary} in {time.perf_counter() - began:.2f}s")
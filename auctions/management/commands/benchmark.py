@@ -0,0 +1,61 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from auctions.benchmarks import data, runner
+from auctions.models import User
+
+
+class Command(BaseCommand):
+    help = "Generate a data set in a scratch database and benchmark the main views"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--listings", type=int, default=1000, help="Number of listings to generate (bids, comments and users scale with it)")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario")
+        parser.add_argument("--scenario", action="append", dest="scenarios", help="Only run this scenario (repeatable)")
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+        parser.add_argument("--baseline", help="Compare against the JSON results of an earlier run")
+        parser.add_argument("--threshold", type=float, default=1.2, help="Allowed p95 growth factor against the baseline")
+        parser.add_argument("--keepdb", action="store_true", help="Keep the scratch database between runs")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        # Never touch the real database: benchmark in a throwaway test database
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options["keepdb"])
+        try:
+            results = self.benchmark(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+
+        for name, figures in results["scenarios"].items():
+            self.stdout.write(
+                f"{name:16} p50 {figures['p50_ms']:7.2f} ms  p95 {figures['p95_ms']:7.2f} ms  p99 {figures['p99_ms']:7.2f} ms  "
+                f"{figures['queries_per_request']:5.1f} queries  {figures['requests_per_second']:7.1f} req/s"
+            )
+        if options["output"]:
+            runner.save(results, options["output"])
+        if options["baseline"]:
+            regressions = runner.compare(results, runner.load(options["baseline"]), options["threshold"])
+            if regressions:
+                raise CommandError("Regressions against the baseline:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
+
+    def benchmark(self, options):
+        began = time.perf_counter()
+        dataset = data.generate(listings=options["listings"], seed=options["seed"])
+        self.stdout.write(f"Generated {options['listings']} listings in {time.perf_counter() - began:.1f}s")
+
+        scenarios = runner.default_scenarios(dataset, seed=options["seed"])
+        if options["scenarios"]:
+            unknown = set(options["scenarios"]) - {scenario.name for scenario in scenarios}
+            if unknown:
+                raise CommandError(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+            scenarios = [scenario for scenario in scenarios if scenario.name in options["scenarios"]]
+
+        user = User.objects.get(pk=dataset.users[0])
+        return runner.run(scenarios, options["requests"], user, meta={"listings": options["listings"], "seed": options["seed"]})
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from auctions.expiry import close_expired_listings
+
+
+class Command(BaseCommand):
+    help = "Close auctions whose end time has passed and record their winners"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Listings closed per transaction")
+        parser.add_argument("--loop", action="store_true", help="Keep running, checking every --interval seconds")
+        parser.add_argument("--interval", type=float, default=30, help="Seconds between checks with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            began = time.perf_counter()
+            closed = close_expired_listings(batch_size=options["batch_size"])
+            if closed or not options["loop"]:
+                self.stdout.write(f"Closed {closed} listing(s) in {time.perf_counter() - began:.2f}s")
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
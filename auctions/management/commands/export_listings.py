@@ -0,0 +1,23 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from auctions.transfer import EXPORTS, FORMATS, export_rows
+
+
+class Command(BaseCommand):
+    help = "Write every listing or bid as CSV or JSON Lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(EXPORTS))
+        parser.add_argument("--format", choices=FORMATS, default="csv")
+        parser.add_argument("--output", help="File to write; defaults to standard output")
+
+    def handle(self, *args, **options):
+        output = open(options["output"], "w", newline="", encoding="utf-8") if options["output"] else sys.stdout
+        try:
+            for line in export_rows(options["kind"], options["format"]):
+                output.write(line)
+        finally:
+            if options["output"]:
+                output.close()
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from auctions.images import evict, refresh_listing_image
+from auctions.models import Listing
+
+
+class Command(BaseCommand):
+    help = "Fetch and thumbnail the images of listings that have none stored, and trim the image store"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Refresh every listing with an image, not only missing ones")
+        parser.add_argument("--evict-only", action="store_true", help="Only trim the store to IMAGE_STORE_MAX_BYTES")
+
+    def handle(self, *args, **options):
+        if not options["evict_only"]:
+            listings = Listing.objects.exclude(image="")
+            if not options["all"]:
+                # Imported listings skip the save signal, and failed fetches are retried
+                listings = listings.filter(image_digest="")
+            count = 0
+            for listing_id in listings.order_by("id").values_list("id", flat=True).iterator():
+                refresh_listing_image(listing_id)
+                count += 1
+            self.stdout.write(f"Refreshed the images of {count} listing(s)")
+        self.stdout.write(f"Evicted {evict()} thumbnail(s)")
@@ -0,0 +1,42 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from auctions.models import User
+from auctions.transfer import FORMATS, format_of, import_listings, read_rows
+
+
+class Command(BaseCommand):
+    help = "Create listings from a CSV or JSON Lines file, validated like the create listing form"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import, or - for standard input")
+        parser.add_argument("--seller", required=True, help="Username the listings are created under")
+        parser.add_argument("--format", choices=FORMATS, help="Defaults to a guess from the file name")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Rows validated and inserted per transaction")
+        parser.add_argument("--dry-run", action="store_true", help="Only validate; create nothing")
+
+    def handle(self, *args, **options):
+        try:
+            seller = User.objects.get(username=options["seller"])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['seller']!r}")
+        format = options["format"] or format_of(options["path"])
+
+        began = time.perf_counter()
+        if options["path"] == "-":
+            report = import_listings(read_rows(sys.stdin, format), seller, options["chunk_size"], options["dry_run"])
+        else:
+            with open(options["path"], encoding="utf-8-sig", newline="") as stream:
+                report = import_listings(read_rows(stream, format), seller, options["chunk_size"], options["dry_run"])
+
+        for line_number, errors in report.errors:
+            for field, messages in errors.items():
+                self.stderr.write(f"line {line_number}: {field}: {' '.join(messages)}")
+        if len(report.errors) < report.error_count:
+            self.stderr.write(f"... and {report.error_count - len(report.errors)} more row(s) with errors")
+        verb = "Validated" if options["dry_run"] else "Created"
+        self.stdout.write(f"{verb} {report.created} listing(s), {report.error_count} row(s) with errors, in {time.perf_counter() - began:.1f}s")
+        if report.unreadable:
+            raise CommandError(f"Stopped reading {options['path']}: {report.unreadable}")
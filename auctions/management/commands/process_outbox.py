@@ -0,0 +1,46 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from auctions import outbox
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Send the notifications for bids and closed auctions recorded in the outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Events delivered per batch")
+        parser.add_argument("--loop", action="store_true", help="Keep running, checking every --interval seconds once drained")
+        parser.add_argument("--interval", type=float, default=2, help="Seconds between checks with --loop")
+        parser.add_argument("--keep-days", type=float, default=7, help="Delete events processed longer ago than this")
+
+    def handle(self, *args, **options):
+        while True:
+            began = time.perf_counter()
+            events = notifications = 0
+            try:
+                while True:
+                    batch_events, batch_notifications = outbox.process_batch(options["batch_size"])
+                    if not batch_events:
+                        break
+                    events += batch_events
+                    notifications += batch_notifications
+            except Exception:
+                if not options["loop"]:
+                    raise
+                # The failed batch stays in the outbox and is tried again
+                logger.exception("Delivering notifications failed")
+            if events or not options["loop"]:
+                elapsed = time.perf_counter() - began
+                self.stdout.write(
+                    f"Processed {events} event(s) into {notifications} notification(s) in {elapsed:.2f}s "
+                    f"({events / elapsed:.0f} events/s); backlog {outbox.metrics()['backlog']}"
+                )
+                outbox.prune(timedelta(days=options["keep_days"]))
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from auctions.stats import rebuild_category_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute the category stats from the listings table and report any drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true", help="Only report drift, exiting with an error if there is any")
+
+    def handle(self, *args, **options):
+        drifted = rebuild_category_stats(fix=not options["check"])
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS("Category stats are consistent"))
+        elif options["check"]:
+            raise CommandError(f"Category stats have drifted for: {', '.join(drifted)}")
+        else:
+            self.stdout.write(self.style.WARNING(f"Rebuilt drifted category stats for: {', '.join(drifted)}"))
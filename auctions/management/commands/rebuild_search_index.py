@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from auctions.search import install_search_index, rebuild_search_index, search_supported
+
+
+class Command(BaseCommand):
+    help = "Rebuild the listing full-text search index from the listings table"
+
+    def handle(self, *args, **options):
+        if not search_supported():
+            raise CommandError("Full-text search needs SQLite with FTS5")
+
+        install_search_index(connection)
+        rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt"))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from auctions.trending import refresh
+
+
+class Command(BaseCommand):
+    help = "Rank listings by their decayed activity and store the top ones of each category"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, help="Listings kept per category (default TRENDING_SIZE)")
+        parser.add_argument("--loop", action="store_true", help="Keep running, refreshing every --interval seconds")
+        parser.add_argument("--interval", type=float, default=60, help="Seconds between refreshes with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            began = time.perf_counter()
+            ranked = refresh(size=options["size"])
+            self.stdout.write(f"Ranked {ranked} listing(s) in {time.perf_counter() - began:.2f}s")
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
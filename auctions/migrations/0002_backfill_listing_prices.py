@@ -0,0 +1,30 @@
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_listing_prices(apps, schema_editor):
+    # The index page used to recompute these on every request; store them once
+    # so they can be maintained when bids are placed instead
+    Listing = apps.get_model('auctions', 'Listing')
+    Bid = apps.get_model('auctions', 'Bid')
+
+    last_bid = Bid.objects.filter(listing=OuterRef('pk')).order_by('-id')
+    bid_count = Bid.objects.filter(listing=OuterRef('pk')).order_by().values('listing').annotate(count=Count('id')).values('count')
+
+    Listing.objects.update(
+        current_price=Coalesce(Subquery(last_bid.values('price')[:1]), 'starting_price'),
+        current_bidder=Subquery(last_bid.values('user')[:1]),
+        number_of_bids=Coalesce(Subquery(bid_count), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_listing_prices, migrations.RunPython.noop),
+    ]
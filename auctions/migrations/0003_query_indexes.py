@@ -0,0 +1,48 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:08
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_watchlists(apps, schema_editor):
+    # Keep the most recent row for each (user, listing) pair so the unique
+    # constraint can be added
+    Watchlist = apps.get_model('auctions', 'Watchlist')
+    duplicates = Watchlist.objects.values('user', 'listing').annotate(rows=Count('id'), keep=Max('id')).filter(rows__gt=1).order_by()
+    for duplicate in duplicates:
+        Watchlist.objects.filter(user=duplicate['user'], listing=duplicate['listing']).exclude(id=duplicate['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0002_backfill_listing_prices'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bid',
+            index=models.Index(fields=['listing', '-price'], name='bid_listing_price'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['listing', 'created'], name='comment_listing_created'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('active', True)), fields=['created'], name='listing_active_created'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('active', True)), fields=['category', 'created'], name='listing_category_active'),
+        ),
+        migrations.AddIndex(
+            model_name='watchlist',
+            index=models.Index(condition=models.Q(('active', True)), fields=['user'], name='watchlist_user_active'),
+        ),
+        migrations.RunPython(remove_duplicate_watchlists, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='watchlist',
+            constraint=models.UniqueConstraint(fields=('user', 'listing'), name='unique_watchlist'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:14
+
+import auctions.models
+from django.db import migrations, models
+
+
+def end_closed_listings(apps, schema_editor):
+    # The default puts every existing row a week in the future, which would
+    # tell closed listings they have time left; end them when they were created
+    Listing = apps.get_model('auctions', 'Listing')
+    Listing.objects.filter(active=False).update(ends_at=models.F('created'))
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0004_listing_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='ends_at',
+            field=models.DateTimeField(default=auctions.models.default_end_time),
+        ),
+        migrations.RunPython(end_closed_listings, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('active', True)), fields=['ends_at'], name='listing_active_ends_at'),
+        ),
+    ]
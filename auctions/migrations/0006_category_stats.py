@@ -0,0 +1,49 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Max, Min
+
+
+def populate_category_stats(apps, schema_editor):
+    Listing = apps.get_model('auctions', 'Listing')
+    CategoryStats = apps.get_model('auctions', 'CategoryStats')
+
+    figures = {
+        row.pop('category'): row
+        for row in Listing.objects.filter(active=True).values('category').annotate(
+            active_count=Count('id'), min_price=Min('current_price'), max_price=Max('current_price')
+        ).order_by()
+    }
+    for code, name in Listing._meta.get_field('category').choices:
+        latest = Listing.objects.filter(category=code, active=True).order_by('-created', '-id').values_list('id', flat=True).first()
+        CategoryStats.objects.create(category=code, latest_listing_id=latest, **figures.get(code, {}))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0005_listing_ends_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryStats',
+            fields=[
+                ('category', models.CharField(choices=[('COL', 'Collectibles'), ('BOK', 'Books'), ('ELE', 'Electronics'), ('FAS', 'Fashion'), ('HOM', 'Home and Garden'), ('AUT', 'Auto parts'), ('MUS', 'Musical instruments'), ('SPO', 'Sporting goods'), ('TOY', 'Toys and Hobbies'), ('OTH', 'Other')], max_length=3, primary_key=True, serialize=False)),
+                ('active_count', models.IntegerField(default=0)),
+                ('min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=19, null=True)),
+                ('max_price', models.DecimalField(blank=True, decimal_places=2, max_digits=19, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('active', True)), fields=['category', 'current_price'], name='listing_category_price'),
+        ),
+        migrations.AddField(
+            model_name='categorystats',
+            name='latest_listing',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='auctions.listing'),
+        ),
+        migrations.RunPython(populate_category_stats, migrations.RunPython.noop),
+    ]
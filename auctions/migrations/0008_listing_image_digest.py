@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+# Listings without an image used to store this hotlinked URL; they now store
+# nothing and show the local placeholder instead
+OLD_PLACEHOLDER = 'https://sisterhoodofstyle.com/wp-content/uploads/2018/02/no-image-1.jpg'
+
+
+def clear_placeholder_urls(apps, schema_editor):
+    Listing = apps.get_model('auctions', 'Listing')
+    Listing.objects.filter(image=OLD_PLACEHOLDER).update(image='')
+
+
+def restore_placeholder_urls(apps, schema_editor):
+    Listing = apps.get_model('auctions', 'Listing')
+    Listing.objects.filter(image='').update(image=OLD_PLACEHOLDER)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0007_category_pages'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='image_digest',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.RunPython(clear_placeholder_urls, restore_placeholder_urls),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:58
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def dates_to_datetimes(apps, schema_editor):
+    # PostgreSQL casts the column itself; SQLite keeps the stored text, which
+    # must gain a time to be read back as a datetime. Old comments get midnight
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("UPDATE auctions_comment SET created = created || ' 00:00:00' WHERE length(created) = 10")
+
+
+def datetimes_to_dates(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("UPDATE auctions_comment SET created = substr(created, 1, 10)")
+
+
+def count_comments(apps, schema_editor):
+    Listing = apps.get_model('auctions', 'Listing')
+    Comment = apps.get_model('auctions', 'Comment')
+    counts = Comment.objects.filter(listing=OuterRef('pk')).order_by().values('listing').annotate(count=Count('id')).values('count')
+    Listing.objects.update(comment_count=Coalesce(Subquery(counts, output_field=IntegerField()), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0010_event_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='comment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_comments, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='comment',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.RunPython(dates_to_datetimes, datetimes_to_dates),
+    ]
@@ -0,0 +1,114 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0013_listing_created'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedBid',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('created', models.DateTimeField()),
+                ('price', models.DecimalField(decimal_places=2, max_digits=19)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedComment',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('text_comment', models.TextField()),
+                ('created', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedListing',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=512)),
+                ('description', models.TextField(blank=True)),
+                ('created', models.DateTimeField()),
+                ('image', models.URLField(blank=True)),
+                ('image_digest', models.CharField(blank=True, default='', max_length=64)),
+                ('starting_price', models.DecimalField(decimal_places=2, max_digits=19)),
+                ('current_price', models.DecimalField(blank=True, decimal_places=2, max_digits=19, null=True)),
+                ('number_of_bids', models.IntegerField(blank=True, default=0, null=True)),
+                ('ends_at', models.DateTimeField()),
+                ('comment_count', models.IntegerField(default=0)),
+                ('category', models.CharField(choices=[('COL', 'Collectibles'), ('BOK', 'Books'), ('ELE', 'Electronics'), ('FAS', 'Fashion'), ('HOM', 'Home and Garden'), ('AUT', 'Auto parts'), ('MUS', 'Musical instruments'), ('SPO', 'Sporting goods'), ('TOY', 'Toys and Hobbies'), ('OTH', 'Other')], default='OTH', max_length=3)),
+                ('archived', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedWatchlist',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('active', models.BooleanField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('active', False)), fields=['ends_at', 'id'], name='listing_closed_ends_at'),
+        ),
+        migrations.AddField(
+            model_name='archivedwatchlist',
+            name='listing',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='watchlisted', to='auctions.archivedlisting'),
+        ),
+        migrations.AddField(
+            model_name='archivedwatchlist',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_watchlist', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='archivedlisting',
+            name='current_bidder',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='archivedlisting',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_listings', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='archivedlisting',
+            name='winner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_winnings', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='archivedcomment',
+            name='listing',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='comments', to='auctions.archivedlisting'),
+        ),
+        migrations.AddField(
+            model_name='archivedcomment',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_comments', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='archivedbid',
+            name='listing',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='bids', to='auctions.archivedlisting'),
+        ),
+        migrations.AddField(
+            model_name='archivedbid',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_bids', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='archivedcomment',
+            index=models.Index(fields=['listing', 'created'], name='archived_comment_listing'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedbid',
+            index=models.Index(fields=['listing', 'created', 'id'], name='archived_bid_listing'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0014_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('listing', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='auctions.listing')),
+                ('score', models.FloatField(default=0)),
+                ('period', models.IntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrendingListing',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(blank=True, choices=[('COL', 'Collectibles'), ('BOK', 'Books'), ('ELE', 'Electronics'), ('FAS', 'Fashion'), ('HOM', 'Home and Garden'), ('AUT', 'Auto parts'), ('MUS', 'Musical instruments'), ('SPO', 'Sporting goods'), ('TOY', 'Toys and Hobbies'), ('OTH', 'Other')], max_length=3)),
+                ('position', models.IntegerField()),
+                ('score', models.FloatField()),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='auctions.listing')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='trendinglisting',
+            constraint=models.UniqueConstraint(fields=('category', 'position'), name='unique_trending_position'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0015_trending'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('image_digest', ''), _negated=True), fields=['image'], name='listing_fetched_image'),
+        ),
+    ]
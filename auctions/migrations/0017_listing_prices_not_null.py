@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 21:05
+
+from django.db import migrations, models
+
+
+def fill_missing_prices(apps, schema_editor):
+    # Listings without a bid price or count open at the starting price
+    Listing = apps.get_model('auctions', 'Listing')
+    Listing.objects.filter(current_price__isnull=True).update(current_price=models.F('starting_price'))
+    Listing.objects.filter(number_of_bids__isnull=True).update(number_of_bids=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0016_listing_fetched_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_missing_prices, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='listing',
+            name='current_price',
+            field=models.DecimalField(decimal_places=2, max_digits=19),
+        ),
+        migrations.AlterField(
+            model_name='listing',
+            name='number_of_bids',
+            field=models.IntegerField(default=0),
+        ),
+    ]
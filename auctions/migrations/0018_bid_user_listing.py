@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 21:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0017_listing_prices_not_null'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bid',
+            index=models.Index(fields=['user', 'listing', 'id', 'price'], name='bid_user_listing'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 23:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0018_bid_user_listing'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedbid',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_bids', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='archivedbid',
+            index=models.Index(fields=['user', 'created', 'id', 'listing', 'price'], name='archived_bid_user_created'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedbid',
+            index=models.Index(fields=['user', 'listing', 'id', 'price'], name='archived_bid_user_listing'),
+        ),
+    ]
@@ -1,5 +1,14 @@
+from datetime import timedelta
+
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
+
+AUCTION_DURATION = timedelta(days=7)
+
+
+def default_end_time():
+    return timezone.now() + AUCTION_DURATION
 
 
 class User(AbstractUser):
@@ -13,12 +22,18 @@ class Listing(models.Model):
     description = models.TextField(blank=True)
     created = models.DateTimeField(auto_now_add=True, editable=False)
     image = models.URLField(max_length=200, blank=True)
+    # sha256 of the image fetched from the URL; names its thumbnails (see auctions.images)
+    image_digest = models.CharField(max_length=64, blank=True, default="")
     active = models.BooleanField()
     starting_price = models.DecimalField(max_digits=19, decimal_places=2)
     winner = models.ForeignKey(User,on_delete=models.CASCADE,related_name="my_winnings",null=True,blank=True)
-    current_price = models.DecimalField(max_digits=19, decimal_places=2,null=True,blank=True)
-    number_of_bids = models.IntegerField(null=True,blank=True, default=0)
+    # Never NULL, so keyset pages sorted by them can seek the index (see auctions.pagination)
+    current_price = models.DecimalField(max_digits=19, decimal_places=2)
+    number_of_bids = models.IntegerField(default=0)
     current_bidder = models.ForeignKey(User, on_delete=models.CASCADE, related_name="my_current_bids",null=True,blank=True)
+    ends_at = models.DateTimeField(default=default_end_time)
+    # Kept in step with the comments table by auctions.signals
+    comment_count = models.IntegerField(default=0)
 
     CATEGORY_CHOICES = [
     ("COL", 'Collectibles'),
@@ -38,6 +53,23 @@ class Listing(models.Model):
         default="OTH",
     )
 
+    class Meta:
+        # Partial indexes over the active rows: SQLite renders filter(active=True)
+        # as a bare boolean term, which can match an index condition but not an
+        # (active, ...) index prefix. They also stay small as closed listings pile up
+        indexes = [
+            models.Index(fields=["created"], condition=models.Q(active=True), name="listing_active_created"),
+            models.Index(fields=["category", "created"], condition=models.Q(active=True), name="listing_category_active"),
+            models.Index(fields=["ends_at"], condition=models.Q(active=True), name="listing_active_ends_at"),
+            models.Index(fields=["category", "current_price"], condition=models.Q(active=True), name="listing_category_price"),
+            models.Index(fields=["category", "number_of_bids"], condition=models.Q(active=True), name="listing_category_bids"),
+            # For the admin's date hierarchy, which spans closed listings too
+            models.Index(fields=["created"], name="listing_created"),
+            # Closed listings in the order auctions.archive moves them out
+            models.Index(fields=["ends_at", "id"], condition=models.Q(active=False), name="listing_closed_ends_at"),
+            # Image URLs already fetched, which auctions.images does not fetch again
+            models.Index(fields=["image"], condition=~models.Q(image_digest=""), name="listing_fetched_image"),
+        ]
 
     def __str__(self):
         return f"{self.id}: {self.title}, {self.category}, {self.active}"
@@ -49,16 +81,54 @@ class Bid(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="my_bids")
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name="bids")
 
+    class Meta:
+        # SQLite has no INCLUDE, so the history indexes list every column the
+        # history pages read and are answered without touching the table
+        indexes = [
+            models.Index(fields=["listing", "-price"], name="bid_listing_price"),
+            models.Index(fields=["listing", "created", "id", "user", "price"], name="bid_listing_created"),
+            models.Index(fields=["user", "created", "id", "listing", "price"], name="bid_user_created"),
+            # A user's bids per listing, for the my bids page (see auctions.history)
+            models.Index(fields=["user", "listing", "id", "price"], name="bid_user_listing"),
+        ]
+
     def __str__(self):
         return f"{self.user}: {self.listing}, {self.price}, {self.created}"
 
 
+class ProxyBid(models.Model):
+    # A hidden maximum the bidding engine bids up to on the user's behalf (see
+    # auctions.bidding.place_proxy_bid)
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name="proxies")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="my_proxy_bids")
+    maximum = models.DecimalField(max_digits=19, decimal_places=2)
+    # When the maximum was last raised; of two equal maxima the earlier one wins
+    placed = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["listing", "user"], name="unique_proxy_bid"),
+        ]
+        indexes = [
+            # The leading proxies of a listing are a seek to the start of this index
+            models.Index(fields=["listing", "-maximum", "placed", "id"], name="proxy_listing_maximum"),
+        ]
+
+    def __str__(self):
+        return f"{self.user}: {self.listing}, up to {self.maximum}"
+
+
 class Comment(models.Model):
     text_comment = models.TextField()
-    created = models.DateField(auto_now_add=True, editable=False)
+    created = models.DateTimeField(auto_now_add=True, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="my_comments")
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name="comments")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["listing", "created"], name="comment_listing_created"),
+        ]
+
     def __str__(self):
         return f"{self.user}: {self.listing}, {self.text_comment}, {self.created}"
 
@@ -67,5 +137,153 @@ class Watchlist(models.Model):
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name="watchlisted")
     active = models.BooleanField()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "listing"], name="unique_watchlist"),
+        ]
+        indexes = [
+            models.Index(fields=["user"], condition=models.Q(active=True), name="watchlist_user_active"),
+        ]
+
+    def __str__(self):
+        return f"{self.user}: {self.listing}"
+
+
+class Event(models.Model):
+    # Outbox: written in the same transaction as the bid or close it records,
+    # then drained by the process_outbox command (see auctions.outbox)
+    BID = "bid"
+    CLOSED = "closed"
+    KIND_CHOICES = [
+        (BID, "Bid placed"),
+        (CLOSED, "Listing closed"),
+    ]
+    kind = models.CharField(max_length=6, choices=KIND_CHOICES)
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name="+")
+    bid = models.ForeignKey(Bid, on_delete=models.CASCADE, related_name="+", null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True, editable=False)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["id"], condition=models.Q(processed_at__isnull=True), name="event_pending"),
+            models.Index(fields=["processed_at"], name="event_processed"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}: {self.listing_id}, {self.processed_at}"
+
+
+class CategoryStats(models.Model):
+    # One row per category, kept up to date as listings open, close, change
+    # category or get bids, so category pages never aggregate the listings table
+    category = models.CharField(max_length=3, choices=Listing.CATEGORY_CHOICES, primary_key=True)
+    active_count = models.IntegerField(default=0)
+    min_price = models.DecimalField(max_digits=19, decimal_places=2, null=True, blank=True)
+    max_price = models.DecimalField(max_digits=19, decimal_places=2, null=True, blank=True)
+    latest_listing = models.ForeignKey(Listing, on_delete=models.SET_NULL, related_name="+", null=True, blank=True)
+    # Last time anything shown on the category's pages changed; drives ETag/Last-Modified
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.category}: {self.active_count}"
+
+
+class ArchivedListing(models.Model):
+    # Closed listings moved out of the hot tables by auctions.archive. Rows keep
+    # their ids, so links to them keep working
+    id = models.IntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="archived_listings")
+    title = models.CharField(max_length=512)
+    description = models.TextField(blank=True)
+    created = models.DateTimeField()
+    image = models.URLField(max_length=200, blank=True)
+    image_digest = models.CharField(max_length=64, blank=True, default="")
+    starting_price = models.DecimalField(max_digits=19, decimal_places=2)
+    winner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="archived_winnings", null=True, blank=True)
+    current_price = models.DecimalField(max_digits=19, decimal_places=2, null=True, blank=True)
+    number_of_bids = models.IntegerField(null=True, blank=True, default=0)
+    current_bidder = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+", null=True, blank=True)
+    ends_at = models.DateTimeField()
+    comment_count = models.IntegerField(default=0)
+    category = models.CharField(max_length=3, choices=Listing.CATEGORY_CHOICES, default="OTH")
+    archived = models.DateTimeField(default=timezone.now)
+
+    # Only closed listings are archived
+    active = False
+
+    def __str__(self):
+        return f"{self.id}: {self.title}, {self.category}, archived"
+
+
+class ArchivedBid(models.Model):
+    id = models.IntegerField(primary_key=True)
+    created = models.DateTimeField()
+    price = models.DecimalField(max_digits=19, decimal_places=2)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="archived_bids", db_index=False)
+    listing = models.ForeignKey(ArchivedListing, on_delete=models.CASCADE, related_name="bids", db_index=False)
+
+    class Meta:
+        # The my bids page reads these alongside the live bids, the same way
+        indexes = [
+            models.Index(fields=["listing", "created", "id"], name="archived_bid_listing"),
+            models.Index(fields=["user", "created", "id", "listing", "price"], name="archived_bid_user_created"),
+            models.Index(fields=["user", "listing", "id", "price"], name="archived_bid_user_listing"),
+        ]
+
+    def __str__(self):
+        return f"{self.user}: {self.listing}, {self.price}, {self.created}"
+
+
+class ArchivedComment(models.Model):
+    id = models.IntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="archived_comments")
+    listing = models.ForeignKey(ArchivedListing, on_delete=models.CASCADE, related_name="comments", db_index=False)
+    text_comment = models.TextField()
+    created = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["listing", "created"], name="archived_comment_listing"),
+        ]
+
+    def __str__(self):
+        return f"{self.user}: {self.listing}, {self.text_comment}, {self.created}"
+
+
+class ArchivedWatchlist(models.Model):
+    id = models.IntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="archived_watchlist")
+    listing = models.ForeignKey(ArchivedListing, on_delete=models.CASCADE, related_name="watchlisted")
+    active = models.BooleanField()
+
+    def __str__(self):
+        return f"{self.user}: {self.listing}"
+
+
+class TrendingScore(models.Model):
+    # A listing's time-decayed activity, added to as it gets bids, watchers and
+    # comments (see auctions.trending)
+    listing = models.OneToOneField(Listing, on_delete=models.CASCADE, primary_key=True, related_name="+")
+    score = models.FloatField(default=0)
+    period = models.IntegerField()
+
+    def __str__(self):
+        return f"{self.listing_id}: {self.score} in period {self.period}"
+
+
+class TrendingListing(models.Model):
+    # The top listings of each category, and overall under a blank category, as
+    # of the last refresh_trending run
+    category = models.CharField(max_length=3, choices=Listing.CATEGORY_CHOICES, blank=True)
+    position = models.IntegerField()
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name="+")
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["category", "position"], name="unique_trending_position"),
+        ]
+
     def __str__(self):
-        return f"{self.user}: {self.listing}"
\ No newline at end of file
+        return f"{self.category or 'all'} #{self.position}: {self.listing_id}"
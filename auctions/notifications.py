@@ -0,0 +1,120 @@
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import OuterRef, Q, Subquery
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+from .models import Bid, Event, User, Watchlist
+
+# Kind -> (subject, body)
+MESSAGES = {
+    "outbid": (
+        "You have been outbid on {title}",
+        "Hi {name},\n\nSomeone bid ${price} on {title}. Bid again at {url}\n",
+    ),
+    "won": (
+        "You won {title}",
+        "Hi {name},\n\nYour bid of ${price} won the auction for {title}: {url}\n",
+    ),
+    "watched_bid": (
+        "New bid on {title}",
+        "Hi {name},\n\n{title}, on your watchlist, is now at ${price}: {url}\n",
+    ),
+    "watched_closed": (
+        "{title} has closed",
+        "Hi {name},\n\nThe auction for {title}, on your watchlist, has ended: {url}\n",
+    ),
+}
+
+
+class Notification:
+    def __init__(self, kind, user, listing, price=None):
+        self.kind = kind
+        self.user = user
+        self.listing = listing
+        self.price = price
+
+    def _format(self, template):
+        return template.format(
+            name=self.user.first_name or self.user.username,
+            title=self.listing.title,
+            price=self.price,
+            url=getattr(settings, "SITE_URL", "http://localhost:8000") + reverse("listing", args=[self.listing.id]),
+        )
+
+    @property
+    def subject(self):
+        return self._format(MESSAGES[self.kind][0])
+
+    @property
+    def body(self):
+        return self._format(MESSAGES[self.kind][1])
+
+    def __repr__(self):
+        return f"<Notification {self.kind} {self.user.id} {self.listing.id}>"
+
+
+def build_notifications(events):
+    """Turn a batch of events (with listing and bid loaded) into notifications.
+
+    Each user hears at most once per listing per batch, about its latest
+    state: being outbid, winning, or, for watchers, a new price or the close.
+    The query count is the same whatever the size of the batch.
+    """
+    bid_ids = [event.bid_id for event in events if event.kind == Event.BID]
+    # Bids on a listing only go up, so the bid just below this one was the one it
+    # beat; a proxy's answer can equal the bid it beats, so ties go by id
+    beaten = Bid.objects.filter(listing=OuterRef("listing")).filter(
+        Q(price__lt=OuterRef("price")) | Q(price=OuterRef("price"), id__lt=OuterRef("id"))
+    ).order_by("-price", "-id").values("user")[:1]
+    previous = dict(Bid.objects.filter(pk__in=bid_ids).annotate(previous_bidder=Subquery(beaten)).values_list("id", "previous_bidder")) if bid_ids else {}
+
+    pending = {}
+    latest = {}
+    for event in events:
+        listing = event.listing
+        latest[listing.id] = event
+        if event.kind == Event.BID:
+            loser = previous.get(event.bid_id)
+            # Someone outbid and back on top within the batch has nothing to hear
+            pending.pop((event.bid.user_id, listing.id), None)
+            if loser and loser != event.bid.user_id and loser != listing.current_bidder_id:
+                pending[(loser, listing.id)] = ("outbid", event.bid.price)
+        elif listing.winner_id:
+            pending[(listing.winner_id, listing.id)] = ("won", listing.current_price)
+
+    watchers = Watchlist.objects.filter(listing_id__in=list(latest), active=True).values_list("listing_id", "user_id")
+    for listing_id, user_id in watchers:
+        event = latest[listing_id]
+        if (user_id, listing_id) in pending:
+            continue
+        if event.kind == Event.CLOSED:
+            pending[(user_id, listing_id)] = ("watched_closed", None)
+        elif user_id != event.bid.user_id:
+            pending[(user_id, listing_id)] = ("watched_bid", event.bid.price)
+
+    users = User.objects.only("username", "email", "first_name").in_bulk({user_id for user_id, listing_id in pending})
+    return [
+        Notification(kind, users[user_id], latest[listing_id].listing, price)
+        for (user_id, listing_id), (kind, price) in pending.items()
+    ]
+
+
+class EmailBackend:
+    """Deliver notifications as email through Django's EMAIL_BACKEND.
+
+    The whole batch goes over one connection; an error is raised rather than
+    swallowed, so the worker leaves the batch to be sent again.
+    """
+
+    def send(self, notifications):
+        messages = [
+            EmailMessage(notification.subject, notification.body, to=[notification.user.email])
+            for notification in notifications if notification.user.email
+        ]
+        if messages:
+            get_connection(fail_silently=False).send_messages(messages)
+
+
+def get_backend():
+    return import_string(getattr(settings, "NOTIFICATION_BACKEND", "auctions.notifications.EmailBackend"))()
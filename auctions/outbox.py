@@ -0,0 +1,48 @@
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import Event
+from .notifications import build_notifications, get_backend
+
+
+def process_batch(batch_size=500, backend=None):
+    """Deliver the notifications for the oldest unprocessed events.
+
+    Returns the number of events and of notifications. Events are marked only
+    after delivery, so a crash in between sends the batch again rather than
+    losing it. Run a single worker: two would deliver the same events twice.
+    """
+    events = list(Event.objects.filter(processed_at__isnull=True).select_related("listing", "bid").order_by("id")[:batch_size])
+    if not events:
+        return 0, 0
+    notifications = build_notifications(events)
+    (backend or get_backend()).send(notifications)
+    Event.objects.filter(pk__in=[event.id for event in events]).update(processed_at=timezone.now())
+    return len(events), len(notifications)
+
+
+def prune(older_than=timedelta(days=7)):
+    """Delete events processed more than older_than ago. Returns how many."""
+    deleted, _ = Event.objects.filter(processed_at__lt=timezone.now() - older_than).delete()
+    return deleted
+
+
+def metrics(now=None):
+    """The backlog gauge and recent throughput, read from the events table.
+
+    Worked out from the table rather than kept by the worker, so any web
+    process can report them.
+    """
+    now = now or timezone.now()
+    pending = Event.objects.filter(processed_at__isnull=True)
+    oldest = pending.order_by("id").values_list("created", flat=True).first()
+    return {
+        "backlog": pending.count(),
+        "oldest_pending_seconds": round((now - oldest).total_seconds(), 3) if oldest else 0,
+        "processed_last_minute": Event.objects.filter(processed_at__gt=now - timedelta(minutes=1)).count(),
+    }
+
+
+def prometheus(values):
+    return "".join(f"# TYPE auctions_outbox_{name} gauge\nauctions_outbox_{name} {value}\n" for name, value in values.items())
@@ -0,0 +1,146 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import F, Max, Q
+from django.utils.functional import cached_property
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def encode_cursor(values):
+    # None (a NULL sort key) stays null so it cannot be mistaken for the text "None"
+    raw = json.dumps([None if value is None else str(value) for value in values]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """The values in a cursor, or None if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or not all(value is None or isinstance(value, str) for value in values):
+        return None
+    return values
+
+
+def _output_field(queryset, name):
+    # Ordering can be on a model field or an annotation such as Max("id")
+    if name in queryset.query.annotations:
+        return queryset.query.annotations[name].output_field
+    return queryset.model._meta.get_field(name)
+
+
+def _value(item, name):
+    return item[name] if isinstance(item, dict) else getattr(item, name)
+
+
+def _order_by(queryset, ordering):
+    # NULLs sort as the lowest value on every database, as SQLite does anyway,
+    # so the seek in _after knows where they are
+    expressions = []
+    for field_name in ordering:
+        name = field_name.lstrip("-")
+        if not _output_field(queryset, name).null:
+            expressions.append(field_name)
+        elif field_name.startswith("-"):
+            expressions.append(F(name).desc(nulls_last=True))
+        else:
+            expressions.append(F(name).asc(nulls_first=True))
+    return queryset.order_by(*expressions)
+
+
+def _after(queryset, ordering, values):
+    # Build "(a, b) > (x, y)" as "a > x OR (a = x AND b > y)" so the database
+    # can seek straight to the cursor in the index instead of counting an offset
+    condition = Q()
+    equal = Q()
+    for field_name, value in zip(ordering, values):
+        descending = field_name.startswith("-")
+        name = field_name.lstrip("-")
+        if value is None:
+            # Nothing sorts below NULL; above it are all the other values
+            if not descending:
+                condition |= equal & Q(**{f"{name}__isnull": False})
+            equal &= Q(**{f"{name}__isnull": True})
+            continue
+        value = _output_field(queryset, name).to_python(value)
+        after = Q(**{f"{name}__{'lt' if descending else 'gt'}": value})
+        if descending and _output_field(queryset, name).null:
+            after |= Q(**{f"{name}__isnull": True})
+        condition |= equal & after
+        equal &= Q(**{name: value})
+
+    # SQLite cannot seek the index on the OR alone, so the first column is also
+    # bounded by the cursor. A descending nullable column has its NULLs after
+    # every value and cannot be bounded; keep such sorts on NOT NULL columns
+    field_name, value = ordering[0], values[0]
+    descending = field_name.startswith("-")
+    name = field_name.lstrip("-")
+    if value is not None and not (descending and _output_field(queryset, name).null):
+        value = _output_field(queryset, name).to_python(value)
+        condition &= Q(**{f"{name}__{'lte' if descending else 'gte'}": value})
+    return condition
+
+
+def keyset_paginate(queryset, cursor=None, page_size=25, ordering=("-created", "-id")):
+    """One page of a queryset ordered by ordering, after the position in cursor.
+
+    Works on model querysets and on values() querysets, including ones ordered
+    by an aggregate; the ordering must end in a unique column. A cursor that
+    does not decode to a position in this ordering gives an empty page.
+    """
+    queryset = _order_by(queryset, ordering)
+
+    if cursor:
+        values = decode_cursor(cursor)
+        if values is None or len(values) != len(ordering):
+            return KeysetPage([], None)
+        try:
+            queryset = queryset.filter(_after(queryset, ordering, values))
+        except ValidationError:
+            return KeysetPage([], None)
+
+    # Fetch one extra row to know whether there is a next page without a COUNT(*)
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor([_value(last, field_name.lstrip("-")) for field_name in ordering])
+    return KeysetPage(items, next_cursor)
+
+
+class EstimatedCountPaginator(Paginator):
+    """A Paginator that never counts a whole table.
+
+    Without a filter the count is the highest primary key, a single seek at
+    the end of the table that overestimates by the rows deleted since. With
+    one the rows are counted up to count_limit, which the index the filter
+    uses keeps cheap, so pages past that limit are not linked.
+    """
+    count_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            return queryset.order_by().aggregate(highest=Max("pk"))["highest"] or 0
+        return queryset.order_by()[:self.count_limit].count()
@@ -0,0 +1,258 @@
+import cProfile
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+
+# Upper bounds of the cumulative buckets exported to Prometheus
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+METRICS = {
+    "wall_seconds": SECONDS_BUCKETS,
+    "db_seconds": SECONDS_BUCKETS,
+    "template_seconds": SECONDS_BUCKETS,
+    "queries": COUNT_BUCKETS,
+    "duplicate_queries": COUNT_BUCKETS,
+}
+
+# Requests the URL resolver could not match all share one entry
+UNRESOLVED = "<unresolved>"
+
+_current = contextvars.ContextVar("perf_timings", default=None)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class Histogram:
+    """Cumulative bucket counts since startup plus a window of recent values.
+
+    The buckets feed Prometheus; percentiles come from the window. Memory is
+    fixed by the number of buckets and the window size.
+    """
+
+    def __init__(self, buckets, window):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def percentile(self, fraction):
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": max(self.recent) if self.recent else None,
+        }
+
+
+class Registry:
+    """Histograms of every metric, per URL name."""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.views = {}
+        self.lock = threading.Lock()
+
+    def record(self, view, values):
+        with self.lock:
+            histograms = self.views.get(view)
+            if histograms is None:
+                histograms = self.views[view] = {name: Histogram(buckets, self.window) for name, buckets in METRICS.items()}
+            for name, value in values.items():
+                histograms[name].observe(value)
+
+    def wall_percentile(self, view, fraction, minimum=100):
+        """The view's recent wall time percentile, once it has enough samples."""
+        with self.lock:
+            histograms = self.views.get(view)
+            if histograms is None or len(histograms["wall_seconds"].recent) < minimum:
+                return None
+            return histograms["wall_seconds"].percentile(fraction)
+
+    def snapshot(self):
+        with self.lock:
+            return {view: {name: histogram.summary() for name, histogram in histograms.items()} for view, histograms in sorted(self.views.items())}
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            for name, buckets in METRICS.items():
+                metric = f"auctions_request_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                for view, histograms in sorted(self.views.items()):
+                    histogram = histograms[name]
+                    label = view.replace("\\", "\\\\").replace('"', '\\"')
+                    cumulative = 0
+                    for bound, count in zip(buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{metric}_bucket{{view="{label}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{metric}_bucket{{view="{label}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{metric}_sum{{view="{label}"}} {histogram.sum}')
+                    lines.append(f'{metric}_count{{view="{label}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+
+
+registry = Registry(window=_setting("PERF_WINDOW", 1000))
+
+
+class RequestTimings:
+    def __init__(self):
+        self.db_seconds = 0
+        self.template_seconds = 0
+        self.queries = 0
+        self.statements = set()
+        self.duplicate_queries = 0
+        self.template_depth = 0
+        self.profile = None
+
+    def execute(self, execute, sql, params, many, context):
+        # The same SQL text twice in one request is usually a query in a loop
+        if sql in self.statements:
+            self.duplicate_queries += 1
+        else:
+            self.statements.add(sql)
+        self.queries += 1
+        began = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - began
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None:
+            return super().render(context, request)
+        # Templates rendered from inside another one are already being timed
+        timings.template_depth += 1
+        began = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.template_depth -= 1
+            if not timings.template_depth:
+                timings.template_seconds += time.perf_counter() - began
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, reporting render time to PerfMiddleware."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
+
+
+def _dump_profile(profile, view, directory):
+    os.makedirs(directory, exist_ok=True)
+    name = "".join(character if character.isalnum() or character in "-_" else "_" for character in view)
+    profile.dump_stats(os.path.join(directory, f"{name}-{time.time_ns()}.prof"))
+
+
+class PerfMiddleware:
+    """Record wall, database and template time and query counts per URL name.
+
+    Every request is only timed. With PERF_PROFILE_DIR set, a request slower
+    than its view's recent 99th percentile has the next PERF_PROFILE_NEXT
+    requests to that view run under cProfile and dumped there, at most once
+    per PERF_PROFILE_INTERVAL seconds per view, so the profiles come from
+    while the view is slow and the profiler cost stays bounded.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.profile_dir = _setting("PERF_PROFILE_DIR", None)
+        self.profile_next = _setting("PERF_PROFILE_NEXT", 5)
+        self.profile_interval = _setting("PERF_PROFILE_INTERVAL", 60)
+        # View -> requests left to profile, and when that was last set
+        self.armed = {}
+        self.armed_at = {}
+        self.lock = threading.Lock()
+
+    def _arm(self, view):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.armed_at.get(view, -self.profile_interval) >= self.profile_interval:
+                self.armed[view] = self.profile_next
+                self.armed_at[view] = now
+
+    def _take(self, view):
+        with self.lock:
+            left = self.armed.get(view)
+            if not left:
+                return False
+            self.armed[view] = left - 1
+            return True
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # The view name is only known once the URL is resolved
+        timings = _current.get()
+        if self.profile_dir and timings is not None and self._take(request.resolver_match.view_name or UNRESOLVED):
+            timings.profile = cProfile.Profile()
+            timings.profile.enable()
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        began = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings.execute))
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if timings.profile is not None:
+                        timings.profile.disable()
+        finally:
+            _current.reset(token)
+        wall_seconds = time.perf_counter() - began
+
+        match = request.resolver_match
+        view = (match.view_name if match else None) or UNRESOLVED
+        if timings.profile is not None:
+            _dump_profile(timings.profile, view, self.profile_dir)
+        elif self.profile_dir:
+            slowest = registry.wall_percentile(view, 0.99)
+            if slowest is not None and wall_seconds >= slowest:
+                self._arm(view)
+        registry.record(view, {
+            "wall_seconds": wall_seconds,
+            "db_seconds": timings.db_seconds,
+            "template_seconds": timings.template_seconds,
+            "queries": timings.queries,
+            "duplicate_queries": timings.duplicate_queries,
+        })
+        return response
@@ -0,0 +1,80 @@
+import asyncio
+import threading
+
+
+class Subscription:
+    """One open connection waiting for updates on a channel.
+
+    Only the latest message is kept: a subscriber that falls behind skips
+    straight to the current state instead of queueing every intermediate one.
+    """
+
+    def __init__(self, channel, loop):
+        self.channel = channel
+        self.loop = loop
+        self.message = None
+        self.event = asyncio.Event()
+
+    def deliver(self, message):
+        self.message = message
+        self.event.set()
+
+    async def get(self):
+        await self.event.wait()
+        self.event.clear()
+        return self.message
+
+
+class Broker:
+    """In-process pub/sub between the (sync) write views and the async streams.
+
+    A publish costs one call_soon_threadsafe per event loop with subscribers on
+    the channel; the fan-out to each connection then happens inside that loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels = {}
+
+    def subscribe(self, channel):
+        loop = asyncio.get_running_loop()
+        subscription = Subscription(channel, loop)
+        with self._lock:
+            self._channels.setdefault(channel, {}).setdefault(loop, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            loops = self._channels.get(subscription.channel, {})
+            subscriptions = loops.get(subscription.loop, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                loops.pop(subscription.loop, None)
+            if not loops:
+                self._channels.pop(subscription.channel, None)
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._channels.get(channel, {}).values())
+
+    def publish(self, channel, message):
+        with self._lock:
+            targets = [(loop, tuple(subscriptions)) for loop, subscriptions in self._channels.get(channel, {}).items()]
+        for loop, subscriptions in targets:
+            try:
+                loop.call_soon_threadsafe(_fan_out, subscriptions, message)
+            except RuntimeError:
+                # The loop has been closed; its subscriptions are gone with it
+                pass
+
+
+def _fan_out(subscriptions, message):
+    for subscription in subscriptions:
+        subscription.deliver(message)
+
+
+broker = Broker()
+
+
+def listing_channel(listing_id):
+    return f"listing:{listing_id}"
@@ -0,0 +1,142 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Listing
+from .pagination import KeysetPage, decode_cursor, encode_cursor, keyset_paginate
+
+# An external-content FTS5 table: it stores only the index and reads title and
+# description back from auctions_listing, kept in sync by the triggers below
+SEARCH_TABLE = "auctions_listing_fts"
+
+SEARCH_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS auctions_listing_fts_insert AFTER INSERT ON auctions_listing BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS auctions_listing_fts_delete AFTER DELETE ON auctions_listing BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS auctions_listing_fts_update AFTER UPDATE OF title, description ON auctions_listing BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO {SEARCH_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+]
+
+# Title matches count ten times as much as description matches
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+
+def search_supported(using=None):
+    return (using or connection).vendor == "sqlite"
+
+
+def install_search_index(using):
+    with using.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(title, description, content='auctions_listing', content_rowid='id')"
+        )
+    install_search_triggers(using)
+
+
+def install_search_triggers(using):
+    # Rebuilding auctions_listing in a SQLite migration drops its triggers, so
+    # they are put back after every migrate
+    with using.cursor() as cursor:
+        for trigger in SEARCH_TRIGGERS:
+            cursor.execute(trigger)
+
+
+def rebuild_search_index(using=None):
+    with (using or connection).cursor() as cursor:
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')")
+
+
+def match_expression(query):
+    # Quote every word so user input can never be parsed as FTS5 syntax, and
+    # match the last one as a prefix while the user is still typing it
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def search_listings(query, category=None, min_price=None, max_price=None, cursor=None, page_size=25):
+    expression = match_expression(query)
+    if expression is None:
+        return KeysetPage([], None)
+    if not search_supported():
+        return _search_without_index(query, category, min_price, max_price, cursor, page_size)
+
+    where = [f"{SEARCH_TABLE} MATCH %s", "listing.active"]
+    params = [expression]
+    if category:
+        where.append("listing.category = %s")
+        params.append(category)
+    if min_price is not None:
+        where.append("listing.current_price >= %s")
+        params.append(str(min_price))
+    if max_price is not None:
+        where.append("listing.current_price <= %s")
+        params.append(str(max_price))
+
+    # bm25() is lower for better matches, so pages run in ascending (rank, id) order
+    after = ""
+    if cursor:
+        # As in keyset_paginate, a cursor that is not a position gives an empty page
+        values = decode_cursor(cursor)
+        if values is None or len(values) != 2:
+            return KeysetPage([], None)
+        try:
+            rank, listing_id = float(values[0]), int(values[1])
+        except (TypeError, ValueError):
+            return KeysetPage([], None)
+        after = "WHERE rank > %s OR (rank = %s AND id > %s)"
+        params += [rank, rank, listing_id]
+
+    sql = f"""
+        SELECT id, rank FROM (
+            SELECT listing.id AS id, bm25({SEARCH_TABLE}, {TITLE_WEIGHT}, {DESCRIPTION_WEIGHT}) AS rank
+            FROM {SEARCH_TABLE}
+            JOIN auctions_listing AS listing ON listing.id = {SEARCH_TABLE}.rowid
+            WHERE {" AND ".join(where)}
+        )
+        {after}
+        ORDER BY rank, id
+        LIMIT %s
+    """
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(sql, params + [page_size + 1])
+        rows = db_cursor.fetchall()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        listing_id, rank = rows[-1]
+        next_cursor = encode_cursor([rank, listing_id])
+
+    listings = Listing.objects.select_related("user").in_bulk([listing_id for listing_id, rank in rows])
+    return KeysetPage([listings[listing_id] for listing_id, rank in rows if listing_id in listings], next_cursor)
+
+
+def _search_without_index(query, category, min_price, max_price, cursor, page_size):
+    # Databases without FTS5 fall back to a (slow) substring match, newest first
+    listings = Listing.objects.filter(active=True).select_related("user")
+    for word in re.findall(r"\w+", query):
+        listings = listings.filter(Q(title__icontains=word) | Q(description__icontains=word))
+    if category:
+        listings = listings.filter(category=category)
+    if min_price is not None:
+        listings = listings.filter(current_price__gte=min_price)
+    if max_price is not None:
+        listings = listings.filter(current_price__lte=max_price)
+    return keyset_paginate(listings, cursor, page_size)
@@ -0,0 +1,110 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_save
+from django.dispatch import receiver
+
+from .auth import forget_user, remember_user
+from .cache import invalidate_listing
+from .db import configure_sqlite
+from .images import schedule_refresh
+from .models import User, Listing, Bid, Comment
+from .search import SEARCH_TABLE, install_search_triggers, search_supported
+from .stats import adjust_category_stats
+
+
+connection_created.connect(configure_sqlite)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    # Names, password and flags are cached for request.user (see auctions.auth);
+    # logging in only updates last_login, which is not
+    if update_fields != frozenset(["last_login"]):
+        forget_user(instance.id)
+
+
+@receiver(user_logged_in)
+def user_logged_in_cached(sender, request, user, **kwargs):
+    # The user was just authenticated from the database
+    remember_user(user)
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+def listing_changed(sender, instance, **kwargs):
+    invalidate_listing(instance.id)
+
+
+@receiver(pre_save, sender=Listing)
+def remember_listing_state(sender, instance, raw=False, **kwargs):
+    # Saves (as opposed to queryset updates) come from creating listings and the
+    # admin; note where the listing was counted before so post_save can move it,
+    # and which image it had so a new URL gets fetched
+    instance._counted_in = None
+    instance._image_before = None
+    if instance.pk and not raw:
+        before = Listing.objects.filter(pk=instance.pk).values("category", "active", "image").first()
+        if before:
+            instance._image_before = before["image"]
+            if instance.image != before["image"]:
+                # The old thumbnails no longer match the URL
+                instance.image_digest = ""
+            if before["active"]:
+                instance._counted_in = before["category"]
+
+
+@receiver(post_save, sender=Listing)
+def update_category_stats(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    deltas = {}
+    before = getattr(instance, "_counted_in", None)
+    if before:
+        deltas[before] = -1
+    if instance.active:
+        deltas[instance.category] = deltas.get(instance.category, 0) + 1
+    adjust_category_stats(deltas)
+
+
+@receiver(post_save, sender=Listing)
+def fetch_listing_image(sender, instance, raw=False, **kwargs):
+    before = getattr(instance, "_image_before", None)
+    # New URLs get fetched; a removed one clears the stored thumbnails
+    if not raw and instance.image != before and (instance.image or before):
+        schedule_refresh(instance.id)
+
+
+@receiver(post_delete, sender=Listing)
+def remove_from_category_stats(sender, instance, **kwargs):
+    adjust_category_stats({instance.category: -1 if instance.active else 0})
+
+
+@receiver(post_save, sender=Bid)
+@receiver(post_delete, sender=Bid)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def listing_child_changed(sender, instance, **kwargs):
+    invalidate_listing(instance.listing_id)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Listing.objects.filter(pk=instance.listing_id).update(comment_count=F("comment_count") + 1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    Listing.objects.filter(pk=instance.listing_id).update(comment_count=F("comment_count") - 1)
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    connection = connections[using]
+    if sender.label != "auctions" or not search_supported(connection):
+        return
+    if SEARCH_TABLE in connection.introspection.table_names():
+        install_search_triggers(connection)
@@ -0,0 +1,80 @@
+from django.db import transaction
+from django.db.models import Count, Exists, F, Max, Min, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from .models import CategoryStats, Listing
+
+
+def _refreshed_figures():
+    # Each subquery is a single seek on a partial index over active listings
+    active = Listing.objects.filter(category=OuterRef("category"), active=True)
+    return {
+        "min_price": Subquery(active.order_by("current_price").values("current_price")[:1]),
+        "max_price": Subquery(active.order_by("-current_price").values("current_price")[:1]),
+        "latest_listing": Subquery(active.order_by("-created", "-id").values("id")[:1]),
+        "updated": timezone.now(),
+    }
+
+
+def _category_of(listing_id):
+    return Subquery(Listing.objects.filter(pk=listing_id).values("category")[:1])
+
+
+def adjust_category_stats(deltas):
+    """Add to the active counts of some categories and refresh their other figures.
+
+    deltas maps a category code to the change in its number of active listings;
+    use 0 to only refresh prices and the latest listing.
+    """
+    for category, delta in deltas.items():
+        CategoryStats.objects.filter(category=category).update(active_count=F("active_count") + delta, **_refreshed_figures())
+
+
+def adjust_listing_category(listing_id, delta=0):
+    """Like adjust_category_stats, for the category a listing is in."""
+    CategoryStats.objects.filter(category=_category_of(listing_id)).update(active_count=F("active_count") + delta, **_refreshed_figures())
+
+
+def refresh_category_prices(category, price):
+    """Refresh a category's price range after one of its listings was bid up to price.
+
+    A bid only raises a price, so the stored range is stale only if price is
+    above the maximum or no active listing is left at the minimum. Most bids
+    change neither and the UPDATE matches no row, so they do not queue up on
+    the stats row or change its updated time.
+    """
+    at_minimum = Listing.objects.filter(category=category, active=True, current_price=OuterRef("min_price"))
+    CategoryStats.objects.filter(category=category).filter(
+        Q(max_price__isnull=True) | Q(max_price__lt=price) | Q(min_price__isnull=True) | ~Exists(at_minimum)
+    ).update(**_refreshed_figures())
+
+
+def compute_category_stats():
+    """Aggregate the figures from scratch, for rebuilding and drift checks."""
+    figures = {code: {"active_count": 0, "min_price": None, "max_price": None} for code, name in Listing.CATEGORY_CHOICES}
+    rows = Listing.objects.filter(active=True).values("category").annotate(
+        active_count=Count("id"), min_price=Min("current_price"), max_price=Max("current_price")
+    ).order_by()
+    for row in rows:
+        figures.setdefault(row.pop("category"), {}).update(row)
+    for category, values in figures.items():
+        values["latest_listing_id"] = Listing.objects.filter(category=category, active=True).order_by("-created", "-id").values_list("id", flat=True).first()
+    return figures
+
+
+def rebuild_category_stats(fix=True):
+    """Compare every stats row with the listings table and rewrite the ones that drifted.
+
+    Returns the categories whose stored figures were wrong. With fix=False
+    nothing is written.
+    """
+    with transaction.atomic():
+        stored = {stats.category: stats for stats in CategoryStats.objects.all()}
+        drifted = []
+        for category, figures in compute_category_stats().items():
+            stats = stored.get(category)
+            if stats is None or any(getattr(stats, name) != value for name, value in figures.items()):
+                drifted.append(category)
+                if fix:
+                    CategoryStats.objects.update_or_create(category=category, defaults=figures)
+    return drifted
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import re
+
+from asgiref.sync import sync_to_async
+
+from .models import Listing
+from .pubsub import broker, listing_channel
+
+STREAM_PATH = re.compile(r"^/listings/(?P<listing_id>[0-9]+)/stream$")
+
+# Comment lines keep idle connections from being dropped by proxies
+HEARTBEAT_SECONDS = 15
+
+
+def listing_state(listing_id):
+    listing = Listing.objects.select_related("current_bidder").filter(pk=listing_id).first()
+    if listing is None:
+        return None
+    bidder = listing.current_bidder
+    return {
+        "price": str(listing.current_price),
+        "number_of_bids": listing.number_of_bids,
+        "current_bidder": f"{bidder.first_name} {bidder.last_name}" if bidder else None,
+        "current_bidder_id": bidder.id if bidder else None,
+        "active": listing.active,
+    }
+
+
+def encode_event(message):
+    return f"event: listing\ndata: {json.dumps(message)}\n\n".encode()
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def listing_stream(scope, receive, send, listing_id):
+    """Server-sent events for one listing: its current state, then every update.
+
+    Updates come from the in-process broker, so an open stream never polls
+    the database; it is queried once when the connection opens. The stream
+    subscribes before that query, so a bid committed in between arrives as an
+    update (at worst repeating the initial state) instead of being lost.
+    """
+    subscription = broker.subscribe(listing_channel(listing_id))
+    try:
+        await _send_updates(receive, send, listing_id, subscription)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+async def _send_updates(receive, send, listing_id, subscription):
+    state = await sync_to_async(listing_state)(listing_id)
+    if state is None:
+        await send({"type": "http.response.start", "status": 404, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": b"Listing does not exist"})
+        return
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": encode_event(state), "more_body": True})
+    if not state["active"]:
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    update = None
+    try:
+        while True:
+            if update is None:
+                update = asyncio.ensure_future(subscription.get())
+            done, pending = await asyncio.wait({update, disconnected}, timeout=HEARTBEAT_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                break
+            if update in done:
+                message = update.result()
+                update = None
+                await send({"type": "http.response.body", "body": encode_event(message), "more_body": True})
+                if not message["active"]:
+                    await send({"type": "http.response.body", "body": b""})
+                    break
+            else:
+                await send({"type": "http.response.body", "body": b": heartbeat\n\n", "more_body": True})
+    finally:
+        for task in (update, disconnected):
+            if task is not None:
+                task.cancel()
+
+
+def stream_application(application):
+    """Serve the listing streams in front of the Django ASGI application."""
+
+    async def app(scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "GET":
+            match = STREAM_PATH.match(scope["path"])
+            if match:
+                return await listing_stream(scope, receive, send, int(match["listing_id"]))
+        return await application(scope, receive, send)
+
+    return app
@@ -0,0 +1,13 @@
+from django import template
+from django.templatetags.static import static
+from django.urls import reverse
+
+register = template.Library()
+
+
+@register.filter
+def thumbnail(listing, size="card"):
+    """URL of a listing's stored thumbnail, falling back to the original while it is fetched."""
+    if listing.image_digest:
+        return reverse("listing_image", args=[listing.id, size, listing.image_digest])
+    return listing.image or static("auctions/no-image.svg")
@@ -1,3 +1,2949 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.http import JsonResponse
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .auth import cached_user, check_shared_caches
+from .benchmarks import data as benchmark_data, runner as benchmark_runner
+from .cache import listing_version
+from .comments import add_comment
+from .bidding import BidError, place_bid, place_proxy_bid
+from .db import ReplicaRouter, read_only
+from . import archive, expiry, images, outbox, trending
+from .expiry import close_by_seller, close_expired_listings, reopen_listings
+from .models import User, Listing, Bid, Comment, Watchlist, CategoryStats, Event, ProxyBid, ArchivedListing, ArchivedBid, ArchivedComment, ArchivedWatchlist, TrendingListing, TrendingScore
+from .history import listing_history, user_bids
+from .images import THUMBNAIL_SIZES, ImageError, evict, fetch_url, stub_fetch, thumbnail_path
+from .outbox import process_batch
+from .pagination import EstimatedCountPaginator, encode_cursor, keyset_paginate
+from .perf import PerfMiddleware, registry
+from .pubsub import broker, listing_channel
+from .search import search_listings
+from .stats import compute_category_stats, rebuild_category_stats
+from .streams import listing_state, stream_application
+from .throttle import take_token
+from .transfer import export_rows, import_listings, read_rows
+from .trending import record_activity
+from .views import CATEGORY_SORTS
+from .watchlist import set_watched
+
+
+# Settings keep users and sessions out of the cache until a shared cache is
+# configured; one test process shares its LocMemCache, so it is safe here
+CACHED_USERS = {
+    "SESSION_ENGINE": "django.contrib.sessions.backends.cached_db",
+    "AUTHENTICATION_BACKENDS": ["auctions.auth.CachedUserBackend"],
+}
+
+
+benchmark_log = logging.getLogger("auctions.benchmarks")
+benchmark_log.setLevel(logging.INFO)
+
+
+def benchmark(cls):
+    """Tag a TestCase as a benchmark, run only when AUCTIONS_BENCHMARKS is set.
+
+    Benchmarks log their timings to benchmark_log, which is written to the
+    test runner's output from --verbosity 2.
+    """
+    run = cls.run
+
+    def run_logging_timings(self, result=None):
+        handler = logging.StreamHandler(result.stream) if getattr(result, "showAll", False) else logging.NullHandler()
+        benchmark_log.addHandler(handler)
+        try:
+            return run(self, result)
+        finally:
+            benchmark_log.removeHandler(handler)
+
+    cls.run = run_logging_timings
+    return tag("benchmark")(skipUnless(os.environ.get("AUCTIONS_BENCHMARKS"), "set AUCTIONS_BENCHMARKS=1 to run benchmarks")(cls))
+
+
+def create_user(username="seller", **kwargs):
+    return User.objects.create_user(username, f"{username}@example.com", "password", first_name=username.title(), last_name="Tester", **kwargs)
+
+
+def create_listings(user, count, **kwargs):
+    fields = dict(description="", active=True, starting_price=Decimal("1.00"), current_price=Decimal("1.00"), category="OTH")
+    fields.update(kwargs)
+    return Listing.objects.bulk_create(
+        Listing(user=user, title=f"Listing {i}", **fields) for i in range(count)
+    )
+
+
+class IndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user()
+        create_listings(cls.seller, 10000)
+
+    def test_index_runs_one_query_and_no_writes(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("index"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0]["sql"].startswith("SELECT"))
+
+    def test_next_page_runs_one_query(self):
+        first = self.client.get(reverse("index")).context["listings"]
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("index"), {"cursor": first.next_cursor})
+
+        second = response.context["listings"]
+        self.assertEqual(len(second), 25)
+        self.assertLess(second.items[0].id, first.items[-1].id)
+
+    def test_shows_stored_price_and_seller(self):
+        response = self.client.get(reverse("index"))
+
+        self.assertContains(response, "$1.00")
+        self.assertContains(response, "Seller Tester")
+
+
+class IndexPaginationTests(TestCase):
+    def test_pages_cover_every_active_listing_once_newest_first(self):
+        seller = create_user()
+        create_listings(seller, 60)
+        create_listings(seller, 5, active=False)
+        expected = list(Listing.objects.filter(active=True).order_by("-created", "-id").values_list("id", flat=True))
+
+        seen = []
+        cursor = None
+        while True:
+            page = self.client.get(reverse("index"), {"cursor": cursor} if cursor else {}).context["listings"]
+            seen.extend(listing.id for listing in page)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+
+        self.assertEqual(len(seen), 60)
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor_gives_an_empty_page(self):
+        seller = create_user()
+        create_listings(seller, 3)
+
+        for cursor in ["not-a-cursor", encode_cursor(["yesterday", "1"]), encode_cursor(["1"])]:
+            page = self.client.get(reverse("index"), {"cursor": cursor}).context["listings"]
+            self.assertEqual((len(page), page.has_next), (0, False), cursor)
+
+    def test_null_sort_keys_page_through(self):
+        # Listing prices are NOT NULL; archived ones still allow NULL
+        seller = create_user()
+        now = timezone.now()
+        ArchivedListing.objects.bulk_create(
+            ArchivedListing(id=number, user=seller, title=f"Listing {number}", created=now, ends_at=now, starting_price=Decimal("1.00"),
+                            current_price=None if number % 2 else Decimal("5.00"))
+            for number in range(1, 7)
+        )
+        listings = ArchivedListing.objects.all()
+
+        for ordering in [("-current_price", "-id"), ("current_price", "id")]:
+            seen = []
+            cursor = None
+            while True:
+                page = keyset_paginate(listings, cursor, 2, ordering)
+                seen.extend(listing.id for listing in page)
+                if not page.has_next:
+                    break
+                cursor = page.next_cursor
+            self.assertEqual(sorted(seen), sorted(listings.values_list("id", flat=True)), ordering)
+            self.assertEqual(len(seen), 6, ordering)
+
+
+
+class BidTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user()
+        cls.bidder = create_user("bidder")
+        cls.listing = Listing.objects.create(user=cls.seller, title="Lamp", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"))
+
+    def test_first_bid_may_equal_starting_price(self):
+        place_bid(self.listing.id, self.bidder, Decimal("10.00"))
+
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.current_price, Decimal("10.00"))
+        self.assertEqual(self.listing.number_of_bids, 1)
+        self.assertEqual(self.listing.current_bidder, self.bidder)
+
+    def test_first_bid_below_starting_price_is_rejected(self):
+        with self.assertRaisesMessage(BidError, "greater than or equal to the initial price"):
+            place_bid(self.listing.id, self.bidder, Decimal("9.99"))
+
+        self.assertFalse(Bid.objects.exists())
+
+    def test_later_bid_must_beat_current_price(self):
+        place_bid(self.listing.id, self.bidder, Decimal("10.00"))
+
+        with self.assertRaisesMessage(BidError, "greater than the current bid"):
+            place_bid(self.listing.id, self.bidder, Decimal("10.00"))
+
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.number_of_bids, 1)
+
+    def test_closed_listing_rejects_bids(self):
+        Listing.objects.filter(pk=self.listing.id).update(active=False)
+
+        with self.assertRaisesMessage(BidError, "closed"):
+            place_bid(self.listing.id, self.bidder, Decimal("50.00"))
+
+    def test_query_count_does_not_grow_with_bids(self):
+        record_activity(self.listing.id, "watch")
+        # Savepoint, conditional UPDATE, INSERT, outbox event, category stats,
+        # trending score, bid count for the live feed, release
+        with self.assertNumQueries(8):
+            place_bid(self.listing.id, self.bidder, Decimal("10.00"))
+
+        Bid.objects.bulk_create(Bid(listing=self.listing, user=self.bidder, price=Decimal("10.00")) for _ in range(5000))
+
+        with self.assertNumQueries(8):
+            place_bid(self.listing.id, self.bidder, Decimal("11.00"))
+
+    def test_bid_view_reports_rejection(self):
+        self.client.force_login(self.bidder)
+
+        response = self.client.post(reverse("bid", args=[self.listing.id]), {"price": "5"}, follow=True)
+
+        self.assertContains(response, "greater than or equal to the initial price")
+        self.assertFalse(Bid.objects.exists())
+
+    def test_bid_view_for_missing_listing_is_404(self):
+        self.client.force_login(self.bidder)
+
+        response = self.client.post(reverse("bid", args=[self.listing.id + 1]), {"price": "50"})
+
+        self.assertEqual(response.status_code, 404)
+
+
+class ConcurrentBidTests(TransactionTestCase):
+    def run_threads(self, target, count):
+        errors = []
+
+        def run(number):
+            try:
+                target(number)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run, args=(number,)) for number in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_concurrent_bids_lose_no_updates(self):
+        seller = create_user()
+        bidders = [create_user(f"bidder{number}") for number in range(8)]
+        listing = Listing.objects.create(user=seller, title="Lamp", active=True, starting_price=Decimal("1.00"), current_price=Decimal("1.00"))
+        accepted = [0] * len(bidders)
+
+        def bid_repeatedly(number):
+            # Every bidder offers every price, so each price level is contested
+            for price in range(1, 41):
+                try:
+                    place_bid(listing.id, bidders[number], Decimal(price))
+                    accepted[number] += 1
+                except BidError:
+                    pass
+
+        self.run_threads(bid_repeatedly, len(bidders))
+
+        listing.refresh_from_db()
+        prices = list(Bid.objects.filter(listing=listing).values_list("price", flat=True))
+        self.assertEqual(listing.number_of_bids, len(prices))
+        self.assertEqual(sum(accepted), len(prices))
+        self.assertEqual(len(prices), len(set(prices)))
+        self.assertEqual(listing.current_price, Decimal("40.00"))
+        self.assertEqual(listing.current_bidder_id, Bid.objects.get(listing=listing, price=Decimal("40.00")).user_id)
+
+    def test_per_bid_latency_is_steady_as_bids_grow(self):
+        seller = create_user()
+        bidder = create_user("bidder")
+        listing = Listing.objects.create(user=seller, title="Lamp", active=True, starting_price=Decimal("1.00"), current_price=Decimal("1.00"))
+
+        def time_bids(start):
+            began = time.perf_counter()
+            for price in range(start, start + 50):
+                place_bid(listing.id, bidder, Decimal(price))
+            return (time.perf_counter() - began) / 50
+
+        early = time_bids(1)
+        Bid.objects.bulk_create(Bid(listing=listing, user=bidder, price=Decimal("1.00")) for _ in range(20000))
+        late = time_bids(100)
+
+        # Generous bound: an O(bids) implementation is orders of magnitude slower here
+        self.assertLess(late, early * 5 + 0.005)
+
+
+class QueryPlanTests(TestCase):
+    """Every query a hot view runs must be answered from an index."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user()
+        cls.viewer = create_user("viewer")
+        create_listings(cls.seller, 50)
+        create_listings(cls.seller, 50, category="BOK")
+        create_listings(cls.seller, 20, active=False)
+        cls.listing = Listing.objects.filter(active=True).first()
+        place_bid(cls.listing.id, cls.viewer, Decimal("5.00"))
+        Comment.objects.create(listing=cls.listing, user=cls.viewer, text_comment="Nice")
+        Watchlist.objects.create(listing=cls.listing, user=cls.viewer, active=True)
+
+    def assertViewUsesIndexes(self, method, path, data=None, seek=None, allow_sort=False):
+        """No query scans a table or sorts in a temporary b-tree; with seek, one
+        seeks the index to a range of that column.
+
+        A SCAN using an index is allowed: with a LIMIT it reads the first rows
+        in index order and stops. allow_sort is for views that sort rows an
+        index seek has already bounded, such as one user's watchlist.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            getattr(self.client, method)(path, data or {})
+
+        self.assertTrue(queries.captured_queries)
+        statements = [query["sql"] for query in queries if query["sql"].lstrip().startswith("SELECT")]
+        steps = []
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+                plan = [row[-1] for row in cursor.fetchall()]
+                full_scans = [step for step in plan if step.startswith("SCAN") and "INDEX" not in step]
+                self.assertEqual(full_scans, [], f"{sql}\n{plan}")
+                if not allow_sort:
+                    sorts = [step for step in plan if step.startswith("USE TEMP B-TREE")]
+                    self.assertEqual(sorts, [], f"{sql}\n{plan}")
+                steps.extend(plan)
+        if seek:
+            seeks = [step for step in steps if step.startswith("SEARCH") and re.search(rf"\b{seek}[<>]", step)]
+            self.assertTrue(seeks, f"no range seek on {seek}:\n" + "\n".join(steps))
+
+    def test_index(self):
+        self.assertViewUsesIndexes("get", reverse("index"))
+        cursor = self.client.get(reverse("index")).context["listings"].next_cursor
+        self.assertViewUsesIndexes("get", reverse("index"), {"cursor": cursor}, seek="created")
+
+    def test_listing(self):
+        self.client.force_login(self.viewer)
+        self.assertViewUsesIndexes("get", reverse("listing", args=[self.listing.id]))
+
+    def test_watchlist_page(self):
+        self.client.force_login(self.viewer)
+        # Watched listings are sorted by listing columns no watchlist index
+        # holds; the sort only covers the rows of this user's watchlist
+        self.assertViewUsesIndexes("get", reverse("watchlist_page"), allow_sort=True)
+
+    def test_watchlist_toggle(self):
+        self.client.force_login(self.viewer)
+        self.assertViewUsesIndexes("post", reverse("watchlist", args=[self.listing.id]), {"watchlist": "dewatchlist"})
+
+    def test_bid_history(self):
+        self.assertViewUsesIndexes("get", reverse("listing_bids", args=[self.listing.id]))
+        self.client.force_login(self.viewer)
+        self.assertViewUsesIndexes("get", reverse("my_bids"))
+        cursor = encode_cursor([timezone.now().isoformat(), "1000000"])
+        self.assertViewUsesIndexes("get", reverse("my_bids"), {"cursor": cursor}, seek="created")
+
+    def test_bid_history_is_read_from_covering_indexes(self):
+        history = listing_history(self.listing.id)
+        sql = str(Bid.objects.filter(listing_id=self.listing.id).order_by("-created", "-id").values("id", "price", "user_id", "created")[:50].query)
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            plan = " ".join(row[-1] for row in cursor.fetchall())
+        self.assertIn("COVERING INDEX bid_listing_created", plan)
+        self.assertEqual(len(history), 1)
+
+    def test_known_image_lookup_uses_an_index(self):
+        known = Listing.objects.filter(image="https://images.example.com/lamp.jpg").exclude(image_digest="").values_list("image_digest", flat=True).order_by("pk")[:1]
+        self.assertIn("INDEX listing_fetched_image", known.explain())
+
+    def test_category(self):
+        for sort in ["newest", "price", "price_desc", "bids"]:
+            self.assertViewUsesIndexes("get", reverse("category", args=["BOK"]), {"sort": sort})
+            cursor = self.client.get(reverse("category", args=["BOK"]), {"sort": sort}).context["listings"].next_cursor
+            self.assertViewUsesIndexes("get", reverse("category", args=["BOK"]), {"sort": sort, "cursor": cursor}, seek=CATEGORY_SORTS[sort][0].lstrip("-"))
+
+    def test_close_listing(self):
+        self.client.force_login(self.seller)
+        self.assertViewUsesIndexes("post", reverse("close_listing", args=[self.listing.id]))
+
+    def test_search(self):
+        # Matches are read from the full-text index and ranked by bm25, which no
+        # index holds; the sort only covers the matching rows
+        self.assertViewUsesIndexes("get", reverse("search"), {"q": "listing"}, allow_sort=True)
+
+
+class ListingCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user()
+        cls.bidder = create_user("bidder")
+        cls.listing = Listing.objects.create(user=cls.seller, title="Lamp", description="A brass lamp", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"))
+        for number in range(5):
+            Comment.objects.create(listing=cls.listing, user=cls.bidder, text_comment=f"Comment {number}")
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse("listing", args=[self.listing.id])
+
+    def test_cached_page_skips_comment_queries(self):
+        with CaptureQueriesContext(connection) as cold:
+            self.client.get(self.url)
+        with CaptureQueriesContext(connection) as warm:
+            response = self.client.get(self.url)
+
+        self.assertContains(response, "Comment 4")
+        self.assertContains(response, "A brass lamp")
+        self.assertEqual(len(warm), 1)
+        self.assertLess(len(warm), len(cold))
+
+    def test_bid_invalidates_price(self):
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            place_bid(self.listing.id, self.bidder, Decimal("25.00"))
+
+        self.assertContains(self.client.get(self.url), "$25.00")
+
+    def test_bid_between_version_and_listing_reads(self):
+        def bid_then_read(listing_id):
+            with self.captureOnCommitCallbacks(execute=True):
+                place_bid(self.listing.id, self.bidder, Decimal("25.00"))
+            return listing_version(listing_id)
+
+        self.client.get(self.url)
+        with mock.patch("auctions.views.listing_version", side_effect=bid_then_read):
+            self.client.get(self.url)
+
+        self.assertContains(self.client.get(self.url), "$25.00")
+
+    def test_comment_invalidates_comments(self):
+        self.client.get(self.url)
+        self.client.force_login(self.bidder)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("comment", args=[self.listing.id]), {"text_comment": "Fresh comment"})
+
+        self.assertContains(self.client.get(self.url), "Fresh comment")
+
+    def test_close_invalidates_page(self):
+        self.client.force_login(self.seller)
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("close_listing", args=[self.listing.id]))
+
+        self.assertTemplateUsed(self.client.get(self.url), "auctions/winner.html")
+
+    def test_viewer_specific_parts_stay_dynamic(self):
+        self.client.force_login(self.seller)
+        self.assertContains(self.client.get(self.url), "Close the Listing")
+
+        self.client.force_login(self.bidder)
+        response = self.client.get(self.url)
+
+        self.assertNotContains(response, "Close the Listing")
+        self.assertContains(response, "Place Bid")
+        self.assertContains(response, "Comment 4")
+
+
+@benchmark
+class ListingCacheBenchmark(TestCase):
+    requests = 300
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user()
+        cls.listing = Listing.objects.create(user=cls.seller, title="Lamp", description="A brass lamp", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"))
+        commenters = [create_user(f"commenter{number}") for number in range(20)]
+        Comment.objects.bulk_create(
+            Comment(listing=cls.listing, user=commenters[number % 20], text_comment=f"Comment {number}") for number in range(200)
+        )
+
+    def requests_per_second(self):
+        url = reverse("listing", args=[self.listing.id])
+        self.client.get(url)
+        began = time.perf_counter()
+        for _ in range(self.requests):
+            self.client.get(url)
+        return self.requests / (time.perf_counter() - began)
+
+    def test_listing_requests_per_second(self):
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}):
+            uncached = self.requests_per_second()
+        cache.clear()
+        cached = self.requests_per_second()
+
+        benchmark_log.info(f"listing page: {uncached:.0f} req/s uncached, {cached:.0f} req/s cached ({cached / uncached:.1f}x)")
+        self.assertGreater(cached, uncached)
+
+
+@override_settings(**CACHED_USERS)
+class WatchlistPageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user()
+        cls.watcher = create_user("watcher")
+        create_listings(cls.seller, 60)
+        listings = list(Listing.objects.order_by("id"))
+        for number, listing in enumerate(listings):
+            listing.current_price = Decimal(100 - number)
+        Listing.objects.bulk_update(listings, ["current_price"])
+        Watchlist.objects.bulk_create(Watchlist(user=cls.watcher, listing=listing, active=True) for listing in listings[:40])
+        Watchlist.objects.bulk_create(Watchlist(user=cls.watcher, listing=listing, active=False) for listing in listings[40:45])
+        cls.watched = [listing.id for listing in listings[:40]]
+
+    def setUp(self):
+        self.client.force_login(self.watcher)
+
+    def test_page_query_count_does_not_depend_on_watchlist_size(self):
+        # One joined query for the listings; the session and user come from the cache
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("watchlist_page"))
+
+        self.assertEqual(len(response.context["listings"]), 25)
+        self.assertContains(response, "Seller Tester")
+
+    def test_pages_cover_the_watchlist(self):
+        first = self.client.get(reverse("watchlist_page")).context["listings"]
+        second = self.client.get(reverse("watchlist_page"), {"cursor": first.next_cursor}).context["listings"]
+
+        self.assertFalse(second.has_next)
+        self.assertEqual(sorted(listing.id for listing in list(first) + list(second)), self.watched)
+
+    def test_sort_by_price(self):
+        response = self.client.get(reverse("watchlist_page"), {"sort": "price"})
+
+        prices = [listing.current_price for listing in response.context["listings"]]
+        self.assertEqual(prices, sorted(prices))
+        self.assertEqual(prices[0], Decimal(100 - 39))
+
+    def test_watched_ids(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("watchlist_ids"))
+
+        self.assertEqual(sorted(response.json()["listings"]), self.watched)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user()
+        cls.lamp = Listing.objects.create(user=cls.seller, title="Brass lamp", description="Old and shiny", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"), category="HOM")
+        cls.book = Listing.objects.create(user=cls.seller, title="Cookbook", description="Recipes for a brass band", active=True, starting_price=Decimal("30.00"), current_price=Decimal("30.00"), category="BOK")
+        cls.closed = Listing.objects.create(user=cls.seller, title="Brass bell", description="", active=False, starting_price=Decimal("5.00"), current_price=Decimal("5.00"), category="HOM")
+
+    def search(self, **params):
+        return list(search_listings(**params))
+
+    def test_title_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search(query="brass"), [self.lamp, self.book])
+
+    def test_closed_listings_are_excluded(self):
+        self.assertNotIn(self.closed, self.search(query="bell"))
+
+    def test_last_word_matches_as_prefix(self):
+        self.assertEqual(self.search(query="cookb"), [self.book])
+
+    def test_filters(self):
+        self.assertEqual(self.search(query="brass", category="BOK"), [self.book])
+        self.assertEqual(self.search(query="brass", min_price=Decimal("20")), [self.book])
+        self.assertEqual(self.search(query="brass", max_price=Decimal("20")), [self.lamp])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.lamp.title = "Copper lamp"
+        self.lamp.save()
+        self.book.delete()
+
+        self.assertEqual(self.search(query="brass"), [])
+        self.assertEqual(self.search(query="copper"), [self.lamp])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.search(query='brass" -(lamp'), [self.lamp])
+        self.assertEqual(self.search(query='"*'), [])
+
+    def test_pagination(self):
+        create_listings(self.seller, 30, description="brass")
+
+        first = search_listings("brass", page_size=20)
+        second = search_listings("brass", cursor=first.next_cursor, page_size=20)
+
+        ids = [listing.id for listing in list(first) + list(second)]
+        self.assertEqual(len(ids), 32)
+        self.assertEqual(len(set(ids)), 32)
+        self.assertFalse(second.has_next)
+
+    def test_search_view(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("search"), {"q": "brass", "category": "HOM"})
+
+        self.assertEqual(list(response.context["listings"]), [self.lamp])
+        self.assertContains(response, "Brass lamp")
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO auctions_listing_fts(auctions_listing_fts) VALUES ('delete-all')")
+        self.assertEqual(self.search(query="brass"), [])
+
+        call_command("rebuild_search_index", stdout=StringIO())
+
+        self.assertEqual(self.search(query="brass"), [self.lamp, self.book])
+
+
+@benchmark
+class SearchBenchmark(TransactionTestCase):
+    words = ["vintage", "lamp", "guitar", "book", "chair", "camera", "watch", "bicycle", "jacket", "record"]
+
+    def add_listings(self, seller, start, count):
+        # Ten listings mention "needle", all among the first 10k, so both searches
+        # find the same rows and only the table grows; the rest share a small vocabulary
+        Listing.objects.bulk_create(
+            (Listing(
+                user=seller,
+                title=f"{self.words[number % 10]} {self.words[number * 7 % 10]} {number}",
+                description="needle in a haystack" if number % 1000 == 0 and number < 10000 else f"{self.words[number * 3 % 10]} in good condition",
+                active=True,
+                starting_price=Decimal("1.00"),
+                current_price=Decimal("1.00"),
+            ) for number in range(start, start + count)),
+            batch_size=5000
+        )
+
+    def time_search(self):
+        search_listings("needle")
+        began = time.perf_counter()
+        for _ in range(50):
+            search_listings("needle")
+        return (time.perf_counter() - began) / 50
+
+    def test_search_latency_is_sub_linear(self):
+        seller = create_user()
+        self.add_listings(seller, 0, 10000)
+        small = self.time_search()
+        self.add_listings(seller, 10000, 90000)
+        large = self.time_search()
+
+        benchmark_log.info(f"search: {small * 1000:.2f} ms over 10k listings, {large * 1000:.2f} ms over 100k listings")
+        # Ten times the listings may cost some more index depth, nowhere near ten times the time
+        self.assertLess(large, small * 3)
+        self.assertEqual(len(search_listings("needle")), 10)
+
+
+class StreamClient:
+    """Drives the ASGI stream application the way a server would."""
+
+    def __init__(self, app, listing_id):
+        self.messages = asyncio.Queue()
+        self.disconnected = asyncio.Event()
+        scope = {"type": "http", "method": "GET", "path": f"/listings/{listing_id}/stream", "headers": []}
+        self.task = asyncio.ensure_future(app(scope, self.receive, self.send))
+
+    async def receive(self):
+        await self.disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(self, message):
+        await self.messages.put(message)
+
+    async def next_event(self):
+        while True:
+            message = await self.messages.get()
+            if message.get("body", b"").startswith(b"event:"):
+                return json.loads(message["body"].decode().split("data: ", 1)[1])
+
+    async def close(self):
+        self.disconnected.set()
+        await self.task
+
+
+class ListingStreamTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user()
+        cls.bidder = create_user("bidder")
+        cls.listing = Listing.objects.create(user=cls.seller, title="Lamp", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"))
+
+    def test_stream_sends_state_then_updates(self):
+        app = stream_application(None)
+        channel = listing_channel(self.listing.id)
+
+        async def scenario():
+            client = StreamClient(app, self.listing.id)
+            initial = await client.next_event()
+            broker.publish(channel, {"price": "12.00", "number_of_bids": 1, "current_bidder": "Bidder Tester", "current_bidder_id": self.bidder.id, "active": True})
+            update = await client.next_event()
+            subscribers = broker.subscriber_count(channel)
+            await client.close()
+            return initial, update, subscribers
+
+        initial, update, subscribers = async_to_sync(scenario)()
+
+        self.assertEqual(initial, {"price": "10.00", "number_of_bids": 0, "current_bidder": None, "current_bidder_id": None, "active": True})
+        self.assertEqual(update["price"], "12.00")
+        self.assertEqual(subscribers, 1)
+        self.assertEqual(broker.subscriber_count(channel), 0)
+
+    def test_update_published_while_reading_the_state_is_sent(self):
+        app = stream_application(None)
+        channel = listing_channel(self.listing.id)
+
+        def state_then_bid(listing_id):
+            state = listing_state(listing_id)
+            broker.publish(channel, {"price": "12.00", "number_of_bids": 1, "current_bidder": "Bidder Tester", "current_bidder_id": self.bidder.id, "active": True})
+            return state
+
+        async def scenario():
+            client = StreamClient(app, self.listing.id)
+            initial = await client.next_event()
+            update = await asyncio.wait_for(client.next_event(), timeout=5)
+            await client.close()
+            return initial, update
+
+        with mock.patch("auctions.streams.listing_state", state_then_bid):
+            initial, update = async_to_sync(scenario)()
+
+        self.assertEqual(initial["price"], "10.00")
+        self.assertEqual(update["price"], "12.00")
+
+    def test_stream_ends_when_listing_closes(self):
+        app = stream_application(None)
+
+        async def scenario():
+            client = StreamClient(app, self.listing.id)
+            await client.next_event()
+            broker.publish(listing_channel(self.listing.id), {"active": False})
+            closed = await client.next_event()
+            await client.task
+            return closed
+
+        self.assertEqual(async_to_sync(scenario)(), {"active": False})
+
+    def test_missing_listing_is_404(self):
+        app = stream_application(None)
+
+        async def scenario():
+            client = StreamClient(app, self.listing.id + 1)
+            await client.task
+            return await client.messages.get()
+
+        self.assertEqual(async_to_sync(scenario)()["status"], 404)
+
+    def test_committed_bid_is_published(self):
+        with mock.patch.object(broker, "publish") as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                place_bid(self.listing.id, self.bidder, Decimal("15.00"))
+
+        publish.assert_called_once_with(listing_channel(self.listing.id), {
+            "price": "15.00",
+            "number_of_bids": 1,
+            "current_bidder": "Bidder Tester",
+            "current_bidder_id": self.bidder.id,
+            "active": True,
+        })
+
+    def test_wsgi_fallback_stops_reconnects(self):
+        response = self.client.get(reverse("listing_stream", args=[self.listing.id]))
+
+        self.assertEqual(response.status_code, 204)
+
+
+@benchmark
+class ListingStreamBenchmark(TestCase):
+    subscribers = 5000
+
+    def test_fan_out_to_concurrent_subscribers(self):
+        seller = create_user()
+        listing = Listing.objects.create(user=seller, title="Lamp", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"))
+        app = stream_application(None)
+
+        async def scenario():
+            clients = [StreamClient(app, listing.id) for _ in range(self.subscribers)]
+            await asyncio.gather(*(client.next_event() for client in clients))
+
+            timings = []
+            for price in range(11, 21):
+                began = time.perf_counter()
+                broker.publish(listing_channel(listing.id), {"price": f"{price}.00", "active": True})
+                events = await asyncio.gather(*(client.next_event() for client in clients))
+                timings.append(time.perf_counter() - began)
+                assert all(event["price"] == f"{price}.00" for event in events)
+
+            await asyncio.gather(*(client.close() for client in clients))
+            return timings
+
+        timings = async_to_sync(scenario)()
+
+        benchmark_log.info(f"fan-out to {self.subscribers} subscribers: {sum(timings) / len(timings) * 1000:.1f} ms mean, {max(timings) * 1000:.1f} ms max")
+        self.assertEqual(broker.subscriber_count(listing_channel(listing.id)), 0)
+
+
+class ExpiryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user()
+        cls.bidder = create_user("bidder")
+        cls.past = timezone.now() - timedelta(minutes=1)
+
+    def test_expired_listings_close_with_highest_bidder_as_winner(self):
+        listing = Listing.objects.create(user=self.seller, title="Lamp", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"))
+        place_bid(listing.id, self.bidder, Decimal("12.00"))
+        unsold = Listing.objects.create(user=self.seller, title="Chair", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"))
+        Listing.objects.filter(pk__in=[listing.id, unsold.id]).update(ends_at=self.past)
+        running = Listing.objects.create(user=self.seller, title="Desk", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"))
+
+        self.assertEqual(close_expired_listings(), 2)
+
+        listing.refresh_from_db()
+        unsold.refresh_from_db()
+        running.refresh_from_db()
+        self.assertFalse(listing.active)
+        self.assertEqual(listing.winner, self.bidder)
+        self.assertFalse(unsold.active)
+        self.assertIsNone(unsold.winner)
+        self.assertTrue(running.active)
+
+    def test_batches_use_one_update_each(self):
+        create_listings(self.seller, 25, ends_at=self.past)
+
+        # Per batch: select the ids, then savepoint, UPDATE, category stats, outbox events, release;
+        # plus the final empty select
+        with self.assertNumQueries(3 * 6 + 1):
+            self.assertEqual(close_expired_listings(batch_size=10), 25)
+
+        self.assertFalse(Listing.objects.filter(active=True).exists())
+
+    def test_listing_closed_again_after_a_reopen_gets_its_event(self):
+        reopened = Listing.objects.create(user=self.seller, title="Lamp", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"))
+        close_by_seller(reopened.id, self.seller)
+        reopen_listings(Listing.objects.filter(pk=reopened.id))
+        raced = Listing.objects.create(user=self.seller, title="Chair", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"))
+        Listing.objects.filter(pk__in=[reopened.id, raced.id]).update(ends_at=self.past)
+        close = expiry._close
+
+        def seller_closes_first(listings, listing_ids):
+            close_by_seller(raced.id, self.seller)
+            return close(listings, listing_ids)
+
+        # The seller closes one listing of the batch after it was picked
+        with mock.patch.object(expiry, "_close", seller_closes_first):
+            self.assertEqual(close_expired_listings(), 1)
+
+        events = Event.objects.filter(kind=Event.CLOSED)
+        self.assertEqual((events.filter(listing=reopened).count(), events.filter(listing=raced).count()), (2, 1))
+
+    def test_bids_on_expired_listings_are_rejected(self):
+        listing = Listing.objects.create(user=self.seller, title="Lamp", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"), ends_at=self.past)
+
+        with self.assertRaisesMessage(BidError, "closed"):
+            place_bid(listing.id, self.bidder, Decimal("12.00"))
+
+    def test_only_the_seller_can_close(self):
+        listing = Listing.objects.create(user=self.seller, title="Lamp", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"))
+        self.client.force_login(self.bidder)
+
+        self.client.post(reverse("close_listing", args=[listing.id]))
+
+        listing.refresh_from_db()
+        self.assertTrue(listing.active)
+
+    def test_command(self):
+        create_listings(self.seller, 3, ends_at=self.past)
+        output = StringIO()
+
+        call_command("close_expired_listings", stdout=output)
+
+        self.assertIn("Closed 3 listing(s)", output.getvalue())
+
+    def test_create_listing_sets_end_time(self):
+        self.client.force_login(self.seller)
+
+        self.client.post(reverse("create_listing"), {"title": "Lamp", "description": "", "image": "", "starting_price": "10", "category": "HOM", "duration": "3"})
+
+        listing = Listing.objects.get(title="Lamp")
+        self.assertAlmostEqual(listing.ends_at, listing.created + timedelta(days=3), delta=timedelta(seconds=5))
+
+
+class ConcurrentExpiryTests(TransactionTestCase):
+    def test_closing_while_bidding_keeps_the_last_accepted_bid_as_winner(self):
+        seller = create_user()
+        bidders = [create_user(f"bidder{number}") for number in range(4)]
+        listing = Listing.objects.create(user=seller, title="Lamp", active=True, starting_price=Decimal("1.00"), current_price=Decimal("1.00"), ends_at=timezone.now() + timedelta(milliseconds=300))
+        errors = []
+
+        def bid(number):
+            try:
+                for price in range(number + 1, 2000, len(bidders)):
+                    try:
+                        place_bid(listing.id, bidders[number], Decimal(price))
+                    except BidError:
+                        pass
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=bid, args=(number,)) for number in range(len(bidders))]
+        for thread in threads:
+            thread.start()
+        while Listing.objects.filter(pk=listing.id, active=True).exists():
+            close_expired_listings()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        listing.refresh_from_db()
+        last_bid = Bid.objects.filter(listing=listing).order_by("-price").first()
+        self.assertEqual(listing.winner_id, last_bid.user_id)
+        self.assertEqual(listing.current_price, last_bid.price)
+        self.assertEqual(listing.number_of_bids, Bid.objects.filter(listing=listing).count())
+
+
+@benchmark
+class ExpiryBenchmark(TestCase):
+    listings = 50000
+
+    def test_close_expired_listings(self):
+        seller = create_user()
+        bidder = create_user("bidder")
+        create_listings(seller, self.listings, ends_at=timezone.now() - timedelta(minutes=1), current_bidder=bidder, number_of_bids=1)
+
+        began = time.perf_counter()
+        closed = close_expired_listings(batch_size=1000)
+        elapsed = time.perf_counter() - began
+
+        benchmark_log.info(f"closed {closed} expired listings in {elapsed:.2f}s ({closed / elapsed:.0f} listings/s)")
+        self.assertEqual(closed, self.listings)
+        self.assertEqual(Listing.objects.filter(winner=bidder).count(), self.listings)
+
+
+class CategoryStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user()
+        cls.bidder = create_user("bidder")
+
+    def create_listing(self, price, category="BOK"):
+        return Listing.objects.create(user=self.seller, title="Book", active=True, starting_price=Decimal(price), current_price=Decimal(price), category=category)
+
+    def assertConsistent(self):
+        stored = {stats.category: stats for stats in CategoryStats.objects.all()}
+        for category, figures in compute_category_stats().items():
+            for name, value in figures.items():
+                self.assertEqual(getattr(stored[category], name), value, f"{category}.{name}")
+
+    def test_creating_listings_updates_counts_prices_and_latest(self):
+        self.create_listing("5.00")
+        latest = self.create_listing("20.00")
+
+        stats = CategoryStats.objects.get(category="BOK")
+        self.assertEqual(stats.active_count, 2)
+        self.assertEqual((stats.min_price, stats.max_price), (Decimal("5.00"), Decimal("20.00")))
+        self.assertEqual(stats.latest_listing, latest)
+        self.assertConsistent()
+
+    def test_bids_closing_and_recategorizing(self):
+        cheap = self.create_listing("5.00")
+        dear = self.create_listing("20.00")
+
+        place_bid(cheap.id, self.bidder, Decimal("30.00"))
+        self.assertConsistent()
+
+        self.client.force_login(self.seller)
+        self.client.post(reverse("close_listing", args=[cheap.id]))
+        self.assertConsistent()
+
+        dear.category = "ELE"
+        dear.save()
+        self.assertConsistent()
+
+        Listing.objects.filter(pk=dear.id).update(ends_at=timezone.now() - timedelta(minutes=1))
+        close_expired_listings()
+        self.assertConsistent()
+
+        self.assertFalse(CategoryStats.objects.filter(active_count__gt=0).exists())
+
+    def test_bids_inside_the_price_range_leave_the_row_alone(self):
+        cheap = self.create_listing("5.00")
+        self.create_listing("8.00")
+        middle = self.create_listing("10.00")
+        self.create_listing("20.00")
+        before = CategoryStats.objects.get(category="BOK").updated
+
+        place_bid(middle.id, self.bidder, Decimal("15.00"))
+        self.assertEqual(CategoryStats.objects.get(category="BOK").updated, before)
+
+        # Outbidding the cheapest listing moves the minimum, outbidding the
+        # dearest the maximum
+        place_bid(cheap.id, self.bidder, Decimal("12.00"))
+        self.assertEqual(CategoryStats.objects.get(category="BOK").min_price, Decimal("8.00"))
+        place_bid(middle.id, self.bidder, Decimal("25.00"))
+        self.assertEqual(CategoryStats.objects.get(category="BOK").max_price, Decimal("25.00"))
+        self.assertConsistent()
+
+    def test_deleting_a_listing(self):
+        listing = self.create_listing("5.00")
+
+        listing.delete()
+
+        self.assertConsistent()
+
+    def test_categories_page_reads_only_the_stats(self):
+        self.create_listing("5.00")
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("category_page"))
+
+        self.assertContains(response, "Books (1)")
+        self.assertContains(response, "Other (0)")
+
+    def test_category_header(self):
+        self.create_listing("5.00")
+
+        response = self.client.get(reverse("category", args=["BOK"]))
+
+        self.assertContains(response, "Books (1)")
+        self.assertEqual(self.client.get(reverse("category", args=["XXX"])).status_code, 404)
+
+    def test_rebuild_command_reports_and_fixes_drift(self):
+        self.create_listing("5.00")
+        CategoryStats.objects.filter(category="BOK").update(active_count=7)
+
+        with self.assertRaisesMessage(CommandError, "BOK"):
+            call_command("rebuild_category_stats", "--check", stdout=StringIO())
+
+        output = StringIO()
+        call_command("rebuild_category_stats", stdout=output)
+
+        self.assertIn("BOK", output.getvalue())
+        self.assertConsistent()
+
+
+class CategoryPageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user()
+        cls.bidder = create_user("bidder")
+        create_listings(cls.seller, 40, category="ELE")
+        create_listings(cls.seller, 5, category="BOK")
+        listings = list(Listing.objects.filter(category="ELE").order_by("id"))
+        for number, listing in enumerate(listings):
+            listing.current_price = Decimal(number % 7 + 1)
+            listing.number_of_bids = number % 5
+        Listing.objects.bulk_update(listings, ["current_price", "number_of_bids"])
+        call_command("rebuild_category_stats", stdout=StringIO())
+        cls.url = reverse("category", args=["ELE"])
+
+    def walk(self, sort):
+        listings = []
+        params = {"sort": sort}
+        while True:
+            page = self.client.get(self.url, params).context["listings"]
+            listings.extend(page)
+            if not page.has_next:
+                return listings
+            params["cursor"] = page.next_cursor
+
+    def test_one_joined_query_after_the_stats(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+
+        self.assertEqual(len(response.context["listings"]), 25)
+        self.assertContains(response, "Electronics (40)")
+
+    def test_sorts_cover_the_category_in_order(self):
+        keys = {
+            "newest": lambda listing: (listing.created, listing.id),
+            "price": lambda listing: (-listing.current_price, -listing.id),
+            "price_desc": lambda listing: (listing.current_price, listing.id),
+            "bids": lambda listing: (listing.number_of_bids, listing.id),
+        }
+        for sort, key in keys.items():
+            listings = self.walk(sort)
+            self.assertEqual(len(listings), 40, sort)
+            self.assertEqual(listings, sorted(listings, key=key, reverse=True), sort)
+
+    def test_unchanged_category_is_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertIn("Last-Modified", response)
+
+        with self.assertNumQueries(1):
+            cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEqual(cached.status_code, 304)
+
+    def test_bid_changes_the_etag(self):
+        response = self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            place_bid(Listing.objects.filter(category="ELE").first().id, self.bidder, Decimal("50.00"))
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200)
+
+    def test_etag_depends_on_sort_and_viewer(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        self.assertNotEqual(self.client.get(self.url, {"sort": "price"})["ETag"], etag)
+        self.client.force_login(self.bidder)
+        self.assertNotEqual(self.client.get(self.url)["ETag"], etag)
+
+
+class BenchmarkSuiteTests(TestCase):
+    def test_generated_data_is_deterministic(self):
+        first = benchmark_data.generate(listings=50, seed=3)
+        titles = list(Listing.objects.filter(pk__in=first.listings).order_by("id").values_list("title", "starting_price", "number_of_bids"))
+        Listing.objects.all().delete()
+        User.objects.all().delete()
+        second = benchmark_data.generate(listings=50, seed=3)
+        self.assertEqual(list(Listing.objects.filter(pk__in=second.listings).order_by("id").values_list("title", "starting_price", "number_of_bids")), titles)
+
+    def test_generated_data_is_consistent(self):
+        dataset = benchmark_data.generate(listings=100, seed=1)
+        self.assertEqual(len(dataset.listings), 100)
+        for listing in Listing.objects.filter(pk__in=dataset.listings):
+            bids = list(listing.bids.order_by("-price"))
+            self.assertEqual(listing.number_of_bids, len(bids))
+            self.assertEqual(listing.comment_count, listing.comments.count())
+            if bids:
+                self.assertEqual(listing.current_price, bids[0].price)
+                self.assertEqual(listing.current_bidder_id, bids[0].user_id)
+        for category, figures in compute_category_stats().items():
+            stats = CategoryStats.objects.get(category=category)
+            self.assertEqual(stats.active_count, figures["active_count"])
+
+    def test_runner_measures_every_scenario(self):
+        cache.clear()
+        dataset = benchmark_data.generate(listings=30)
+        user = User.objects.get(pk=dataset.users[0])
+        bids = Bid.objects.filter(listing_id=dataset.listings[0], user=user)
+        existing = bids.count()
+        results = benchmark_runner.run(benchmark_runner.default_scenarios(dataset), requests=5, user=user)
+        self.assertEqual(set(results["scenarios"]), {"index", "listing", "bid", "watchlist_page", "category", "search"})
+        for figures in results["scenarios"].values():
+            self.assertLessEqual(figures["p50_ms"], figures["p99_ms"])
+            self.assertGreater(figures["queries_per_request"], 0)
+        # Warmup and measured bids all went through
+        self.assertEqual(bids.count(), existing + 10)
+
+    def test_compare_flags_regressions(self):
+        baseline = {"scenarios": {"index": {"p95_ms": 10.0, "queries_per_request": 1.0}}}
+        self.assertEqual(benchmark_runner.compare({"scenarios": {"index": {"p95_ms": 11.0, "queries_per_request": 1.0}}}, baseline), [])
+        self.assertEqual(len(benchmark_runner.compare({"scenarios": {"index": {"p95_ms": 13.0, "queries_per_request": 2.0}}}, baseline)), 2)
+
+
+class PerfMiddlewareTests(TestCase):
+    def setUp(self):
+        registry.reset()
+
+    def test_records_view_metrics(self):
+        create_listings(create_user(), 3)
+        self.client.get(reverse("index"))
+        self.client.get(reverse("index"))
+        figures = registry.snapshot()["index"]
+        self.assertEqual(figures["wall_seconds"]["count"], 2)
+        self.assertGreaterEqual(figures["queries"]["p50"], 1)
+        self.assertGreater(figures["db_seconds"]["sum"], 0)
+        self.assertGreater(figures["template_seconds"]["sum"], 0)
+        self.assertLessEqual(figures["template_seconds"]["sum"], figures["wall_seconds"]["sum"])
+
+    def test_counts_duplicate_queries(self):
+        create_listings(create_user(), 3)
+
+        def view(request):
+            for listing in Listing.objects.all():
+                User.objects.get(pk=listing.user_id)
+            return JsonResponse({})
+
+        request = RequestFactory().get("/")
+        request.resolver_match = mock.Mock(view_name="loop")
+        PerfMiddleware(view)(request)
+        figures = registry.snapshot()["loop"]
+        self.assertEqual(figures["queries"]["max"], 4)
+        self.assertEqual(figures["duplicate_queries"]["max"], 2)
+
+    def test_unresolved_requests_share_an_entry(self):
+        self.client.get("/no/such/page")
+        self.assertIn("<unresolved>", registry.snapshot())
+
+    def test_endpoint_is_staff_only(self):
+        self.client.force_login(create_user())
+        self.assertEqual(self.client.get(reverse("perf")).status_code, 302)
+
+        self.client.force_login(create_user("staff", is_staff=True))
+        self.client.get(reverse("index"))
+        response = self.client.get(reverse("perf"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["views"]["index"]["wall_seconds"]["count"], 1)
+
+        metrics = self.client.get(reverse("perf"), {"format": "prometheus"}).content.decode()
+        self.assertIn("# TYPE auctions_request_wall_seconds histogram", metrics)
+        self.assertIn('auctions_request_wall_seconds_bucket{view="index",le="+Inf"} 1', metrics)
+        self.assertIn('auctions_request_queries_count{view="index"} 1', metrics)
+
+    def test_profiles_the_requests_after_a_slow_one(self):
+        create_listings(create_user(), 3)
+        with tempfile.TemporaryDirectory() as directory:
+            with self.settings(PERF_PROFILE_DIR=directory, PERF_PROFILE_NEXT=2, PERF_PROFILE_INTERVAL=3600):
+                client = Client()
+                # Nothing is profiled while the view is as fast as usual
+                for _ in range(100):
+                    registry.record("index", {"wall_seconds": 10})
+                client.get(reverse("index"))
+                self.assertEqual(os.listdir(directory), [])
+
+                # One request slower than the 99th percentile gets the next two
+                # profiled, and the interval keeps later ones from re-arming it
+                registry.reset()
+                for _ in range(100):
+                    registry.record("index", {"wall_seconds": 0})
+                for _ in range(5):
+                    client.get(reverse("index"))
+                dumps = os.listdir(directory)
+        self.assertEqual(len(dumps), 2)
+        self.assertTrue(all(dump.startswith("index-") and dump.endswith(".prof") for dump in dumps))
+
+
+class DatabaseSettingsTests(TestCase):
+    def test_sqlite_connections_are_tuned(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+    def test_read_only_views_read_from_the_replica(self):
+        router = ReplicaRouter()
+        routed = read_only(lambda request: router.db_for_read(Listing))
+
+        self.assertIsNone(routed(None))
+        with mock.patch.dict(settings.DATABASES, {"replica": settings.DATABASES["default"]}):
+            self.assertEqual(routed(None), "replica")
+            self.assertIsNone(router.db_for_read(Listing))
+            self.assertEqual(read_only(lambda request: router.db_for_write(Listing))(None), "default")
+        self.assertFalse(router.allow_migrate("replica", "auctions"))
+        self.assertTrue(router.allow_migrate("default", "auctions"))
+
+
+def run_in_threads(targets):
+    errors = []
+
+    def run(target):
+        try:
+            target()
+        except Exception as error:
+            errors.append(error)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+class ConcurrentReadWriteTests(TransactionTestCase):
+    def test_writers_commit_while_a_reader_is_open(self):
+        seller = create_user()
+        create_listings(seller, 3)
+        reading = threading.Event()
+        written = threading.Event()
+        seen = []
+
+        def reader():
+            with transaction.atomic():
+                seen.append(Listing.objects.count())
+                reading.set()
+                written.wait(10)
+                # Still the snapshot the transaction started with
+                seen.append(Listing.objects.count())
+
+        def writer():
+            reading.wait(10)
+            began = time.perf_counter()
+            create_listings(seller, 1)
+            seen.append(time.perf_counter() - began)
+            written.set()
+
+        self.assertEqual(run_in_threads([reader, writer]), [])
+        # With a rollback journal the commit waits out the busy timeout instead
+        self.assertLess(seen[1], 1)
+        self.assertEqual([seen[0], seen[2]], [3, 3])
+        self.assertEqual(Listing.objects.count(), 4)
+
+
+@benchmark
+class ConcurrentReadWriteBenchmark(TransactionTestCase):
+    def mixed_workload(self, journal_mode, seconds=3, readers=4, writers=2):
+        pragmas = {**settings.SQLITE_PRAGMAS, "journal_mode": journal_mode}
+        with self.settings(SQLITE_PRAGMAS=pragmas):
+            # The journal mode can only change while no other connection is open
+            connection.close()
+            connection.ensure_connection()
+            seller = create_user(f"seller-{journal_mode}")
+            bidders = [create_user(f"bidder-{journal_mode}-{number}") for number in range(writers)]
+            create_listings(seller, 1000)
+            listings = list(Listing.objects.filter(user=seller).values_list("id", flat=True)[:writers])
+            deadline = time.perf_counter() + seconds
+            read_latencies = []
+            bids = [0] * writers
+
+            def read():
+                while time.perf_counter() < deadline:
+                    began = time.perf_counter()
+                    with transaction.atomic():
+                        list(Listing.objects.filter(active=True).order_by("-created")[:25])
+                        Listing.objects.filter(active=True).count()
+                    read_latencies.append(time.perf_counter() - began)
+
+            def write(number):
+                price = 1
+                while time.perf_counter() < deadline:
+                    place_bid(listings[number], bidders[number], Decimal(price))
+                    price += 1
+                    bids[number] += 1
+
+            errors = run_in_threads([read] * readers + [lambda number=number: write(number) for number in range(writers)])
+            connection.close()
+        self.assertEqual(errors, [])
+        return benchmark_runner.percentile(read_latencies, 0.95), len(read_latencies) / seconds, sum(bids) / seconds
+
+    def test_reads_and_writes_do_not_serialize(self):
+        results = {mode: self.mixed_workload(mode) for mode in ("delete", "wal")}
+        for mode, (p95, reads, writes) in results.items():
+            benchmark_log.info(f"{mode}: read p95 {p95 * 1000:.2f} ms, {reads:.0f} reads/s, {writes:.0f} bids/s")
+        self.assertGreater(results["wal"][2], results["delete"][2])
+
+
+IMPORT_CSV = """title,description,image,starting_price,category,duration
+Lamp,Brass,,10.00,HOM,3
+Guitar,,https://example.com/guitar.jpg,250,MUS,
+Broken,,,not a price,OTH,7
+Chair,Oak,,5,XXX,7
+Novel,Paperback,,4.50,BOK,1
+"""
+
+
+class ImportExportTests(TestCase):
+    def setUp(self):
+        self.seller = create_user()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w") as output:
+            output.write(content)
+        return path
+
+    def test_import_command_creates_valid_rows_and_reports_the_rest(self):
+        out, err = StringIO(), StringIO()
+        call_command("import_listings", self.write("catalog.csv", IMPORT_CSV), seller="seller", chunk_size=2, stdout=out, stderr=err)
+
+        self.assertIn("Created 3 listing(s), 2 row(s) with errors", out.getvalue())
+        self.assertIn("line 4: starting_price: Enter a number.", err.getvalue())
+        self.assertIn("line 5: category:", err.getvalue())
+        lamp = Listing.objects.get(title="Lamp")
+        self.assertEqual((lamp.user, lamp.active, lamp.current_price, lamp.image), (self.seller, True, Decimal("10.00"), ""))
+        self.assertAlmostEqual(lamp.ends_at, lamp.created + timedelta(days=3), delta=timedelta(seconds=5))
+        guitar = Listing.objects.get(title="Guitar")
+        self.assertAlmostEqual(guitar.ends_at, guitar.created + timedelta(days=7), delta=timedelta(seconds=5))
+        self.assertEqual(CategoryStats.objects.get(category="HOM").active_count, 1)
+        self.assertEqual(CategoryStats.objects.get(category="BOK").max_price, Decimal("4.50"))
+
+    def test_jsonl_import_reports_unparseable_lines(self):
+        rows = '{"title": "Lamp", "starting_price": 3, "category": "HOM"}\nnot json\n\n["a list"]\n'
+        out, err = StringIO(), StringIO()
+        call_command("import_listings", self.write("catalog.jsonl", rows), seller="seller", stdout=out, stderr=err)
+        self.assertIn("Created 1 listing(s), 2 row(s) with errors", out.getvalue())
+        self.assertIn("line 2:", err.getvalue())
+        self.assertIn("line 4:", err.getvalue())
+
+    def test_dry_run_creates_nothing(self):
+        out = StringIO()
+        call_command("import_listings", self.write("catalog.csv", IMPORT_CSV), seller="seller", dry_run=True, stdout=out, stderr=StringIO())
+        self.assertIn("Validated 3 listing(s)", out.getvalue())
+        self.assertFalse(Listing.objects.exists())
+
+    def test_each_chunk_is_one_insert(self):
+        rows = [(number, {"title": f"Item {number}", "starting_price": "1", "category": "OTH"}) for number in range(10)]
+        with CaptureQueriesContext(connection) as captured:
+            report = import_listings(rows, self.seller, chunk_size=5)
+        self.assertEqual(report.created, 10)
+        self.assertEqual(len([query for query in captured if query["sql"].startswith("INSERT")]), 2)
+
+    def test_upload_endpoint_is_staff_only(self):
+        self.client.force_login(self.seller)
+        self.assertEqual(self.client.get(reverse("import_listings")).status_code, 302)
+
+        self.client.force_login(create_user("staff", is_staff=True))
+        response = self.client.post(reverse("import_listings"), {
+            "file": SimpleUploadedFile("catalog.csv", IMPORT_CSV.encode()),
+            "seller": "seller",
+        })
+        self.assertContains(response, "Created 3 listing(s); 2 row(s) had errors.")
+        self.assertContains(response, "Enter a number.")
+        self.assertEqual(Listing.objects.filter(user=self.seller).count(), 3)
+
+    def test_unreadable_upload_is_a_file_error(self):
+        self.client.force_login(create_user("staff", is_staff=True))
+        response = self.client.post(reverse("import_listings"), {
+            "file": SimpleUploadedFile("catalog.csv", "title,starting_price,category\nCafé,1,OTH\n".encode("latin-1")),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response.context["form"], "file", "The file is not UTF-8 text.")
+
+    def test_malformed_csv_stops_at_its_line(self):
+        rows = "title,starting_price,category\nLamp,1,HOM\n" + '"' + "x" * (csv.field_size_limit() + 1) + '",1,OTH\n'
+        out, err = StringIO(), StringIO()
+        with self.assertRaisesMessage(CommandError, "Line 3: field larger than field limit"):
+            call_command("import_listings", self.write("catalog.csv", rows), seller="seller", stdout=out, stderr=err)
+        self.assertIn("Created 1 listing(s), 0 row(s) with errors", out.getvalue())
+
+    def test_only_the_first_errors_are_kept(self):
+        rows = [(number, {"title": "", "starting_price": "1", "category": "OTH"}) for number in range(10)]
+        report = import_listings(rows, self.seller, max_errors=3)
+        self.assertEqual((report.error_count, [line_number for line_number, errors in report.errors]), (10, [0, 1, 2]))
+
+    def test_export_streams_listings_and_bids(self):
+        listing = Listing.objects.create(user=self.seller, title="Lamp, brass", active=True, starting_price=Decimal("1.00"), current_price=Decimal("1.00"), category="HOM")
+        place_bid(listing.id, create_user("bidder"), Decimal("3.00"))
+        self.client.force_login(create_user("staff", is_staff=True))
+
+        response = self.client.get(reverse("export", args=["listings"]))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="listings.csv"')
+        rows = list(csv.DictReader(StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual([(row["title"], row["current_price"], row["user"], row["current_bidder"]) for row in rows], [("Lamp, brass", "3.00", "seller", "bidder")])
+
+        response = self.client.get(reverse("export", args=["bids"]), {"format": "jsonl"})
+        bids = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(bid["listing_id"], bid["user"], bid["price"]) for bid in bids], [(listing.id, "bidder", "3.00")])
+
+        self.assertEqual(self.client.get(reverse("export", args=["users"])).status_code, 404)
+
+    def test_exported_listings_import_back(self):
+        create_listings(self.seller, 3, category="TOY")
+        exported = "".join(export_rows("listings", "csv"))
+        report = import_listings(read_rows(StringIO(exported), "csv"), self.seller)
+        self.assertEqual((report.created, report.errors), (3, []))
+        self.assertEqual(Listing.objects.filter(category="TOY").count(), 6)
+
+
+@benchmark
+class ImportExportBenchmark(TransactionTestCase):
+    rows = int(os.environ.get("AUCTIONS_BENCHMARK_ROWS", 1000000))
+
+    def test_million_row_import_and_export(self):
+        seller = create_user()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "catalog.csv")
+            with open(path, "w", newline="") as output:
+                writer = csv.writer(output)
+                writer.writerow(["title", "description", "starting_price", "category"])
+                for number in range(self.rows):
+                    writer.writerow([f"Item {number}", "Imported in bulk", number % 500 + 1, Listing.CATEGORY_CHOICES[number % 10][0]])
+
+            tracemalloc.start()
+            began = time.perf_counter()
+            with open(path, newline="") as stream:
+                report = import_listings(read_rows(stream, "csv"), seller, chunk_size=5000)
+            import_seconds = time.perf_counter() - began
+            import_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        tracemalloc.start()
+        began = time.perf_counter()
+        size = sum(len(line) for line in export_rows("listings", "csv", chunk_size=5000))
+        export_seconds = time.perf_counter() - began
+        export_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        benchmark_log.info(f"import: {self.rows / import_seconds:.0f} rows/s, peak {import_peak / 2 ** 20:.1f} MiB"
+                           f"\nexport: {self.rows / export_seconds:.0f} rows/s, {size / 2 ** 20:.0f} MiB written, peak {export_peak / 2 ** 20:.1f} MiB")
+        self.assertEqual(report.created, self.rows)
+        # Flat memory: a few chunks' worth of rows whatever the number of rows
+        self.assertLess(import_peak, 64 * 2 ** 20)
+        self.assertLess(export_peak, 64 * 2 ** 20)
+
+
+class ListingImageTests(TestCase):
+    def setUp(self):
+        self.seller = create_user()
+        self.client.force_login(self.seller)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = self.settings(IMAGE_FETCHER="auctions.images.stub_fetch", IMAGE_FETCH_ASYNC=False, IMAGE_STORE_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        cache.clear()
+
+    def create(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("create_listing"), {"title": "Lamp", "description": "", "image": image, "starting_price": "10", "category": "HOM", "duration": "7"})
+        return Listing.objects.latest("id")
+
+    def test_new_listings_get_thumbnails(self):
+        listing = self.create("https://images.example.com/lamp.jpg")
+        self.assertEqual(len(listing.image_digest), 64)
+        self.assertTrue(os.path.exists(thumbnail_path(listing.image_digest, "card")))
+
+        thumbnail = reverse("listing_image", args=[listing.id, "card", listing.image_digest])
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, thumbnail)
+        self.assertNotContains(response, "images.example.com")
+        self.assertContains(self.client.get(reverse("listing", args=[listing.id])), reverse("listing_image", args=[listing.id, "detail", listing.image_digest]))
+
+        response = self.client.get(thumbnail)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertEqual(b"".join(response.streaming_content), stub_fetch("https://images.example.com/lamp.jpg"))
+
+    def test_web_server_can_send_the_file(self):
+        listing = self.create("https://images.example.com/lamp.jpg")
+        with self.settings(IMAGE_SENDFILE_HEADER="X-Sendfile"):
+            response = self.client.get(reverse("listing_image", args=[listing.id, "card", listing.image_digest]))
+        self.assertEqual(response["X-Sendfile"], thumbnail_path(listing.image_digest, "card"))
+        self.assertEqual(response.content, b"")
+
+    def test_each_url_is_fetched_once(self):
+        with mock.patch("auctions.images.stub_fetch", wraps=stub_fetch) as fetch:
+            first = self.create("https://images.example.com/lamp.jpg")
+            second = self.create("https://images.example.com/lamp.jpg")
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(first.image_digest, second.image_digest)
+
+    def test_listings_without_a_stored_image_fall_back(self):
+        missing = self.create("https://images.example.com/missing.jpg")
+        self.assertEqual(missing.image_digest, "")
+        blank = self.create("")
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, "https://images.example.com/missing.jpg")
+        self.assertContains(response, "/static/auctions/no-image.svg")
+        self.assertNotContains(response, "sisterhoodofstyle")
+        self.assertEqual(blank.image, "")
+
+    def test_changing_the_url_replaces_the_thumbnail(self):
+        listing = self.create("https://images.example.com/lamp.jpg")
+        old_digest = listing.image_digest
+        listing.image = "https://images.example.com/other.jpg"
+        with self.captureOnCommitCallbacks(execute=True):
+            listing.save()
+        listing.refresh_from_db()
+        self.assertNotIn(listing.image_digest, ("", old_digest))
+
+        listing.image = ""
+        with self.captureOnCommitCallbacks(execute=True):
+            listing.save()
+        listing.refresh_from_db()
+        self.assertEqual(listing.image_digest, "")
+
+    def test_evicts_least_recently_used_files(self):
+        paths = []
+        for number in range(5):
+            listing = self.create(f"https://images.example.com/{number}.jpg")
+            for path in sorted({thumbnail_path(listing.image_digest, size) for size in THUMBNAIL_SIZES}):
+                os.utime(path, (1000 + number, 1000 + number))
+                paths.append(path)
+        size = os.path.getsize(path)
+        self.assertEqual(evict(max_bytes=size * len(paths)), 0)
+        # Down to 90% of the limit, oldest first
+        limit = size * (len(paths) // 2 + 1)
+        kept = int(limit * 0.9 // size)
+        self.assertEqual(evict(max_bytes=limit), len(paths) - kept)
+        self.assertEqual([os.path.exists(path) for path in paths], [False] * (len(paths) - kept) + [True] * kept)
+
+    def test_original_is_stored_once_without_pillow(self):
+        with mock.patch.object(images, "Image", None):
+            listing = self.create("https://images.example.com/lamp.jpg")
+            self.assertEqual(thumbnail_path(listing.image_digest, "card"), thumbnail_path(listing.image_digest, "detail"))
+            self.assertEqual([error.id for error in images.check_pillow(None)], ["auctions.W001"])
+        stored = [name for directory, subdirectories, names in os.walk(images.store_dir()) for name in names]
+        self.assertEqual(stored, [f"{listing.image_digest}-original"])
+
+    def test_evicted_thumbnails_are_fetched_again(self):
+        listing = self.create("https://images.example.com/lamp.jpg")
+        digest = listing.image_digest
+        for path in {thumbnail_path(digest, size) for size in THUMBNAIL_SIZES}:
+            os.remove(path)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(reverse("listing_image", args=[listing.id, "card", digest]))
+        self.assertRedirects(response, "https://images.example.com/lamp.jpg", fetch_redirect_response=False)
+        listing.refresh_from_db()
+        self.assertEqual(listing.image_digest, digest)
+        self.assertTrue(os.path.exists(thumbnail_path(digest, "card")))
+
+    def test_digest_must_be_a_sha256(self):
+        listing = self.create("https://images.example.com/lamp.jpg")
+        for digest in [".." + "a" * 62, listing.image_digest.upper(), listing.image_digest[:-1]]:
+            self.assertEqual(self.client.get(reverse("listing_image", args=[listing.id, "card", digest])).status_code, 404, digest)
+
+    def test_command_fetches_images_of_imported_listings(self):
+        create_listings(self.seller, 3, image="https://images.example.com/bulk.jpg")
+        out = StringIO()
+        call_command("fetch_listing_images", stdout=out)
+        self.assertIn("Refreshed the images of 3 listing(s)", out.getvalue())
+        self.assertEqual(Listing.objects.filter(image_digest="").count(), 0)
+
+
+class FetchUrlTests(TestCase):
+    def test_refuses_other_schemes_and_private_addresses(self):
+        for url in ["file:///etc/passwd", "ftp://images.example.com/lamp.jpg", "http://127.0.0.1/lamp.jpg",
+                    "http://localhost:8000/admin/", "http://10.0.0.5/lamp.jpg", "http://169.254.169.254/latest/meta-data/", "http://[::1]/lamp.jpg"]:
+            with self.assertRaises(ImageError, msg=url):
+                fetch_url(url)
+
+    def test_checks_where_redirects_lead(self):
+        class Redirect(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(302)
+                self.send_header("Location", "http://10.0.0.5/lamp.jpg")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), Redirect)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        # Let the test server through as if it were public; the address it
+        # redirects to must still be refused
+        with mock.patch("auctions.images._is_public", lambda address: address.is_loopback):
+            with self.assertRaisesMessage(ImageError, "10.0.0.5 is not a public address"):
+                fetch_url(f"http://127.0.0.1:{server.server_port}/lamp.jpg")
+
+
+class BidHistoryTests(TestCase):
+    def setUp(self):
+        self.seller = create_user()
+        self.alice = create_user("alice")
+        self.bob = create_user("bob")
+        create_listings(self.seller, 2)
+        self.lamp, self.chair = Listing.objects.order_by("id")
+
+    def test_listing_history_is_newest_first_across_pages(self):
+        for price in range(1, 8):
+            place_bid(self.lamp.id, self.alice if price % 2 else self.bob, Decimal(price))
+        seen = []
+        cursor = None
+        while True:
+            page = listing_history(self.lamp.id, cursor, page_size=3)
+            seen += [bid.price for bid in page]
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, [Decimal(price) for price in range(7, 0, -1)])
+
+    def test_listing_history_json(self):
+        place_bid(self.lamp.id, self.alice, Decimal("2.00"))
+        place_bid(self.lamp.id, self.bob, Decimal("3.00"))
+        data = self.client.get(reverse("listing_bids", args=[self.lamp.id]), {"format": "json"}).json()
+        self.assertEqual([(bid["price"], bid["bidder"]) for bid in data["bids"]], [("3.00", "Bob Tester"), ("2.00", "Alice Tester")])
+        self.assertIsNone(data["next_cursor"])
+        self.assertContains(self.client.get(reverse("listing_bids", args=[self.lamp.id])), "Alice Tester")
+        self.assertEqual(self.client.get(reverse("listing_bids", args=[0])).status_code, 404)
+
+    def test_my_bids_are_grouped_by_listing_with_status(self):
+        place_bid(self.lamp.id, self.alice, Decimal("2.00"))
+        place_bid(self.lamp.id, self.alice, Decimal("3.00"))
+        place_bid(self.chair.id, self.alice, Decimal("2.00"))
+        place_bid(self.chair.id, self.bob, Decimal("5.00"))
+
+        summaries = list(user_bids(self.alice))
+        self.assertEqual([(summary["listing_id"], summary["bids"], summary["highest_bid"], summary["status"]) for summary in summaries], [
+            (self.chair.id, 1, Decimal("2.00"), "outbid"),
+            (self.lamp.id, 2, Decimal("3.00"), "winning"),
+        ])
+
+        close_expired_listings(now=timezone.now() + timedelta(days=30))
+        self.assertEqual([summary["status"] for summary in user_bids(self.alice)], ["lost", "won"])
+
+        self.client.force_login(self.alice)
+        data = self.client.get(reverse("my_bids"), {"format": "json"}).json()
+        self.assertEqual([(row["listing"], row["status"]) for row in data["listings"]], [(self.chair.id, "lost"), (self.lamp.id, "won")])
+        self.assertContains(self.client.get(reverse("my_bids")), "You won this auction")
+
+    def test_my_bids_paginate_by_latest_bid(self):
+        create_listings(self.seller, 30)
+        for listing in Listing.objects.order_by("id")[2:]:
+            place_bid(listing.id, self.alice, Decimal("2.00"))
+        place_bid(self.lamp.id, self.alice, Decimal("2.00"))
+
+        first = user_bids(self.alice, page_size=25)
+        second = user_bids(self.alice, first.next_cursor, page_size=25)
+        self.assertEqual(first.items[0]["listing_id"], self.lamp.id)
+        ids = [summary["listing_id"] for summary in first] + [summary["listing_id"] for summary in second]
+        self.assertEqual(len(ids), 31)
+        self.assertEqual(len(set(ids)), 31)
+        self.assertFalse(second.has_next)
+
+    def test_pages_run_a_constant_number_of_queries(self):
+        def count_queries(path):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(path)
+            return len(queries)
+
+        self.client.force_login(self.alice)
+        place_bid(self.lamp.id, self.alice, Decimal("2.00"))
+        few = count_queries(reverse("listing_bids", args=[self.lamp.id])), count_queries(reverse("my_bids"))
+        create_listings(self.seller, 40)
+        for listing in Listing.objects.order_by("id")[2:]:
+            place_bid(listing.id, self.alice, Decimal("2.00"))
+            place_bid(self.lamp.id, self.bob if listing.id % 2 else self.alice, Decimal(listing.id + 10))
+        many = count_queries(reverse("listing_bids", args=[self.lamp.id])), count_queries(reverse("my_bids"))
+        self.assertEqual(few, many)
+
+
+@benchmark
+class BidHistoryBenchmark(TestCase):
+    bids = 100000
+
+    def time_page(self, function, *args):
+        function(*args)
+        began = time.perf_counter()
+        for _ in range(20):
+            page = function(*args)
+        return (time.perf_counter() - began) / 20, page
+
+    def test_history_pages_on_listings_with_100k_bids(self):
+        seller = create_user()
+        bidders = [create_user(f"bidder{number}") for number in range(10)]
+        create_listings(seller, 2)
+        listings = list(Listing.objects.values_list("id", flat=True))
+        # A spread of other listings the bidders also bid on, for the grouped view
+        create_listings(seller, 500)
+        others = list(Listing.objects.exclude(pk__in=listings).values_list("id", flat=True))
+        Bid.objects.bulk_create(
+            (Bid(listing_id=listing_id, user=bidders[number % 10], price=Decimal(number + 1)) for listing_id in listings for number in range(self.bids)),
+            batch_size=5000
+        )
+        Bid.objects.bulk_create((Bid(listing_id=listing_id, user=bidders[0], price=Decimal(2)) for listing_id in others), batch_size=5000)
+
+        first, page = self.time_page(listing_history, listings[0], None, 50)
+        for _ in range(100):
+            page = listing_history(listings[0], page.next_cursor, 50)
+        deep, page = self.time_page(listing_history, listings[0], page.next_cursor, 50)
+        grouped, page = self.time_page(user_bids, bidders[0], None, 25)
+
+        benchmark_log.info(f"bid history: first page {first * 1000:.2f} ms, page 100 {deep * 1000:.2f} ms, my bids {grouped * 1000:.2f} ms "
+                           f"({self.bids} bids per listing)")
+        # Seeking the cursor in the index: deep pages cost the same as the first
+        self.assertLess(deep, first * 3 + 0.002)
+        self.assertEqual(len(page), 25)
+
+
+@override_settings(RATE_LIMITS={"bid": (3, 60), "comment": (3, 60), "watchlist": (3, 60)})
+class ThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = create_user()
+        self.bidder = create_user("bidder")
+        self.listing = Listing.objects.create(user=self.seller, title="Lamp", active=True, starting_price=Decimal("1.00"), current_price=Decimal("1.00"))
+        self.client.force_login(self.bidder)
+
+    def test_token_bucket(self):
+        self.assertEqual([take_token("bid", 1, now=1000) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(take_token("bid", 1, now=1000), 60)
+        self.assertAlmostEqual(take_token("bid", 1, now=1030), 30)
+        self.assertEqual(take_token("bid", 1, now=1060), 0)
+        self.assertGreater(take_token("bid", 1, now=1060), 0)
+        # Buckets are per user and per scope
+        self.assertEqual(take_token("bid", 2, now=1060), 0)
+        self.assertEqual(take_token("comment", 1, now=1060), 0)
+
+    def test_unlisted_scopes_are_unlimited(self):
+        with self.settings(RATE_LIMITS={}):
+            self.assertEqual([take_token("bid", 1) for _ in range(100)], [0] * 100)
+
+    def test_writes_beyond_the_rate_are_refused(self):
+        statuses = [self.client.post(reverse("bid", args=[self.listing.id]), {"price": price}).status_code for price in range(2, 7)]
+        self.assertEqual(statuses, [302, 302, 302, 429, 429])
+        self.assertEqual(Bid.objects.count(), 3)
+        response = self.client.post(reverse("comment", args=[self.listing.id]), {"text_comment": "Still allowed"})
+        self.assertEqual(response.status_code, 302)
+        response = self.client.post(reverse("bid", args=[self.listing.id]), {"price": 10})
+        self.assertEqual(response["Retry-After"], "60")
+
+    def test_repeated_submissions_run_once(self):
+        key = self.client.get(reverse("listing", args=[self.listing.id])).context["idempotency_key"]
+        first = self.client.post(reverse("bid", args=[self.listing.id]), {"price": 5, "idempotency_key": key})
+        again = self.client.post(reverse("bid", args=[self.listing.id]), {"price": 5, "idempotency_key": key})
+        self.assertEqual(Bid.objects.count(), 1)
+        self.assertEqual((again.status_code, again["Location"]), (first.status_code, first["Location"]))
+        self.assertEqual(again["Idempotent-Replay"], "true")
+
+        # Replays cost no tokens
+        for _ in range(5):
+            self.client.post(reverse("bid", args=[self.listing.id]), {"price": 6}, HTTP_IDEMPOTENCY_KEY="header-key")
+        self.assertEqual(Bid.objects.count(), 2)
+        self.assertEqual(self.client.post(reverse("bid", args=[self.listing.id]), {"price": 7}).status_code, 302)
+
+    def test_keys_are_per_user_and_errors_are_not_remembered(self):
+        for _ in range(3):
+            take_token("comment", self.bidder.id)
+        refused = self.client.post(reverse("comment", args=[self.listing.id]), {"text_comment": "Hi", "idempotency_key": "k"})
+        self.assertEqual(refused.status_code, 429)
+        cache.delete(f"ratelimit:comment:{self.bidder.id}")
+        self.client.post(reverse("comment", args=[self.listing.id]), {"text_comment": "Hi", "idempotency_key": "k"})
+        self.assertEqual(Comment.objects.count(), 1)
+
+        self.client.force_login(self.seller)
+        self.client.post(reverse("comment", args=[self.listing.id]), {"text_comment": "Hi", "idempotency_key": "k"})
+        self.assertEqual(Comment.objects.count(), 2)
+
+    def test_listing_forms_carry_a_key(self):
+        response = self.client.get(reverse("listing", args=[self.listing.id]))
+        self.assertContains(response, f'name="idempotency_key" value="{response.context["idempotency_key"]}"', count=4)
+        self.assertNotEqual(self.client.get(reverse("listing", args=[self.listing.id])).context["idempotency_key"], response.context["idempotency_key"])
+
+
+@override_settings(RATE_LIMITS={"bid": (5, 60), "comment": (5, 60), "watchlist": (5, 60)})
+class ConcurrentThrottleTests(TransactionTestCase):
+    threads = 20
+
+    def setUp(self):
+        cache.clear()
+        self.seller = create_user()
+        self.bidder = create_user("bidder")
+        self.listing = Listing.objects.create(user=self.seller, title="Lamp", active=True, starting_price=Decimal("1.00"), current_price=Decimal("1.00"))
+
+    def flood(self, name, data):
+        clients = []
+        for _ in range(self.threads):
+            client = Client()
+            client.force_login(self.bidder)
+            clients.append(client)
+        statuses = []
+        start = threading.Barrier(self.threads)
+
+        def post(client, number):
+            start.wait()
+            statuses.append(client.post(reverse(name, args=[self.listing.id]), data(number)).status_code)
+
+        self.assertEqual(run_in_threads([lambda client=client, number=number: post(client, number) for number, client in enumerate(clients)]), [])
+        return sorted(statuses)
+
+    def test_flood_of_distinct_bids_is_cut_to_the_burst(self):
+        statuses = self.flood("bid", lambda number: {"price": 10 + number})
+        self.assertEqual(statuses.count(429), self.threads - 5)
+        self.assertEqual(statuses.count(302), 5)
+        self.assertLessEqual(Bid.objects.count(), 5)
+        self.assertGreaterEqual(Bid.objects.count(), 1)
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.number_of_bids, Bid.objects.count())
+
+    def test_flood_of_one_submission_writes_once(self):
+        statuses = self.flood("bid", lambda number: {"price": 10, "idempotency_key": "double-click"})
+        self.assertEqual(statuses, [302] * self.threads)
+        self.assertEqual(Bid.objects.count(), 1)
+
+        statuses = self.flood("comment", lambda number: {"text_comment": "First!", "idempotency_key": "retry"})
+        self.assertEqual(statuses, [302] * self.threads)
+        self.assertEqual(Comment.objects.count(), 1)
+
+    def test_flood_of_watchlist_toggles(self):
+        statuses = self.flood("watchlist", lambda number: {"watchlist": "watchlist"})
+        self.assertEqual(statuses.count(302), 5)
+        self.assertEqual(list(Watchlist.objects.values_list("user_id", "active")), [(self.bidder.id, True)])
+
+
+class OutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user()
+        cls.alice = create_user("alice")
+        cls.bob = create_user("bob")
+        cls.watcher = create_user("watcher")
+
+    def setUp(self):
+        self.listing = Listing.objects.create(user=self.seller, title="Lamp", active=True, starting_price=Decimal("1.00"), current_price=Decimal("1.00"))
+
+    def sent(self):
+        return sorted((message.to[0].split("@")[0], message.subject) for message in mail.outbox)
+
+    def test_events_are_written_with_the_bid(self):
+        place_bid(self.listing.id, self.alice, Decimal("5.00"))
+        with self.assertRaises(BidError):
+            place_bid(self.listing.id, self.bob, Decimal("4.00"))
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            place_bid(self.listing.id, self.bob, Decimal("6.00"))
+            raise RuntimeError
+
+        self.assertEqual(list(Event.objects.values_list("kind", "bid__price")), [(Event.BID, Decimal("5.00"))])
+
+    def test_outbid_bidder_is_notified(self):
+        place_bid(self.listing.id, self.alice, Decimal("5.00"))
+        place_bid(self.listing.id, self.alice, Decimal("6.00"))
+        place_bid(self.listing.id, self.bob, Decimal("7.00"))
+
+        self.assertEqual(process_batch(), (3, 1))
+        self.assertEqual(self.sent(), [("alice", "You have been outbid on Lamp")])
+        self.assertIn("$7.00", mail.outbox[0].body)
+        self.assertIn(f"/listings/{self.listing.id}", mail.outbox[0].body)
+        self.assertFalse(Event.objects.filter(processed_at__isnull=True).exists())
+
+    def test_bid_matched_by_a_proxy_is_outbid(self):
+        place_proxy_bid(self.listing.id, self.alice, Decimal("100.00"))
+        process_batch()
+        mail.outbox.clear()
+
+        # Alice's proxy answers at Bob's price and, placed earlier, keeps the lead
+        place_bid(self.listing.id, self.bob, Decimal("100.00"))
+        process_batch()
+
+        self.assertEqual(self.sent(), [("bob", "You have been outbid on Lamp")])
+
+    def test_batch_sends_each_user_the_latest_state_once(self):
+        Watchlist.objects.create(user=self.watcher, listing=self.listing, active=True)
+        Watchlist.objects.create(user=self.bob, listing=self.listing, active=True)
+        for user, price in [(self.alice, "5.00"), (self.bob, "6.00"), (self.alice, "7.00")]:
+            place_bid(self.listing.id, user, Decimal(price))
+
+        process_batch()
+
+        # Alice is back on top, so only Bob was outbid, and not also told as a watcher
+        self.assertEqual(self.sent(), [("bob", "You have been outbid on Lamp"), ("watcher", "New bid on Lamp")])
+        self.assertIn("$7.00", mail.outbox[1].body if mail.outbox[1].to == [self.watcher.email] else mail.outbox[0].body)
+
+    def test_closing_notifies_the_winner_and_watchers(self):
+        Watchlist.objects.create(user=self.watcher, listing=self.listing, active=True)
+        Watchlist.objects.create(user=self.bob, listing=self.listing, active=False)
+        place_bid(self.listing.id, self.alice, Decimal("5.00"))
+        process_batch()
+        mail.outbox.clear()
+
+        close_by_seller(self.listing.id, self.seller)
+        process_batch()
+
+        self.assertEqual(self.sent(), [("alice", "You won Lamp"), ("watcher", "Lamp has closed")])
+
+    def test_expired_listings_get_one_event_each(self):
+        create_listings(self.seller, 5, ends_at=timezone.now() - timedelta(minutes=1), current_bidder=self.alice)
+        expired = list(Listing.objects.filter(title__startswith="Listing").order_by("id").values_list("id", flat=True))
+
+        close_expired_listings(batch_size=2)
+
+        self.assertEqual(sorted(Event.objects.filter(kind=Event.CLOSED).values_list("listing_id", flat=True)), expired)
+        self.assertEqual(process_batch(), (5, 5))
+        self.assertEqual(self.sent(), [("alice", f"You won Listing {number}") for number in range(5)])
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        prices = itertools.count(10)
+
+        def queries_for(bids):
+            for number in range(bids):
+                place_bid(self.listing.id, (self.alice, self.bob)[number % 2], Decimal(next(prices)))
+            with CaptureQueriesContext(connection) as queries:
+                process_batch()
+            return len(queries)
+
+        Watchlist.objects.create(user=self.watcher, listing=self.listing, active=True)
+        # Events, bids beaten, watchers, users, mark processed
+        self.assertEqual(queries_for(2), 5)
+        self.assertEqual(queries_for(50), 5)
+
+    def test_failed_delivery_leaves_the_batch_for_a_retry(self):
+        place_bid(self.listing.id, self.alice, Decimal("5.00"))
+        place_bid(self.listing.id, self.bob, Decimal("6.00"))
+
+        with mock.patch("auctions.notifications.EmailBackend.send", side_effect=OSError("mail server down")):
+            with self.assertRaises(OSError):
+                process_batch()
+        self.assertEqual(Event.objects.filter(processed_at__isnull=True).count(), 2)
+
+        self.assertEqual(process_batch(), (2, 1))
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(NOTIFICATION_BACKEND="auctions.tests.RecordingBackend")
+    def test_backend_is_pluggable(self):
+        RecordingBackend.sent = []
+        place_bid(self.listing.id, self.alice, Decimal("5.00"))
+        place_bid(self.listing.id, self.bob, Decimal("6.00"))
+
+        process_batch()
+
+        self.assertEqual([(notification.kind, notification.user) for notification in RecordingBackend.sent], [("outbid", self.alice)])
+        self.assertEqual(mail.outbox, [])
+
+    def test_metrics(self):
+        place_bid(self.listing.id, self.alice, Decimal("5.00"))
+        place_bid(self.listing.id, self.bob, Decimal("6.00"))
+        self.assertEqual(outbox.metrics()["backlog"], 2)
+        self.assertGreaterEqual(outbox.metrics()["oldest_pending_seconds"], 0)
+
+        process_batch(batch_size=1)
+        figures = outbox.metrics()
+        self.assertEqual((figures["backlog"], figures["processed_last_minute"]), (1, 1))
+
+        self.client.force_login(create_user("staff", is_staff=True))
+        self.assertEqual(self.client.get(reverse("perf")).json()["outbox"]["backlog"], 1)
+        metrics = self.client.get(reverse("perf"), {"format": "prometheus"}).content.decode()
+        self.assertIn("# TYPE auctions_outbox_backlog gauge\nauctions_outbox_backlog 1\n", metrics)
+
+    def test_command_drains_and_prunes(self):
+        for price in range(5, 10):
+            place_bid(self.listing.id, (self.alice, self.bob)[price % 2], Decimal(price))
+        Event.objects.filter(pk=Event.objects.order_by("id").first().pk).update(processed_at=timezone.now() - timedelta(days=30))
+        output = StringIO()
+
+        call_command("process_outbox", batch_size=2, stdout=output)
+
+        # Each batch of two tells whoever was outbid and is not back on top
+        self.assertIn("Processed 4 event(s) into 2 notification(s)", output.getvalue())
+        self.assertIn("backlog 0", output.getvalue())
+        self.assertEqual(Event.objects.count(), 4)
+
+
+class RecordingBackend:
+    sent = []
+
+    def send(self, notifications):
+        RecordingBackend.sent.extend(notifications)
+
+
+@benchmark
+class OutboxBenchmark(TestCase):
+    listings = 1000
+    bids_per_listing = 20
+
+    def test_drain_throughput(self):
+        seller = create_user()
+        bidders = [create_user(f"bidder{number}") for number in range(10)]
+        create_listings(seller, self.listings, number_of_bids=self.bids_per_listing, current_bidder=bidders[0])
+        listings = list(Listing.objects.all())
+        Watchlist.objects.bulk_create(Watchlist(user=bidder, listing=listing, active=True) for listing in listings for bidder in bidders[:3])
+        Bid.objects.bulk_create(
+            Bid(listing=listing, user=bidders[number % len(bidders)], price=Decimal(number + 1))
+            for listing in listings for number in range(self.bids_per_listing)
+        )
+        bids = Bid.objects.order_by("price", "id").values_list("id", "listing_id")
+        Event.objects.bulk_create(Event(kind=Event.BID, listing_id=listing_id, bid_id=bid_id) for bid_id, listing_id in bids)
+
+        began = time.perf_counter()
+        events = notifications = 0
+        while True:
+            batch_events, batch_notifications = process_batch(batch_size=500)
+            if not batch_events:
+                break
+            events += batch_events
+            notifications += batch_notifications
+        elapsed = time.perf_counter() - began
+
+        benchmark_log.info(f"drained {events} events into {notifications} notifications in {elapsed:.2f}s ({events / elapsed:.0f} events/s)")
+        self.assertEqual(events, self.listings * self.bids_per_listing)
+        self.assertEqual(outbox.metrics()["backlog"], 0)
+
+
+@override_settings(**CACHED_USERS)
+class ApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user()
+        cls.bidder = create_user("bidder")
+        create_listings(cls.seller, 60, description="Long enough to be worth leaving out", category="BOK")
+        cls.listing = Listing.objects.create(user=cls.seller, title="Lamp", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"), category="HOM")
+
+    def setUp(self):
+        cache.clear()
+
+    def test_listings_pages_and_query_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            first = self.client.get(reverse("api_listings"), {"limit": 50}).json()
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(first["results"]), 50)
+        self.assertEqual(first["results"][0]["seller"], "seller")
+
+        with self.assertNumQueries(1):
+            second = self.client.get(reverse("api_listings"), {"limit": 50, "cursor": first["next_cursor"]}).json()
+        self.assertEqual(len(second["results"]), 11)
+        self.assertIsNone(second["next_cursor"])
+
+        self.assertEqual(self.client.get(reverse("api_listings"), {"category": "HOM"}).json()["results"][0]["id"], self.listing.id)
+
+    def test_sparse_fields_load_only_their_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("api_listings"), {"fields": "id,title,current_price"})
+        self.assertEqual(set(response.json()["results"][0]), {"id", "title", "current_price"})
+        self.assertNotIn("description", queries[0]["sql"])
+        self.assertNotIn("auctions_user", queries[0]["sql"])
+
+        response = self.client.get(reverse("api_listings"), {"fields": "id,price"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("price", response.json()["error"])
+
+    def test_responses_are_gzipped(self):
+        response = self.client.get(reverse("api_listings"), HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))["results"]), 25)
+
+    def test_list_etag(self):
+        response = self.client.get(reverse("api_listings"))
+        self.assertEqual(self.client.get(reverse("api_listings"), HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+        Listing.objects.create(user=self.seller, title="Desk", active=True, starting_price=Decimal("1.00"), current_price=Decimal("1.00"))
+        self.assertEqual(self.client.get(reverse("api_listings"), HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200)
+
+    def test_detail_etag_is_checked_without_queries(self):
+        url = reverse("api_listing", args=[self.listing.id])
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.json()["title"], "Lamp")
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            place_bid(self.listing.id, self.bidder, Decimal("12.00"))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["current_price"], "12.00")
+
+    def test_closed_listings_are_shown_to_the_seller_and_winner_only(self):
+        place_bid(self.listing.id, self.bidder, Decimal("12.00"))
+        with self.captureOnCommitCallbacks(execute=True):
+            close_by_seller(self.listing.id, self.seller)
+        url = reverse("api_listing", args=[self.listing.id])
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_login(self.bidder)
+        self.assertEqual(self.client.get(url, {"fields": "winner"}).json(), {"winner": "bidder"})
+
+    def test_closed_listing_without_a_winner_is_hidden_from_anonymous_users(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            close_by_seller(self.listing.id, self.seller)
+        url = reverse("api_listing", args=[self.listing.id])
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(reverse("listing", args=[self.listing.id])).status_code, 404)
+        self.client.force_login(self.seller)
+        self.assertEqual(self.client.get(url, {"fields": "active"}).json(), {"active": False})
+
+    def test_bidding(self):
+        url = reverse("api_bids", args=[self.listing.id])
+        self.assertEqual(self.client.post(url, {"price": "12"}).status_code, 401)
+
+        self.client.force_login(self.bidder)
+        record_activity(self.listing.id, "watch")
+        # Only the bid service's eight; the session and user come from the cache
+        with self.assertNumQueries(8):
+            response = self.client.post(url, {"price": "12"}, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["price"], "12.00")
+
+        response = self.client.post(url, {"price": "11"}, content_type="application/json")
+        self.assertEqual(response.status_code, 409)
+        self.assertIn("greater than the current bid", response.json()["error"])
+
+        response = self.client.post(url, {"price": "lots"}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("price", response.json()["errors"])
+
+        self.assertEqual(self.client.post(reverse("api_bids", args=[0]), {"price": "12"}).status_code, 404)
+
+        with self.assertNumQueries(1):
+            history = self.client.get(url, {"fields": "price,bidder"}).json()
+        self.assertEqual(history["results"], [{"price": "12.00", "bidder": "bidder"}])
+
+    def test_writes_need_the_token_from_the_csrf_endpoint(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.bidder)
+        url = reverse("api_bids", args=[self.listing.id])
+        self.assertEqual(client.post(url, {"price": "12"}, content_type="application/json").status_code, 403)
+
+        response = client.get(reverse("api_csrf"))
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertIn("csrftoken", response.cookies)
+        token = response.json()["csrf_token"]
+        self.assertEqual(client.post(url, {"price": "12"}, content_type="application/json", HTTP_X_CSRFTOKEN=token).status_code, 201)
+
+    def test_writes_skip_the_etag(self):
+        self.client.force_login(self.bidder)
+        with mock.patch("auctions.api.listing_version") as version:
+            bid = self.client.post(reverse("api_bids", args=[self.listing.id]), {"price": "12"}, content_type="application/json", HTTP_IF_NONE_MATCH="*")
+            comment = self.client.post(reverse("api_comments", args=[self.listing.id]), {"text_comment": "Hi"}, HTTP_IF_MATCH='"stale"')
+        self.assertEqual((bid.status_code, comment.status_code), (201, 201))
+        self.assertNotIn("ETag", bid)
+        version.assert_not_called()
+
+    def test_comments(self):
+        url = reverse("api_comments", args=[self.listing.id])
+        self.client.force_login(self.bidder)
+
+        self.assertEqual(self.client.post(url, {"text_comment": ""}).status_code, 400)
+        Comment.objects.bulk_create(Comment(text_comment=f"Comment {number}", user=self.seller, listing=self.listing) for number in range(29))
+        response = self.client.post(url, {"text_comment": "Comment 29"})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["author"], "bidder")
+        self.client.logout()
+
+        with self.assertNumQueries(1):
+            first = self.client.get(url).json()
+        second = self.client.get(url, {"cursor": first["next_cursor"]}).json()
+        self.assertEqual((first["results"][0]["text"], first["results"][0]["author"]), ("Comment 29", "bidder"))
+        self.assertEqual(len(first["results"]) + len(second["results"]), 30)
+        self.assertEqual(self.client.get(reverse("api_comments", args=[0])).status_code, 404)
+
+    def test_watchlist(self):
+        url = reverse("api_watchlist_item", args=[self.listing.id])
+        self.assertEqual(self.client.put(url).status_code, 401)
+        self.client.force_login(self.bidder)
+
+        self.assertEqual(self.client.put(url).json(), {"listing": self.listing.id, "watched": True})
+        # The listing check, the update and, as nothing changed, whether it exists
+        with self.assertNumQueries(3):
+            self.assertEqual(self.client.put(url).status_code, 200)
+
+        with self.assertNumQueries(1):
+            watched = self.client.get(reverse("api_watchlist"), {"fields": "id"}).json()
+        self.assertEqual(watched["results"], [{"id": self.listing.id}])
+
+        self.client.delete(url)
+        self.assertEqual(self.client.get(reverse("api_watchlist")).json()["results"], [])
+        self.assertEqual(self.client.put(reverse("api_watchlist_item", args=[0])).status_code, 404)
+
+    def test_method_not_allowed(self):
+        response = self.client.delete(reverse("api_listings"))
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(response["Allow"], "GET, HEAD")
+
+
+class CommentThreadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user()
+        cls.commenter = create_user("commenter")
+        cls.listing = Listing.objects.create(user=cls.seller, title="Lamp", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"))
+        cls.commenters = [create_user(f"commenter{number}") for number in range(5)]
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse("listing", args=[self.listing.id])
+
+    def add_comments(self, count):
+        Comment.objects.bulk_create(
+            Comment(listing=self.listing, user=self.commenters[number % 5], text_comment=f"Comment {number}") for number in range(count)
+        )
+        # bulk_create skips the signal that counts comments
+        Listing.objects.filter(pk=self.listing.id).update(comment_count=F("comment_count") + count)
+
+    def test_count_follows_comments(self):
+        self.client.force_login(self.commenter)
+        self.client.post(reverse("comment", args=[self.listing.id]), {"text_comment": "From the page"})
+        self.client.post(reverse("api_comments", args=[self.listing.id]), {"text_comment": "From the API"})
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.comment_count, 2)
+
+        Comment.objects.filter(text_comment="From the page").get().delete()
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.comment_count, 1)
+        self.assertContains(self.client.get(self.url), "Comments (1)")
+
+    def test_page_shows_the_latest_comments_in_constant_queries(self):
+        self.add_comments(3)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(self.url)
+
+        self.add_comments(500)
+        cache.clear()
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(self.url)
+
+        self.assertEqual(len(many), len(few))
+        self.assertEqual(len(response.context["comments"]), 10)
+        self.assertContains(response, "Comment 499")
+        self.assertNotContains(response, "Comment 489")
+        self.assertContains(response, "Load more comments")
+
+    def test_cursor_order_is_stable_within_a_second(self):
+        self.add_comments(120)
+        # Comments made in the same instant are still ordered, by id
+        Comment.objects.update(created=timezone.now())
+        url = reverse("listing_comments", args=[self.listing.id])
+
+        seen = []
+        cursor = None
+        while True:
+            with self.assertNumQueries(2):
+                page = self.client.get(url, {"format": "json", **({"cursor": cursor} if cursor else {})}).json()
+            seen += [comment["text"] for comment in page["comments"]]
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+
+        self.assertEqual(seen, [f"Comment {number}" for number in reversed(range(120))])
+
+    def test_comments_page(self):
+        self.add_comments(60)
+        response = self.client.get(reverse("listing_comments", args=[self.listing.id]))
+        self.assertEqual(len(response.context["comments"]), 50)
+        self.assertContains(response, "60 comment(s)")
+        self.assertContains(response, "Older comments")
+        self.assertEqual(self.client.get(reverse("listing_comments", args=[0])).status_code, 404)
+
+
+class ProxyBidTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user()
+        cls.alice = create_user("alice")
+        cls.bob = create_user("bob")
+        cls.carol = create_user("carol")
+
+    def setUp(self):
+        self.listing = Listing.objects.create(user=self.seller, title="Lamp", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"))
+
+    def state(self):
+        self.listing.refresh_from_db()
+        return self.listing.current_bidder, self.listing.current_price, self.listing.number_of_bids
+
+    def prices(self):
+        return list(Bid.objects.filter(listing=self.listing).order_by("id").values_list("user__username", "price"))
+
+    def test_single_proxy_opens_at_the_starting_price(self):
+        place_proxy_bid(self.listing.id, self.alice, Decimal("50"))
+        self.assertEqual(self.state(), (self.alice, Decimal("10.00"), 1))
+
+    def test_competing_maxima_resolve_at_once(self):
+        place_proxy_bid(self.listing.id, self.alice, Decimal("50"))
+        place_proxy_bid(self.listing.id, self.bob, Decimal("30"))
+        self.assertEqual(self.state(), (self.alice, Decimal("31.00"), 3))
+
+        bids = place_proxy_bid(self.listing.id, self.carol, Decimal("80"))
+        self.assertEqual([bid.user for bid in bids], [self.alice, self.carol])
+        self.assertEqual(self.state(), (self.carol, Decimal("51.00"), 5))
+        self.assertEqual(self.prices(), [
+            ("alice", Decimal("10.00")), ("bob", Decimal("30.00")), ("alice", Decimal("31.00")),
+            ("alice", Decimal("50.00")), ("carol", Decimal("51.00")),
+        ])
+
+    def test_earlier_of_equal_maxima_wins(self):
+        place_proxy_bid(self.listing.id, self.alice, Decimal("50"))
+        place_proxy_bid(self.listing.id, self.bob, Decimal("50"))
+        self.assertEqual(self.state(), (self.alice, Decimal("50.00"), 2))
+
+    def test_leader_raising_the_maximum_writes_no_bid(self):
+        place_proxy_bid(self.listing.id, self.alice, Decimal("50"))
+        self.assertEqual(place_proxy_bid(self.listing.id, self.alice, Decimal("70")), [])
+        self.assertEqual(ProxyBid.objects.get(user=self.alice).maximum, Decimal("70"))
+
+        with self.assertRaisesMessage(BidError, "only be raised"):
+            place_proxy_bid(self.listing.id, self.alice, Decimal("60"))
+
+    def test_rejected_maximum_is_not_kept(self):
+        place_bid(self.listing.id, self.bob, Decimal("20"))
+        with self.assertRaisesMessage(BidError, "greater than the current bid"):
+            place_proxy_bid(self.listing.id, self.alice, Decimal("15"))
+        Listing.objects.filter(pk=self.listing.id).update(active=False)
+        with self.assertRaisesMessage(BidError, "closed"):
+            place_proxy_bid(self.listing.id, self.alice, Decimal("50"))
+        self.assertFalse(ProxyBid.objects.exists())
+
+    def test_literal_bid_is_answered_in_the_same_update(self):
+        place_proxy_bid(self.listing.id, self.alice, Decimal("50"))
+
+        # Savepoint, UPDATE, state, the bid, the answer's bidder and bid, events, stats,
+        # trending score, release
+        with self.assertNumQueries(10):
+            place_bid(self.listing.id, self.bob, Decimal("20"))
+        self.assertEqual(self.state(), (self.alice, Decimal("21.00"), 3))
+
+        place_bid(self.listing.id, self.bob, Decimal("49.50"))
+        self.assertEqual(self.state(), (self.alice, Decimal("50.00"), 5))
+
+        place_bid(self.listing.id, self.bob, Decimal("60"))
+        self.assertEqual(self.state(), (self.bob, Decimal("60.00"), 6))
+
+    def test_literal_bid_equal_to_a_maximum_leaves_the_proxy_leading(self):
+        place_proxy_bid(self.listing.id, self.alice, Decimal("100"))
+        place_bid(self.listing.id, self.bob, Decimal("100"))
+        self.assertEqual(self.state(), (self.alice, Decimal("100.00"), 3))
+        self.assertEqual(self.prices(), [("alice", Decimal("10.00")), ("bob", Decimal("100.00")), ("alice", Decimal("100.00"))])
+
+    def test_query_count_does_not_grow_with_proxies(self):
+        users = [create_user(f"proxy{number}") for number in range(200)]
+        place_proxy_bid(self.listing.id, self.alice, Decimal("10000"))
+
+        # Savepoint, proxy UPDATE, savepoint, INSERT, release, listing, leaders,
+        # two bids, listing UPDATE, bidder, events, stats, trending score, release
+        with self.assertNumQueries(15):
+            place_proxy_bid(self.listing.id, users[0], Decimal("20"))
+        ProxyBid.objects.bulk_create(ProxyBid(listing=self.listing, user=user, maximum=Decimal(21 + number)) for number, user in enumerate(users[1:-1]))
+        with self.assertNumQueries(15):
+            place_proxy_bid(self.listing.id, users[-1], Decimal("5000"))
+        self.assertEqual(self.state()[1], Decimal("5001.00"))
+
+    def test_leaders_are_read_from_the_index(self):
+        leaders = ProxyBid.objects.filter(listing_id=self.listing.id).order_by("-maximum", "placed", "id").values("user_id", "maximum")[:2]
+        with connection.cursor() as cursor:
+            sql, params = leaders.query.sql_with_params()
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            plan = " ".join(str(row) for row in cursor.fetchall())
+        self.assertIn("proxy_listing_maximum", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_matches_a_brute_force_bid_war(self):
+        generator = random.Random(7)
+        users = [create_user(f"proxy{number}") for number in range(40)]
+        accepted = []
+        for user in users:
+            maximum = Decimal(generator.randint(1000, 9000)) / 100
+            try:
+                place_proxy_bid(self.listing.id, user, maximum)
+            except BidError:
+                continue
+            accepted.append((maximum, user))
+
+        # Each proxy keeps bidding one increment over whoever leads until its
+        # maximum runs out; what is left is the highest maximum, earliest first,
+        # just above the runner-up's
+        ranked = sorted(accepted, key=lambda entry: -entry[0])
+        (top, winner), (second, _) = ranked[0], ranked[1]
+        self.assertEqual(self.state()[:2], (winner, min(top, second + 1)))
+
+        prices = [price for user, price in self.prices()]
+        self.assertEqual(prices, sorted(set(prices)))
+        self.assertEqual(self.state()[2], len(prices))
+
+    def test_views(self):
+        self.client.force_login(self.alice)
+        self.client.post(reverse("proxy_bid", args=[self.listing.id]), {"maximum": "50"})
+        self.assertContains(self.client.get(reverse("listing", args=[self.listing.id])), "Your maximum bid is $50")
+
+        self.client.force_login(self.bob)
+        response = self.client.post(reverse("api_bids", args=[self.listing.id]), {"maximum": "30"}, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([bid["price"] for bid in response.json()["bids"]], ["30.00", "31.00"])
+        response = self.client.post(reverse("proxy_bid", args=[self.listing.id]), {"maximum": "40"}, follow=True)
+        self.assertContains(response, "you have been outbid")
+
+
+@benchmark
+class ProxyBidBenchmark(TestCase):
+    proxies = 5000
+
+    def test_competing_proxies_on_one_listing(self):
+        seller = create_user()
+        User.objects.bulk_create(User(username=f"proxy{number}", email=f"proxy{number}@example.com", first_name="Proxy", last_name=str(number)) for number in range(self.proxies))
+        users = list(User.objects.filter(username__startswith="proxy").order_by("id"))
+        listing = Listing.objects.create(user=seller, title="Lamp", active=True, starting_price=Decimal("1.00"), current_price=Decimal("1.00"))
+        generator = random.Random(0)
+
+        timings = []
+        rejected = 0
+        for number, user in enumerate(users):
+            began = time.perf_counter()
+            try:
+                # Climbing maxima that overlap, so most proxies take over the lead
+                place_proxy_bid(listing.id, user, Decimal(100 + number * 100 + generator.randint(0, 250)) / 100)
+            except BidError:
+                rejected += 1
+            timings.append(time.perf_counter() - began)
+        elapsed = sum(timings)
+
+        listing.refresh_from_db()
+        first, last = timings[:500], timings[-500:]
+        benchmark_log.info(f"{self.proxies} competing proxies in {elapsed:.2f}s ({self.proxies / elapsed:.0f} proxies/s), "
+                           f"{rejected} below the price; {listing.number_of_bids} bids written; "
+                           f"first 500 {sum(first) / 500 * 1000:.2f}ms each, last 500 {sum(last) / 500 * 1000:.2f}ms each")
+        self.assertEqual(listing.number_of_bids, Bid.objects.filter(listing=listing).count())
+        self.assertLess(sum(last), sum(first) * 3)
+
+
+@override_settings(**CACHED_USERS)
+class AdminTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = create_user("staff", is_staff=True, is_superuser=True)
+        cls.bidder = create_user("bidder")
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.staff)
+
+    def add_rows(self, count):
+        listings = create_listings(self.staff, count)
+        listings = list(Listing.objects.order_by("-id")[:count])
+        Bid.objects.bulk_create(Bid(user=self.bidder, listing=listing, price=Decimal("2.00")) for listing in listings)
+        Comment.objects.bulk_create(Comment(user=self.bidder, listing=listing, text_comment="Nice") for listing in listings)
+        Watchlist.objects.bulk_create(Watchlist(user=self.bidder, listing=listing, active=True) for listing in listings)
+
+    def test_change_lists_take_the_same_queries_however_many_rows(self):
+        # Estimated count, the page with its relations joined; the listings' date
+        # hierarchy adds its date range and the dates under it
+        pages = [("user", "", 2), ("listing", "", 4), ("listing", "?active__exact=1&category__exact=OTH", 4),
+                 ("bid", "", 2), ("comment", "", 2), ("watchlist", "", 2), ("watchlist", "?active__exact=1", 2)]
+        for rows in (3, 30):
+            self.add_rows(rows)
+            for model, query, queries in pages:
+                with self.subTest(model=model, query=query, rows=rows), CaptureQueriesContext(connection) as captured:
+                    response = self.client.get(reverse(f"admin:auctions_{model}_changelist") + query)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(captured), queries)
+                self.assertFalse([query for query in captured if query["sql"].startswith("SELECT COUNT(*) FROM \"")])
+
+    def test_estimated_count(self):
+        self.add_rows(5)
+        self.assertEqual(EstimatedCountPaginator(Listing.objects.order_by("id"), 2).count, Listing.objects.latest("id").id)
+        paginator = EstimatedCountPaginator(Listing.objects.filter(active=True).order_by("id"), 2)
+        paginator.count_limit = 3
+        self.assertEqual(paginator.count, 3)
+
+    def test_related_fields_are_not_dropdowns(self):
+        self.add_rows(1)
+        response = self.client.get(reverse("admin:auctions_bid_change", args=[Bid.objects.get().id]))
+        self.assertContains(response, "vForeignKeyRawIdAdminField")
+        self.assertContains(response, "admin-autocomplete")
+        self.assertNotContains(response, "<option value=\"%d\">" % self.staff.id)
+
+    def test_close_and_reopen_actions(self):
+        create_listings(self.staff, 4)
+        rebuild_category_stats()
+        listings = list(Listing.objects.order_by("id"))
+        place_bid(listings[0].id, self.bidder, Decimal("5.00"))
+        Listing.objects.update(ends_at=timezone.now() - timedelta(minutes=1))
+        changelist = reverse("admin:auctions_listing_changelist")
+        version = listing_version(listings[0].id)
+
+        # The change list's count, then the selection, savepoint, UPDATE, stats,
+        # events, release, and the empty re-read
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as captured:
+            self.client.post(changelist, {"action": "close", "_selected_action": [listing.id for listing in listings]})
+        self.assertFalse(Listing.objects.filter(active=True).exists())
+        self.assertEqual(Listing.objects.get(pk=listings[0].id).winner, self.bidder)
+        self.assertEqual(len(captured), 8)
+        self.assertEqual(Event.objects.filter(kind=Event.CLOSED).count(), 4)
+        self.assertEqual(CategoryStats.objects.get(category="OTH").active_count, 0)
+        self.assertNotEqual(listing_version(listings[0].id), version)
+        closing = len(captured)
+
+        with mock.patch("auctions.expiry.broker.publish") as publish, self.captureOnCommitCallbacks(execute=True):
+            self.client.post(changelist, {"action": "reopen", "_selected_action": [listing.id for listing in listings[:2]]})
+        # Live pages get the price and bidder back, not just the open flag
+        publish.assert_any_call(listing_channel(listings[0].id), {
+            "price": "5.00", "number_of_bids": 1, "current_bidder": "Bidder Tester", "current_bidder_id": self.bidder.id, "active": True,
+        })
+        reopened = Listing.objects.get(pk=listings[0].id)
+        self.assertTrue(reopened.active)
+        self.assertIsNone(reopened.winner)
+        self.assertGreater(reopened.ends_at, timezone.now())
+        self.assertEqual(CategoryStats.objects.get(category="OTH").active_count, 2)
+        self.assertEqual(rebuild_category_stats(fix=False), [])
+
+        # Selecting more listings in the same category costs no more queries
+        create_listings(self.staff, 20)
+        selected = list(Listing.objects.values_list("id", flat=True))
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as captured:
+            self.client.post(changelist, {"action": "close", "_selected_action": selected})
+        self.assertEqual(len(captured), closing)
+
+
+class ArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user()
+        cls.bidder = create_user("bidder")
+        cls.watcher = create_user("watcher")
+
+    def setUp(self):
+        cache.clear()
+
+    def closed_listing(self, days_ago=100, bids=2):
+        listing = Listing.objects.create(user=self.seller, title="Lamp", description="A brass lamp", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"))
+        for number in range(bids):
+            place_bid(listing.id, self.bidder, Decimal(11 + number))
+        add_comment(listing.id, self.watcher, "Still available?")
+        set_watched(self.watcher, listing.id, True)
+        close_by_seller(listing.id, self.seller)
+        Listing.objects.filter(pk=listing.id).update(ends_at=timezone.now() - timedelta(days=days_ago))
+        return listing
+
+    def test_moves_old_closed_listings_with_their_rows(self):
+        old = self.closed_listing()
+        recent = self.closed_listing(days_ago=10)
+        running = Listing.objects.create(user=self.seller, title="Desk", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"))
+        ProxyBid.objects.create(listing=old, user=self.watcher, maximum=Decimal("12"))
+        Event.objects.update(processed_at=timezone.now())
+
+        self.assertEqual(list(archive.archive_batches()), [{"listings": 1, "bids": 2, "comments": 1, "watchlists": 1}])
+
+        self.assertEqual(set(Listing.objects.values_list("id", flat=True)), {recent.id, running.id})
+        archived = ArchivedListing.objects.get()
+        self.assertEqual((archived.id, archived.title, archived.winner, archived.current_price, archived.comment_count), (old.id, "Lamp", self.bidder, Decimal("12.00"), 1))
+        self.assertEqual(list(ArchivedBid.objects.order_by("id").values_list("price", flat=True)), [Decimal("11.00"), Decimal("12.00")])
+        self.assertEqual(ArchivedComment.objects.get().text_comment, "Still available?")
+        self.assertTrue(ArchivedWatchlist.objects.get(user=self.watcher).active)
+        for model in (Bid, Comment, Watchlist, Event, ProxyBid):
+            self.assertFalse(model.objects.filter(listing_id=old.id).exists())
+        self.assertEqual([listing.id for listing in search_listings("brass")], [])
+
+    def test_waits_for_pending_notifications(self):
+        self.closed_listing()
+        self.assertEqual(list(archive.archive_batches()), [])
+        Event.objects.update(processed_at=timezone.now())
+        self.assertEqual(len(list(archive.archive_batches())), 1)
+
+    def test_dry_run_and_resuming(self):
+        for _ in range(5):
+            self.closed_listing(bids=1)
+        Event.objects.update(processed_at=timezone.now())
+
+        output = StringIO()
+        call_command("archive_listings", "--dry-run", stdout=output)
+        self.assertIn("Would archive 5 listings, 5 bids, 5 comments, 5 watchlists", output.getvalue())
+        self.assertEqual(ArchivedListing.objects.count(), 0)
+
+        # Stopping part way leaves nothing half moved, and the next run picks up the rest
+        call_command("archive_listings", "--batch-size", "2", "--limit", "3", stdout=StringIO())
+        self.assertEqual((Listing.objects.count(), ArchivedListing.objects.count(), ArchivedBid.objects.count()), (2, 3, 3))
+        output = StringIO()
+        call_command("archive_listings", stdout=output)
+        self.assertIn("Archived 2 listings, 2 bids, 2 comments, 2 watchlists", output.getvalue())
+        self.assertEqual(archive.plan(), {"listings": 0, "bids": 0, "comments": 0, "watchlists": 0})
+
+    def test_batches_take_the_same_queries_however_many_bids(self):
+        for bids in (1, 10):
+            self.closed_listing(bids=bids)
+            Event.objects.update(processed_at=timezone.now())
+            # Pick the batch, then savepoint, copy the listings, read back which moved,
+            # copy bids, comments and watchlists, clear category stats, eight deletes, release;
+            # plus the final empty pick
+            with self.assertNumQueries(18):
+                list(archive.archive_batches())
+
+    def test_batches_are_picked_from_the_index(self):
+        sql, params = archive.archivable().order_by("ends_at", "id").values("id")[:500].query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            plan = " ".join(str(row) for row in cursor.fetchall())
+        self.assertIn("listing_closed_ends_at", plan)
+
+    def test_winner_page_falls_back_to_the_archive(self):
+        listing = self.closed_listing()
+        Event.objects.update(processed_at=timezone.now())
+        list(archive.archive_batches())
+
+        self.client.force_login(self.bidder)
+        response = self.client.get(reverse("listing", args=[listing.id]))
+        self.assertContains(response, "Congratulations! You are the winner of this auction!")
+        self.assertContains(response, "$12.00")
+        self.client.force_login(self.seller)
+        self.assertContains(self.client.get(reverse("listing", args=[listing.id])), "Bidder Tester is the winner")
+        self.client.force_login(self.watcher)
+        self.assertEqual(self.client.get(reverse("listing", args=[listing.id])).status_code, 404)
+        self.assertEqual(self.client.get(reverse("listing", args=[listing.id + 1])).status_code, 404)
+
+    def test_api_falls_back_to_the_archive(self):
+        listing = self.closed_listing()
+        Event.objects.update(processed_at=timezone.now())
+        list(archive.archive_batches())
+        url = reverse("api_listing", args=[listing.id])
+
+        self.client.force_login(self.bidder)
+        body = self.client.get(url).json()
+        self.assertEqual((body["id"], body["active"], body["current_price"], body["winner"]), (listing.id, False, "12.00", "bidder"))
+        self.assertEqual(self.client.get(url, {"fields": "title,active"}).json(), {"title": "Lamp", "active": False})
+        self.client.force_login(self.watcher)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_bid_history_falls_back_to_the_archive(self):
+        listing = self.closed_listing()
+        Event.objects.update(processed_at=timezone.now())
+        list(archive.archive_batches())
+        running = Listing.objects.create(user=self.seller, title="Desk", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"))
+        place_bid(running.id, self.bidder, Decimal("20"))
+
+        response = self.client.get(reverse("listing_bids", args=[listing.id]))
+        self.assertContains(response, "2 bid(s)")
+        self.assertContains(response, "$12.00")
+        body = self.client.get(reverse("api_bids", args=[listing.id])).json()
+        self.assertEqual([bid["price"] for bid in body["results"]], ["12.00", "11.00"])
+        self.assertEqual(self.client.get(reverse("api_bids", args=[running.id + 1])).status_code, 404)
+
+        # The archived listing comes after the running one, and one cursor pages through both
+        first = user_bids(self.bidder, page_size=1)
+        second = user_bids(self.bidder, first.next_cursor, page_size=1)
+        self.assertEqual([summary["listing_id"] for summary in first], [running.id])
+        self.assertEqual([(summary["listing_id"], summary["highest_bid"], summary["bids"], summary["status"]) for summary in second], [(listing.id, Decimal("12.00"), 2, "won")])
+        self.assertFalse(second.has_next)
+
+
+@benchmark
+class ArchiveBenchmark(TestCase):
+    listings = 20000
+    requests = 100
+
+    def test_hot_paths_before_and_after_archiving(self):
+        data = benchmark_data.generate(listings=self.listings)
+        # Close 90% of the listings well past the retention window
+        closed = data.listings[:len(data.listings) * 9 // 10]
+        Listing.objects.filter(pk__in=closed).update(active=False, ends_at=timezone.now() - timedelta(days=365), winner=F("current_bidder"))
+        rebuild_category_stats()
+        running = benchmark_data.DataSet(data.users, data.listings[len(closed):], data.password)
+        user = User.objects.get(pk=data.users[0])
+
+        def measure():
+            cache.clear()
+            return benchmark_runner.run(benchmark_runner.default_scenarios(running), requests=self.requests, user=user)["scenarios"]
+
+        before = measure()
+        began = time.perf_counter()
+        moved = {}
+        for batch in archive.archive_batches(batch_size=1000):
+            for kind, count in batch.items():
+                moved[kind] = moved.get(kind, 0) + count
+        elapsed = time.perf_counter() - began
+        after = measure()
+
+        benchmark_log.info(f"archived {moved} in {elapsed:.2f}s ({moved['listings'] / elapsed:.0f} listings/s)")
+        for name in before:
+            benchmark_log.info(f"{name:>15}: p50 {before[name]['p50_ms']:.2f}ms -> {after[name]['p50_ms']:.2f}ms, "
+                               f"p95 {before[name]['p95_ms']:.2f}ms -> {after[name]['p95_ms']:.2f}ms")
+        self.assertEqual(moved["listings"], len(closed))
+        self.assertEqual(Listing.objects.count(), len(data.listings) - len(closed))
+
+
+class TrendingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user()
+        cls.bidder = create_user("bidder")
+
+    def setUp(self):
+        cache.clear()
+
+    def score(self, listing_id, now=None):
+        return TrendingScore.objects.filter(listing_id=listing_id).annotate(current=trending.current_score(now)).values_list("current", flat=True).get()
+
+    def test_matches_a_brute_force_recomputation(self):
+        categories = ["BOK", "ELE", "TOY"]
+        for category in categories:
+            create_listings(self.seller, 8, category=category)
+        listings = dict(Listing.objects.values_list("id", "category"))
+        generator = random.Random(3)
+        half_life = trending.half_life().total_seconds()
+        weights = {"bid": 3.0, "watch": 2.0, "comment": 1.0}
+
+        # Four days of activity, crossing period boundaries, with a few events
+        # from a lagging clock
+        start = timezone.now() - timedelta(days=4)
+        events = []
+        for number in range(600):
+            at = start + timedelta(minutes=number * 9 + generator.randint(0, 8))
+            if generator.random() < 0.05:
+                at -= timedelta(hours=generator.randint(1, 30))
+            events.append((generator.choice(list(listings)), generator.choice(list(weights)), at))
+        for listing_id, kind, at in events:
+            trending.record_activity(listing_id, kind, now=at)
+
+        now = start + timedelta(days=4, hours=1)
+        trending.refresh(now=now, size=5)
+
+        expected = {}
+        for listing_id, kind, at in events:
+            expected[listing_id] = expected.get(listing_id, 0) + weights[kind] * 2 ** -((now - at).total_seconds() / half_life)
+        for category in [""] + categories:
+            ranked = sorted(((score, listing_id) for listing_id, score in expected.items() if not category or listings[listing_id] == category), reverse=True)[:5]
+            stored = TrendingListing.objects.filter(category=category).order_by("position").values_list("listing_id", "score")
+            self.assertEqual([listing_id for listing_id, score in stored], [listing_id for score, listing_id in ranked])
+            for (listing_id, score), (brute, _) in zip(stored, ranked):
+                self.assertAlmostEqual(score / brute, 1, places=9)
+
+    def test_writes_add_to_the_score(self):
+        listing = Listing.objects.create(user=self.seller, title="Lamp", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"))
+        with CaptureQueriesContext(connection) as captured:
+            place_bid(listing.id, self.bidder, Decimal("10.00"))
+        self.assertFalse([query for query in captured if "auctions_bid" in query["sql"] and "COUNT" in query["sql"]])
+        self.assertAlmostEqual(self.score(listing.id), 3.0, places=3)
+
+        add_comment(listing.id, self.bidder, "Does it work?")
+        set_watched(self.bidder, listing.id, True)
+        # Watching what is already watched adds nothing, watching again does
+        set_watched(self.bidder, listing.id, True)
+        self.assertAlmostEqual(self.score(listing.id), 6.0, places=3)
+        set_watched(self.bidder, listing.id, False)
+        set_watched(self.bidder, listing.id, True)
+        self.assertAlmostEqual(self.score(listing.id), 8.0, places=3)
+
+        # A half life later it counts half as much
+        self.assertAlmostEqual(self.score(listing.id, timezone.now() + trending.half_life()), 4.0, places=3)
+
+    def test_refresh_prunes_closed_and_idle_listings(self):
+        create_listings(self.seller, 3)
+        closed, idle, busy = Listing.objects.order_by("id")
+        trending.record_activity(closed.id, "bid")
+        trending.record_activity(idle.id, "bid", now=timezone.now() - timedelta(days=trending.IDLE_PERIODS + 2))
+        trending.record_activity(busy.id, "comment")
+        Listing.objects.filter(pk=closed.id).update(active=False)
+
+        output = StringIO()
+        call_command("refresh_trending", stdout=output)
+        self.assertIn("Ranked 1 listing(s)", output.getvalue())
+        self.assertEqual(list(TrendingScore.objects.values_list("listing_id", flat=True)), [busy.id])
+        self.assertEqual(list(TrendingListing.objects.values_list("category", "listing_id")), [("", busy.id), ("OTH", busy.id)])
+
+    def test_reads_take_the_same_queries_however_many_listings(self):
+        for count in (3, 30):
+            create_listings(self.seller, count, category="BOK")
+            for listing_id in Listing.objects.values_list("id", flat=True):
+                trending.record_activity(listing_id, "watch")
+            trending.refresh()
+            # The top rows, then their listings with the sellers
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse("trending"), {"category": "BOK"})
+            self.assertEqual(len(response.context["listings"]), min(Listing.objects.count(), 20))
+        self.assertContains(response, "Trending in Books")
+        self.assertEqual(self.client.get(reverse("trending"), {"category": "XYZ"}).status_code, 404)
+
+    def test_api(self):
+        create_listings(self.seller, 3, category="BOK")
+        first, second, third = Listing.objects.order_by("id")
+        trending.record_activity(second.id, "bid")
+        trending.record_activity(first.id, "comment")
+        trending.refresh()
+
+        response = self.client.get(reverse("api_trending"), {"category": "BOK", "fields": "id,title"})
+        self.assertEqual([(item["id"], item["title"]) for item in response.json()["results"]], [(second.id, "Listing 1"), (first.id, "Listing 0")])
+        self.assertAlmostEqual(response.json()["results"][0]["score"], 3.0, places=2)
+        self.assertEqual(self.client.get(reverse("api_trending"), {"category": "XYZ"}).status_code, 400)
+
+
+DATABASE_SESSIONS = {
+    "SESSION_ENGINE": "django.contrib.sessions.backends.db",
+    "AUTHENTICATION_BACKENDS": ["django.contrib.auth.backends.ModelBackend"],
+}
+
+
+@override_settings(**CACHED_USERS)
+class SessionCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_user()
+        cls.bidder = create_user("bidder")
+        cls.listing = Listing.objects.create(user=cls.seller, title="Lamp", active=True, starting_price=Decimal("10.00"), current_price=Decimal("10.00"))
+
+    def setUp(self):
+        cache.clear()
+
+    def queries(self, method, path, data=None):
+        # Each measurement starts from the same data and an empty cache
+        cache.clear()
+        with transaction.atomic():
+            client = Client()
+            client.force_login(self.bidder)
+            with CaptureQueriesContext(connection) as captured:
+                getattr(client, method)(path, data or {})
+            transaction.set_rollback(True)
+        return len(captured)
+
+    def test_authenticated_requests_skip_the_session_and_user_queries(self):
+        pages = [
+            ("get", reverse("listing", args=[self.listing.id]), None),
+            ("get", reverse("watchlist_page"), None),
+            ("post", reverse("watchlist", args=[self.listing.id]), {"watchlist": "watchlist"}),
+            ("post", reverse("bid", args=[self.listing.id]), {"price": "20"}),
+        ]
+        for method, path, data in pages:
+            with self.subTest(path=path):
+                with override_settings(**DATABASE_SESSIONS):
+                    before = self.queries(method, path, data)
+                after = self.queries(method, path, data)
+                self.assertEqual(before - after, 2)
+
+    def test_changes_to_the_user_are_seen_at_once(self):
+        self.client.force_login(self.bidder)
+        self.assertEqual(self.client.get(reverse("index")).wsgi_request.user.first_name, "Bidder")
+
+        self.bidder.first_name = "Bea"
+        self.bidder.save()
+        self.assertEqual(self.client.get(reverse("index")).wsgi_request.user.first_name, "Bea")
+
+        # A new password signs out the other sessions, as without the cache
+        self.bidder.set_password("another password")
+        self.bidder.save()
+        self.assertEqual(self.client.get(reverse("watchlist_page")).status_code, 302)
+
+    def test_cached_user_is_slim(self):
+        user = cached_user(self.bidder.id)
+        self.assertEqual((user.username, user.last_name), ("bidder", "Tester"))
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, "bidder@example.com")
+        self.assertIsNone(cached_user(0))
+
+    def test_check_rejects_per_process_user_and_session_caches(self):
+        self.assertEqual([error.id for error in check_shared_caches(None)], ["auctions.E001", "auctions.E002"])
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}):
+            self.assertEqual(check_shared_caches(None), [])
+        with override_settings(AUTHENTICATION_BACKENDS=["django.contrib.auth.backends.ModelBackend"]):
+            self.assertEqual([error.id for error in check_shared_caches(None)], ["auctions.E002"])
+        with override_settings(**DATABASE_SESSIONS):
+            self.assertEqual(check_shared_caches(None), [])
+
+    @override_settings(SESSION_ENGINE="django.contrib.sessions.backends.signed_cookies")
+    def test_signed_cookie_sessions_stay_off_the_database(self):
+        self.assertTrue(self.client.login(username="bidder", password="password"))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(reverse("watchlist_page")).status_code, 200)
+        self.assertFalse(Session.objects.exists())
+
+
+@override_settings(**CACHED_USERS)
+@benchmark
+class SessionCacheBenchmark(TestCase):
+    requests = 200
+
+    def test_queries_per_authenticated_request(self):
+        data = benchmark_data.generate(listings=2000)
+        user = User.objects.get(pk=data.users[0])
+        scenarios = [scenario for scenario in benchmark_runner.default_scenarios(data) if scenario.name in ("listing", "bid", "watchlist_page")]
+
+        cache.clear()
+        with override_settings(**DATABASE_SESSIONS):
+            before = benchmark_runner.run(scenarios, requests=self.requests, user=user)["scenarios"]
+        cache.clear()
+        after = benchmark_runner.run(scenarios, requests=self.requests, user=user)["scenarios"]
+
+        for name in before:
+            benchmark_log.info(f"{name:>15}: {before[name]['queries_per_request']:.1f} -> {after[name]['queries_per_request']:.1f} queries per request, "
+                               f"p50 {before[name]['p50_ms']:.2f}ms -> {after[name]['p50_ms']:.2f}ms")
+            self.assertLessEqual(after[name]["queries_per_request"], before[name]["queries_per_request"] - 2)
@@ -0,0 +1,143 @@
+import math
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+# How long a retried submission with the same key is answered from the first one
+IDEMPOTENCY_WINDOW = 60 * 10
+
+IDEMPOTENCY_FIELD = "idempotency_key"
+IDEMPOTENCY_HEADER = "HTTP_IDEMPOTENCY_KEY"
+
+# How long a duplicate waits for the first request to finish before giving up
+IDEMPOTENCY_WAIT = 5
+
+_PENDING = "pending"
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def _cache():
+    return caches[getattr(settings, "RATE_LIMIT_CACHE", "default")]
+
+
+def _locked(cache, key, attempts=50):
+    # cache.add is atomic on every backend, so it can serve as a short lock
+    for _ in range(attempts):
+        if cache.add(f"{key}:lock", 1, 5):
+            return True
+        time.sleep(0.001)
+    return False
+
+
+def take_token(scope, user_id, now=None):
+    """Take a token from the user's bucket for scope.
+
+    Returns 0 if the request may go ahead, otherwise the number of seconds
+    until a token is available. Scopes missing from RATE_LIMITS are unlimited.
+    The bucket is stored as the single time at which it will be full again
+    (the generic cell rate algorithm), so taking a token is one read and one
+    write.
+    """
+    limit = getattr(settings, "RATE_LIMITS", {}).get(scope)
+    if limit is None:
+        return 0
+    burst, interval = limit
+    cache = _cache()
+    key = f"ratelimit:{scope}:{user_id}"
+    if not _locked(cache, key):
+        return interval
+    try:
+        now = time.time() if now is None else now
+        full_at = max(cache.get(key, now), now)
+        wait = full_at - now - interval * (burst - 1)
+        if wait > 0:
+            return wait
+        cache.set(key, full_at + interval, full_at + interval - now)
+        return 0
+    finally:
+        cache.delete(f"{key}:lock")
+
+
+def rate_limit(scope):
+    """Answer writes beyond the user's rate for scope with 429 Too Many Requests."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in SAFE_METHODS and request.user.is_authenticated:
+                wait = take_token(scope, request.user.id)
+                if wait:
+                    response = HttpResponse("Too many requests, slow down.", status=429, content_type="text/plain")
+                    response["Retry-After"] = str(math.ceil(wait))
+                    return response
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def new_idempotency_key():
+    return uuid.uuid4().hex
+
+
+def _replay(stored):
+    response = HttpResponse(stored["content"], status=stored["status"], content_type=stored["content_type"])
+    if stored["location"]:
+        response["Location"] = stored["location"]
+    response["Idempotent-Replay"] = "true"
+    return response
+
+
+def idempotent(scope):
+    """Run a POST at most once per idempotency key; repeats get the first response.
+
+    The key comes from the Idempotency-Key header or the idempotency_key
+    form field and is scoped to the user. Requests without a key run as usual.
+    Error responses are not remembered, so the same key can be retried.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = (request.META.get(IDEMPOTENCY_HEADER) or request.POST.get(IDEMPOTENCY_FIELD)) if request.method == "POST" else None
+            if not key or not request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+
+            cache = _cache()
+            cache_key = f"idempotency:{scope}:{request.user.id}:{key[:64]}"
+            if not cache.add(cache_key, _PENDING, IDEMPOTENCY_WINDOW):
+                # A repeat: wait for the first request to finish, then answer as it did
+                deadline = time.monotonic() + IDEMPOTENCY_WAIT
+                stored = cache.get(cache_key)
+                while stored == _PENDING and time.monotonic() < deadline:
+                    time.sleep(0.05)
+                    stored = cache.get(cache_key)
+                if isinstance(stored, dict):
+                    return _replay(stored)
+                if stored == _PENDING:
+                    response = HttpResponse("This request is still being processed.", status=409, content_type="text/plain")
+                    response["Retry-After"] = "1"
+                    return response
+                # Expired or forgotten after an error in between: run it now
+                if not cache.add(cache_key, _PENDING, IDEMPOTENCY_WINDOW):
+                    return wrapper(request, *args, **kwargs)
+
+            try:
+                response = view(request, *args, **kwargs)
+            except BaseException:
+                cache.delete(cache_key)
+                raise
+            if response.status_code >= 400 or response.streaming:
+                cache.delete(cache_key)
+            else:
+                cache.set(cache_key, {
+                    "status": response.status_code,
+                    "content": response.content,
+                    "content_type": response.get("Content-Type"),
+                    "location": response.get("Location"),
+                }, IDEMPOTENCY_WINDOW)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,170 @@
+import csv
+import io
+import json
+from collections import Counter
+
+from django.db import transaction
+from django.utils import timezone
+
+from .forms import CreateListing
+from .models import Bid, Listing
+from .stats import adjust_category_stats
+
+FORMATS = ("csv", "jsonl")
+
+# Columns an import reads; duration is optional and defaults like the form
+IMPORT_FIELDS = ("title", "description", "image", "starting_price", "category", "duration")
+
+# Row errors an import keeps; past this they are only counted
+MAX_ERRORS = 1000
+
+EXPORTS = {
+    "listings": (
+        Listing.objects.order_by("id"),
+        ("id", "title", "description", "image", "category", "starting_price", "current_price", "number_of_bids",
+         "active", "created", "ends_at", "user__username", "current_bidder__username", "winner__username"),
+    ),
+    "bids": (
+        Bid.objects.order_by("id"),
+        ("id", "listing_id", "user__username", "price", "created"),
+    ),
+}
+
+
+def format_of(name):
+    """Guess the format from a file name, defaulting to CSV."""
+    return "jsonl" if name.lower().endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+
+class UnreadableFile(ValueError):
+    """The file itself cannot be read any further, as opposed to one bad row."""
+
+    def __init__(self, message, line_number=None):
+        super().__init__(message if line_number is None else f"Line {line_number}: {message}")
+        self.line_number = line_number
+
+
+def read_rows(stream, format):
+    """Yield (line number, row) pairs from a text stream.
+
+    A line that cannot be parsed yields (line number, None). Text that is not
+    UTF-8, or CSV the csv module gives up on, raises UnreadableFile.
+    """
+    try:
+        if format == "csv":
+            reader = csv.DictReader(stream)
+            try:
+                for row in reader:
+                    yield reader.line_num, row
+            except csv.Error as error:
+                # DictReader only copies line_num after a good row; the csv reader has the failing one
+                raise UnreadableFile(str(error), reader.reader.line_num)
+            return
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row if isinstance(row, dict) else None
+    except UnicodeDecodeError:
+        # Text is decoded a block at a time, so the line is not known
+        raise UnreadableFile("The file is not UTF-8 text.")
+
+
+class ImportReport:
+    def __init__(self, max_errors=MAX_ERRORS):
+        self.created = 0
+        self.errors = []
+        self.error_count = 0
+        self.max_errors = max_errors
+        self.unreadable = None
+
+    def add_error(self, line_number, errors):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line_number, errors))
+
+
+def _import_chunk(rows, user, report, dry_run):
+    now = timezone.now()
+    listings = []
+    for line_number, row in rows:
+        if row is None:
+            report.add_error(line_number, {"__all__": ["Not a valid row."]})
+            continue
+        data = {field: row[field] for field in IMPORT_FIELDS if row.get(field) not in (None, "")}
+        data.setdefault("duration", CreateListing.base_fields["duration"].initial)
+        form = CreateListing(data)
+        if form.is_valid():
+            listings.append(form.build_listing(user, now))
+        else:
+            report.add_error(line_number, {field: list(messages) for field, messages in form.errors.items()})
+    if listings and not dry_run:
+        with transaction.atomic():
+            Listing.objects.bulk_create(listings)
+            # bulk_create skips the signals that keep category stats
+            adjust_category_stats(Counter(listing.category for listing in listings))
+    report.created += len(listings)
+
+
+def import_listings(rows, user, chunk_size=1000, dry_run=False, max_errors=MAX_ERRORS):
+    """Validate rows with the CreateListing rules and create listings for the valid ones.
+
+    rows is an iterable of (line number, row) pairs as made by read_rows. Each
+    chunk is validated, then inserted with one bulk_create in its own
+    transaction, so only one chunk is held in memory. Invalid rows are left
+    out and reported; they do not stop the import. The first max_errors of
+    them are kept and the rest only counted. A file that cannot be read any
+    further stops the import at that point and is kept as report.unreadable.
+    """
+    report = ImportReport(max_errors)
+    chunk = []
+    try:
+        for line in rows:
+            chunk.append(line)
+            if len(chunk) >= chunk_size:
+                _import_chunk(chunk, user, report, dry_run)
+                chunk = []
+    except UnreadableFile as error:
+        report.unreadable = error
+    if chunk:
+        _import_chunk(chunk, user, report, dry_run)
+    return report
+
+
+def _value(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+class _Line:
+    # csv.writer only needs an object with write(); hand each line straight back
+    def write(self, value):
+        return value
+
+
+def export_rows(kind, format, chunk_size=2000):
+    """Yield an export of all listings or all bids, one line at a time.
+
+    Rows are read with a server-side iterator, so memory does not grow with
+    the size of the table.
+    """
+    queryset, columns = EXPORTS[kind]
+    rows = queryset.values_list(*columns).iterator(chunk_size=chunk_size)
+    names = [column.replace("__username", "") for column in columns]
+    if format == "csv":
+        writer = csv.writer(_Line())
+        yield writer.writerow(names)
+        for row in rows:
+            yield writer.writerow(map(_value, row))
+        return
+    for row in rows:
+        yield json.dumps(dict(zip(names, map(_value, row))), default=str) + "\n"
+
+
+def text_stream(uploaded_file):
+    """Read an uploaded file as text without loading it into memory."""
+    return io.TextIOWrapper(uploaded_file.file, encoding="utf-8-sig", newline="")
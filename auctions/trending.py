@@ -0,0 +1,124 @@
+import heapq
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Power
+from django.utils import timezone
+
+from .models import Listing, TrendingListing, TrendingScore
+
+# Scores are kept relative to the start of the period of their last activity,
+# so the exponential growth within a period stays small. Moving a score to a
+# later period multiplies it by the decay over the periods in between.
+EPOCH = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+PERIOD = timedelta(days=1)
+
+# Scores idle for this many periods have decayed to nothing and are deleted on refresh
+IDLE_PERIODS = 7
+
+ALL = ""
+
+
+def half_life():
+    return timedelta(hours=getattr(settings, "TRENDING_HALF_LIFE_HOURS", 6))
+
+
+def weight(kind):
+    return getattr(settings, "TRENDING_WEIGHTS", {"bid": 3.0, "watch": 2.0, "comment": 1.0})[kind]
+
+
+def _period(now):
+    return (now - EPOCH) // PERIOD
+
+
+def _growth(now, period):
+    # How much an activity now outweighs one at the start of the period
+    return 2 ** ((now - EPOCH - period * PERIOD) / half_life())
+
+
+def _decay():
+    # What a score loses over a whole period
+    return 2 ** -(PERIOD / half_life())
+
+
+def current_score(now=None):
+    """An expression for each TrendingScore's decayed value at now.
+
+    That is the sum over the listing's activity of its weight halved for
+    every half life since.
+    """
+    now = now or timezone.now()
+    period = _period(now)
+    decay = Power(Value(_decay()), Value(period) - F("period"), output_field=models.FloatField())
+    return F("score") * decay / Value(_growth(now, period))
+
+
+def record_activity(listing_id, kind, count=1, now=None):
+    """Add count activities of a kind ("bid", "watch" or "comment") to a listing's score.
+
+    A single UPDATE of the listing's row, or an INSERT for its first
+    activity; nothing is aggregated. Activity recorded with a time in an
+    earlier period than the row's, from a lagging clock, is decayed to the
+    row's period instead.
+    """
+    now = now or timezone.now()
+    period = _period(now)
+    amount = weight(kind) * count * _growth(now, period)
+    decay = Value(_decay())
+    scores = TrendingScore.objects.filter(listing_id=listing_id)
+    changes = {
+        "score": Case(
+            When(period__gt=period, then=F("score") + Value(amount) * Power(decay, F("period") - Value(period))),
+            default=F("score") * Power(decay, Value(period) - F("period")) + Value(amount),
+            output_field=models.FloatField(),
+        ),
+        "period": Case(When(period__gt=period, then=F("period")), default=Value(period)),
+    }
+    if not scores.update(**changes):
+        try:
+            with transaction.atomic():
+                TrendingScore.objects.create(listing_id=listing_id, score=amount, period=period)
+        except IntegrityError:
+            # A concurrent write created it first
+            scores.update(**changes)
+
+
+def refresh(now=None, size=None):
+    """Rewrite the top listings of each category and overall.
+
+    One pass over the scores of recently active listings, which is all the
+    scores table holds once idle and closed listings are pruned. Returns the
+    number of scored listings ranked.
+    """
+    now = now or timezone.now()
+    size = size or getattr(settings, "TRENDING_SIZE", 20)
+    TrendingScore.objects.filter(Q(listing__active=False) | Q(period__lt=_period(now) - IDLE_PERIODS)).delete()
+    rows = list(TrendingScore.objects.filter(listing__active=True).annotate(current=current_score(now)).values_list("listing_id", "listing__category", "current"))
+
+    by_category = {ALL: rows}
+    for row in rows:
+        by_category.setdefault(row[1], []).append(row)
+    entries = []
+    for category, candidates in by_category.items():
+        # Newer listings first among equal scores
+        best = heapq.nlargest(size, candidates, key=lambda row: (row[2], row[0]))
+        entries += [TrendingListing(category=category, position=position, listing_id=listing_id, score=score)
+                    for position, (listing_id, _, score) in enumerate(best)]
+    with transaction.atomic():
+        TrendingListing.objects.all().delete()
+        TrendingListing.objects.bulk_create(entries)
+    return len(rows)
+
+
+def trending_listings(category=ALL, listings=None, size=None):
+    """The listings of the last refresh with their scores, best first.
+
+    Two queries, each a handful of index seeks, however many listings and
+    bids there are. Listings closed since the refresh are left out.
+    """
+    entries = TrendingListing.objects.filter(category=category).order_by("position").values_list("listing_id", "score")
+    entries = list(entries[:size] if size else entries)
+    found = (Listing.objects.all() if listings is None else listings).filter(active=True).in_bulk([listing_id for listing_id, score in entries])
+    return [(found[listing_id], score) for listing_id, score in entries if listing_id in found]
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 urlpatterns = [
     path("", views.index, name="index"),
@@ -9,11 +9,31 @@ urlpatterns = [
     path("register", views.register, name="register"),
     path("create", views.create_listing, name="create_listing"),
     path("listings/<int:listing_id>", views.listing, name="listing"),
+    path("listings/<int:listing_id>/stream", views.listing_stream, name="listing_stream"),
+    path("listings/<int:listing_id>/bids", views.listing_bids, name="listing_bids"),
+    path("listings/<int:listing_id>/comments", views.listing_comments, name="listing_comments"),
+    path("listings/<int:listing_id>/image/<str:size>/<str:digest>", views.listing_image, name="listing_image"),
     path("<int:listing_id>/watchlist", views.watchlist, name="watchlist"),
     path("<int:listing_id>/bid", views.bid, name="bid"),
+    path("<int:listing_id>/proxy_bid", views.proxy_bid, name="proxy_bid"),
     path("<int:listing_id>/close", views.close_listing, name="close_listing"),
     path("<int:listing_id>/comment", views.comment, name="comment"),
     path("watchlist", views.watchlist_page, name="watchlist_page"),
+    path("bids", views.my_bids, name="my_bids"),
+    path("watchlist/ids", views.watchlist_ids, name="watchlist_ids"),
     path("categories", views.category_page, name="category_page"),
-    path("categories/<str:category_name>", views.category, name="category")
+    path("categories/<str:category_name>", views.category, name="category"),
+    path("search", views.search, name="search"),
+    path("trending", views.trending, name="trending"),
+    path("_perf", views.perf, name="perf"),
+    path("import", views.import_listings_view, name="import_listings"),
+    path("export/<str:kind>", views.export, name="export"),
+    path("api/v1/csrf", api.csrf, name="api_csrf"),
+    path("api/v1/listings", api.listings, name="api_listings"),
+    path("api/v1/listings/<int:listing_id>", api.listing, name="api_listing"),
+    path("api/v1/listings/<int:listing_id>/bids", api.bids, name="api_bids"),
+    path("api/v1/listings/<int:listing_id>/comments", api.comments, name="api_comments"),
+    path("api/v1/trending", api.trending, name="api_trending"),
+    path("api/v1/watchlist", api.watchlist, name="api_watchlist"),
+    path("api/v1/watchlist/<int:listing_id>", api.watchlist_item, name="api_watchlist_item")
 ]
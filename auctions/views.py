@@ -1,30 +1,66 @@
+import hashlib
+import os
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.db import IntegrityError
-from django.core.exceptions import ObjectDoesNotExist
-from django.http import HttpResponse, HttpResponseRedirect, Http404
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.templatetags.static import static
 from django.urls import reverse
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-
-
-from .models import User, Listing, Bid, Comment, Watchlist
-from .forms import CreateListing, CreateBid, CreateComment
-
+from django.views.decorators.http import condition
+from django.utils.functional import SimpleLazyObject
+
+
+from .models import User, Listing, ArchivedListing, ProxyBid, Watchlist, CategoryStats
+from .forms import CreateListing, CreateBid, CreateComment, CreateProxyBid, SearchForm, ImportListings
+from .bidding import BidError, place_bid, place_proxy_bid
+from .expiry import close_by_seller
+from .images import THUMBNAIL_SIZES, content_type, schedule_refresh, store_dir, thumbnail_path, touch
+from .cache import LISTING_CACHE_TIMEOUT, category_changed, listing_version
+from .comments import add_comment, comment_page
+from .db import read_only
+from .history import listing_history, user_bids
+from . import outbox
+from .pagination import keyset_paginate
+from .perf import registry
+from .search import search_listings
+from .throttle import idempotent, new_idempotency_key, rate_limit
+from .transfer import EXPORTS, FORMATS, export_rows, format_of, import_listings, read_rows, text_stream
+from .trending import trending_listings
+from .watchlist import set_watched
+
+LISTINGS_PER_PAGE = 25
+
+# Latest comments shown on the listing page; older ones load from listing_comments
+COMMENTS_INLINE = 10
+COMMENTS_PER_PAGE = 50
+
+WATCHLIST_SORTS = {
+    "newest": ("-created", "-id"),
+    "price": ("current_price", "id"),
+    "ending": ("ends_at", "id"),
+}
+
+CATEGORY_SORTS = {
+    "newest": ("-created", "-id"),
+    "price": ("current_price", "id"),
+    "price_desc": ("-current_price", "-id"),
+    "bids": ("-number_of_bids", "-id"),
+}
+
+@read_only
 def index(request):
-    listings = Listing.objects.filter(active=True)
-
-    # Get the bids from the database to use them for current price when there has never been any bids
-    for listing in listings:
-        bids = listing.bids.all()
-        if bids: 
-            listing.current_price = listing.bids.last().price
-        else:
-            listing.current_price = listing.starting_price
-        listing.save()
+    # Prices and bid counts are kept up to date when bids are placed, so this only reads
+    listings = Listing.objects.filter(active=True).select_related("user")
+    page = keyset_paginate(listings, request.GET.get("cursor"), LISTINGS_PER_PAGE)
 
     return render(request, "auctions/index.html", {
-        "listings":listings
+        "listings":page
     })
 
 def login_view(request):
@@ -91,18 +127,7 @@ def create_listing(request):
         form = CreateListing(request.POST)
 
         if form.is_valid():
-            title = form.cleaned_data["title"]
-            description = form.cleaned_data["description"]
-            starting_price = form.cleaned_data["starting_price"]
-            category = form.cleaned_data["category"]
-
-            if form.cleaned_data["image"]:
-                image = form.cleaned_data["image"]
-            else:
-                image = 'https://sisterhoodofstyle.com/wp-content/uploads/2018/02/no-image-1.jpg'
-
-            newListing = Listing(user=request.user,title=title,description=description,image=image,active=True,starting_price=starting_price,category=category)
-            newListing.save()
+            form.build_listing(request.user).save()
 
         else:
             return render(request, "auctions/create_listing.html", {
@@ -116,48 +141,21 @@ def create_listing(request):
     })
 
 def listing(request, listing_id):
+    # Read the version before the listing, so a bid committing in between leaves
+    # the fragments cached under a version that is already stale
+    version = listing_version(listing_id)
+
     # Try to get the listing from database by the id provided
     try:
-        listing = Listing.objects.get(pk=listing_id)
+        listing = Listing.objects.select_related("user", "current_bidder", "winner").get(pk=listing_id)
     except Listing.DoesNotExist:
-        raise Http404("Listing does not exist") 
-
-    # Get the comments from the database
-    comments = listing.comments.all()
-
-    # If listing is active
-    if listing.active:
-        # If the user is signed in render a template with watchlist
-        if request.user.is_authenticated:
-            # If the listing has ever been watchlisted
-            try:
-                watchlist = Watchlist.objects.get(user=request.user, listing=listing)
-
-                return render(request, "auctions/listing.html", {
-                    "listing": listing,
-                    "watchlist":watchlist.active,
-                    "bidForm": CreateBid(),
-                    "create_comment":CreateComment(),
-                    "comments":comments
-                })
-            # If the listing has never been watchlisted
-            except Watchlist.DoesNotExist:
-                return render(request, "auctions/listing.html", {
-                    "listing": listing,
-                    "watchlist":"never_watchlisted",
-                    "bidForm": CreateBid(),
-                    "create_comment":CreateComment(),
-                    "comments":comments
-                })
-        
-        # If the user isn't signed in render a template without watchlist
-        return render(request, "auctions/listing.html", {
-                "listing": listing,
-                "comments":comments
-            })
+        # Long closed listings are moved to the archive tables (see auctions.archive)
+        listing = ArchivedListing.objects.select_related("user", "winner").filter(pk=listing_id).first()
+        if listing is None:
+            raise Http404("Listing does not exist")
 
     # If listing is not active show who won the auction
-    else:
+    if not listing.active:
         if request.user == listing.winner or request.user == listing.user:
             return render(request, "auctions/winner.html", {
                 "listing": listing
@@ -165,128 +163,360 @@ def listing(request, listing_id):
         else:
             raise Http404("Listing is not active")
 
+    # The description, price and comments are the same for every viewer and are
+    # cached in the template; the comments are only queried on a cache miss
+    context = {
+        "listing": listing,
+        "version": version,
+        "cache_timeout": LISTING_CACHE_TIMEOUT,
+        "comments": SimpleLazyObject(lambda: comment_page(listing.id, page_size=COMMENTS_INLINE))
+    }
+
+    # If the user is signed in render a template with watchlist
+    if request.user.is_authenticated:
+        # If the listing has ever been watchlisted
+        try:
+            watchlist = Watchlist.objects.get(user=request.user, listing=listing)
+            context["watchlist"] = watchlist.active
+        # If the listing has never been watchlisted
+        except Watchlist.DoesNotExist:
+            context["watchlist"] = "never_watchlisted"
+        context["bidForm"] = CreateBid()
+        context["proxyForm"] = CreateProxyBid()
+        context["proxy_maximum"] = ProxyBid.objects.filter(listing=listing, user=request.user).values_list("maximum", flat=True).first()
+        context["create_comment"] = CreateComment()
+        # Resubmitting the same rendered form (double clicks, retries) runs it once
+        context["idempotency_key"] = new_idempotency_key()
+
+    return render(request, "auctions/listing.html", context)
+
+def listing_stream(request, listing_id):
+    # The live feed is served by the ASGI application (commerce.asgi). Under WSGI,
+    # 204 tells EventSource clients to stop reconnecting
+    return HttpResponse(status=204)
+
 @login_required
+@idempotent("watchlist")
+@rate_limit("watchlist")
 def watchlist(request, listing_id):
     listing = Listing.objects.get(pk=listing_id)
 
     if request.method == 'POST':
-        form = request.POST
-        try:
-            watchlist = Watchlist.objects.get(user=request.user, listing=listing)
-            if form["watchlist"] == "watchlist":
-                watchlist.active = True
-                watchlist.save()
-            else:
-                watchlist.active = False
-                watchlist.save()
-        except ObjectDoesNotExist:
-            watchlist = Watchlist(user=request.user, listing=listing, active=True)
-            watchlist.save()
+        set_watched(request.user, listing.id, request.POST.get("watchlist") == "watchlist")
     return HttpResponseRedirect(reverse("listing", args=[listing_id]))
 
 @login_required
+@idempotent("bid")
+@rate_limit("bid")
 def bid(request, listing_id):
-    listing = Listing.objects.get(pk=listing_id)
-
     if request.method == 'POST':
-
-        bids = listing.bids.all()
-        if bids: 
-            current_price = listing.bids.last().price
-        else:
-            current_price = listing.starting_price
-        
         userBid = CreateBid(request.POST)
         if userBid.is_valid():
-            if len(bids) == 0:
-                if userBid.cleaned_data['price'] < current_price:
-                    messages.add_message(request, messages.SUCCESS, 'The bid must be greater than or equal to the initial price!')
-                    return HttpResponseRedirect(reverse("listing", args=[listing_id]))
-                else:
-                    newBid = Bid(price=userBid.cleaned_data['price'],listing=listing,user=request.user) 
-                    newBid.save()
-                    listing.current_price = userBid.cleaned_data['price']
-                    listing.save()
-            else:
-                if userBid.cleaned_data['price'] <= current_price:
-                    messages.add_message(request, messages.SUCCESS, 'The bid must be greater than the current bid!')
-                    return HttpResponseRedirect(reverse("listing", args=[listing_id]))
-                else:
-                    newBid = Bid(price=userBid.cleaned_data['price'],listing=listing,user=request.user) 
-                    listing.current_price = userBid.cleaned_data['price']
-                    listing.save()
-                    newBid.save()
-
-        bids = listing.bids.all()
-        listing.current_bidder = listing.bids.last().user
-        listing.number_of_bids = len(bids)
-        listing.save()
+            try:
+                place_bid(listing_id, request.user, userBid.cleaned_data['price'])
+            except Listing.DoesNotExist:
+                raise Http404("Listing does not exist")
+            except BidError as error:
+                messages.add_message(request, messages.SUCCESS, str(error))
 
     return HttpResponseRedirect(reverse("listing", args=[listing_id]))
 
 @login_required
-def close_listing(request, listing_id):
+@idempotent("proxy_bid")
+@rate_limit("bid")
+def proxy_bid(request, listing_id):
     if request.method == 'POST':
+        form = CreateProxyBid(request.POST)
+        if form.is_valid():
+            try:
+                bids = place_proxy_bid(listing_id, request.user, form.cleaned_data['maximum'])
+            except Listing.DoesNotExist:
+                raise Http404("Listing does not exist")
+            except BidError as error:
+                messages.add_message(request, messages.SUCCESS, str(error))
+            else:
+                if bids and bids[-1].user_id != request.user.id:
+                    messages.add_message(request, messages.SUCCESS, "Another bidder's maximum is higher, you have been outbid!")
 
-        listing = Listing.objects.get(pk=listing_id)
-        listing.active = False
-
-        try:
-            bidder = listing.bids.last().user
-        except AttributeError:
-            bidder = None
+    return HttpResponseRedirect(reverse("listing", args=[listing_id]))
 
-        listing.winner = bidder
-        listing.save()
-        return HttpResponseRedirect(reverse("listing", args=[listing_id]))
+@login_required
+def close_listing(request, listing_id):
+    if request.method == 'POST':
+        close_by_seller(listing_id, request.user)
     return HttpResponseRedirect(reverse("listing", args=[listing_id]))
 
 @login_required
+@idempotent("comment")
+@rate_limit("comment")
 def comment(request, listing_id):
     if request.method == 'POST':
         listing = Listing.objects.get(pk=listing_id)
         user_comment = CreateComment(request.POST)
         if user_comment.is_valid():
-            newComment = Comment(text_comment=user_comment.cleaned_data['text_comment'], user=request.user, listing=listing)
-            newComment.save()
+            add_comment(listing.id, request.user, user_comment.cleaned_data['text_comment'])
     return HttpResponseRedirect(reverse("listing", args=[listing_id]))
 
+def listing_comments(request, listing_id):
+    listing = Listing.objects.filter(pk=listing_id).only("title", "comment_count").first()
+    if listing is None:
+        raise Http404("Listing does not exist")
+    page = comment_page(listing_id, request.GET.get("cursor"), COMMENTS_PER_PAGE)
+
+    if request.GET.get("format") == "json":
+        return JsonResponse({
+            "listing": listing_id,
+            "comments": [{
+                "id": comment.id,
+                "author": comment.user.first_name,
+                "text": comment.text_comment,
+                "created": comment.created.isoformat(),
+            } for comment in page],
+            "next_cursor": page.next_cursor,
+        })
+    return render(request, "auctions/comments.html", {
+        "listing": listing,
+        "comments": page
+    })
+
 @login_required
 def watchlist_page(request):
+    sort = request.GET.get("sort")
+    if sort not in WATCHLIST_SORTS:
+        sort = "newest"
 
-    watchlists = request.user.my_watchlist.filter(active=True)
-
-    listings = []
-    for watchlist in watchlists:
-        listings.append(watchlist.listing)
+    # One joined query for the listings and their sellers instead of one per watched listing
+    listings = Listing.objects.filter(watchlisted__user=request.user, watchlisted__active=True).select_related("user")
+    page = keyset_paginate(listings, request.GET.get("cursor"), LISTINGS_PER_PAGE, WATCHLIST_SORTS[sort])
 
     return render(request, "auctions/watchlist.html",{
-        "listings":listings
+        "listings":page,
+        "sort":sort
     })
 
-def category_page(request):
+@login_required
+def watchlist_ids(request):
+    # Lets the front-end mark stars without rendering the watchlist page
+    listing_ids = request.user.my_watchlist.filter(active=True).values_list("listing_id", flat=True)
+
+    return JsonResponse({
+        "listings": list(listing_ids)
+    })
 
-    categories = [
-    ("COL", 'Collectibles'),
-    ("BOK", 'Books'),
-    ("ELE", 'Electronics'),
-    ("FAS", 'Fashion'),
-    ("HOM", 'Home and Garden'),
-    ("AUT", 'Auto parts'),
-    ("MUS", 'Musical instruments'),
-    ("SPO", 'Sporting goods'),
-    ("TOY", 'Toys and Hobbies'),
-    ("OTH", 'Other'),
-    ]
+@read_only
+def category_page(request):
+    # Counts and prices come from the stats table: one row per category
+    stats = CategoryStats.objects.select_related("latest_listing").in_bulk()
+    categories = [(code, name, stats.get(code)) for code, name in Listing.CATEGORY_CHOICES]
 
     return render(request, "auctions/categories.html", {
         "categories":categories
     })
 
+def _category_stats(request, category_name):
+    # Shared by the conditional request checks and the view so it is read once
+    if not hasattr(request, "category_stats"):
+        request.category_stats = CategoryStats.objects.filter(category=category_name).first()
+    return request.category_stats
+
+def _category_etag(request, category_name):
+    stats = _category_stats(request, category_name)
+    if stats is None:
+        return None
+    # Bids change the prices shown without touching the stats row (see
+    # auctions.stats.refresh_category_prices). The page also depends on the
+    # sort, the cursor and who is signed in
+    version = f"{category_name}:{stats.updated.isoformat()}:{category_changed(category_name)}:{request.GET.urlencode()}:{request.user.pk}"
+    return hashlib.sha1(version.encode()).hexdigest()
+
+def _category_last_modified(request, category_name):
+    stats = _category_stats(request, category_name)
+    if stats is None:
+        return None
+    bid_at = datetime.fromtimestamp(category_changed(category_name) / 1e9, tz=dt_timezone.utc)
+    return max(stats.updated, bid_at)
+
+@read_only
+@condition(etag_func=_category_etag, last_modified_func=_category_last_modified)
 def category(request, category_name):
+    stats = _category_stats(request, category_name)
+    if stats is None:
+        raise Http404("Category does not exist")
 
-    listings = Listing.objects.filter(category=category_name, active=True)
+    sort = request.GET.get("sort")
+    if sort not in CATEGORY_SORTS:
+        sort = "newest"
+
+    # Every sort is backed by a partial index on (category, sort column)
+    listings = Listing.objects.filter(category=category_name, active=True).select_related("user")
+    page = keyset_paginate(listings, request.GET.get("cursor"), LISTINGS_PER_PAGE, CATEGORY_SORTS[sort])
 
     return render(request, "auctions/category.html", {
-        "listings":listings
-    })
\ No newline at end of file
+        "listings":page,
+        "stats":stats,
+        "sort":sort
+    })
+
+@read_only
+def trending(request):
+    # Ranked in the background by refresh_trending; this only reads its top rows
+    category = request.GET.get("category", "")
+    categories = dict(Listing.CATEGORY_CHOICES)
+    if category and category not in categories:
+        raise Http404("Category does not exist")
+    listings = trending_listings(category, Listing.objects.select_related("user"))
+
+    return render(request, "auctions/trending.html", {
+        "listings": listings,
+        "category": category,
+        "categories": Listing.CATEGORY_CHOICES,
+        "category_name": categories.get(category),
+    })
+
+@read_only
+def search(request):
+    form = SearchForm(request.GET)
+    listings = None
+
+    if form.is_valid() and form.cleaned_data["q"]:
+        listings = search_listings(
+            form.cleaned_data["q"],
+            category=form.cleaned_data["category"],
+            min_price=form.cleaned_data["min_price"],
+            max_price=form.cleaned_data["max_price"],
+            cursor=request.GET.get("cursor"),
+            page_size=LISTINGS_PER_PAGE
+        )
+
+    # Keep the filters on the "next page" link
+    query = request.GET.copy()
+    query.pop("cursor", None)
+
+    return render(request, "auctions/search.html", {
+        "form":form,
+        "listings":listings,
+        "query":query.urlencode()
+    })
+
+
+@user_passes_test(lambda user: user.is_staff)
+def perf(request):
+    if request.GET.get("format") == "prometheus":
+        return HttpResponse(registry.prometheus() + outbox.prometheus(outbox.metrics()), content_type="text/plain; version=0.0.4")
+    return JsonResponse({"views": registry.snapshot(), "outbox": outbox.metrics()})
+
+
+# Rows of the error report shown on the page; the rest are only counted
+IMPORT_ERRORS_SHOWN = 200
+
+@user_passes_test(lambda user: user.is_staff)
+def import_listings_view(request):
+    report = None
+    if request.method == "POST":
+        form = ImportListings(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data["file"]
+            format = form.cleaned_data["format"] or format_of(upload.name)
+            report = import_listings(read_rows(text_stream(upload), format), form.cleaned_data["seller"] or request.user, max_errors=IMPORT_ERRORS_SHOWN)
+            if report.unreadable:
+                form.add_error("file", str(report.unreadable))
+    else:
+        form = ImportListings()
+    return render(request, "auctions/import_listings.html", {
+        "form": form,
+        "report": report,
+        "errors": report.errors if report else [],
+    })
+
+@user_passes_test(lambda user: user.is_staff)
+def export(request, kind):
+    format = request.GET.get("format", "csv")
+    if kind not in EXPORTS or format not in FORMATS:
+        raise Http404("No such export")
+    response = StreamingHttpResponse(export_rows(kind, format), content_type="text/csv" if format == "csv" else "application/x-ndjson")
+    response["Content-Disposition"] = f'attachment; filename="{kind}.{format}"'
+    return response
+
+def listing_image(request, listing_id, size, digest):
+    # The digest becomes part of a file path, so it must be exactly a sha256
+    if size not in THUMBNAIL_SIZES or not re.fullmatch("[0-9a-f]{64}", digest):
+        raise Http404("No such image")
+    path = thumbnail_path(digest, size)
+    if not os.path.exists(path):
+        # Evicted from the store, or not fetched yet: send the browser to the
+        # original for now and fetch it again
+        listing = Listing.objects.filter(pk=listing_id).only("image", "image_digest").first()
+        if listing is None:
+            listing = ArchivedListing.objects.filter(pk=listing_id).only("image").first()
+            if listing is None:
+                raise Http404("No such image")
+        elif listing.image_digest == digest:
+            Listing.objects.filter(pk=listing_id).update(image_digest="")
+            schedule_refresh(listing_id)
+        response = HttpResponseRedirect(listing.image or static("auctions/no-image.svg"))
+        response["Cache-Control"] = "no-cache"
+        return response
+
+    touch(path)
+    sendfile = getattr(settings, "IMAGE_SENDFILE_HEADER", None)
+    if sendfile:
+        # The web server sends the file; X-Accel-Redirect wants a URL under an internal location
+        target = path
+        if sendfile == "X-Accel-Redirect":
+            target = settings.IMAGE_SENDFILE_PREFIX + os.path.relpath(path, store_dir())
+        response = HttpResponse(content_type=content_type(path))
+        response[sendfile] = target
+    else:
+        response = FileResponse(open(path, "rb"), content_type=content_type(path))
+    # The digest in the URL changes whenever the image does
+    response["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+BIDS_PER_PAGE = 50
+
+def listing_bids(request, listing_id):
+    listing = Listing.objects.filter(pk=listing_id).only("title", "number_of_bids", "active").first()
+    archived = listing is None
+    if archived:
+        # Long closed listings are moved to the archive tables (see auctions.archive)
+        listing = ArchivedListing.objects.filter(pk=listing_id).only("title", "number_of_bids").first()
+        if listing is None:
+            raise Http404("Listing does not exist")
+    page = listing_history(listing_id, request.GET.get("cursor"), BIDS_PER_PAGE, archived)
+
+    if request.GET.get("format") == "json":
+        return JsonResponse({
+            "listing": listing_id,
+            "bids": [{
+                "id": bid.id,
+                "price": str(bid.price),
+                "created": bid.created.isoformat(),
+                "bidder": f"{bid.user.first_name} {bid.user.last_name}",
+            } for bid in page],
+            "next_cursor": page.next_cursor,
+        })
+    return render(request, "auctions/bids.html", {
+        "listing": listing,
+        "bids": page
+    })
+
+@login_required
+def my_bids(request):
+    page = user_bids(request.user, request.GET.get("cursor"), LISTINGS_PER_PAGE)
+
+    if request.GET.get("format") == "json":
+        return JsonResponse({
+            "listings": [{
+                "listing": summary["listing_id"],
+                "title": summary["listing"].title,
+                "current_price": str(summary["listing"].current_price),
+                "highest_bid": str(summary["highest_bid"]),
+                "bids": summary["bids"],
+                "last_bid_at": summary["last_bid_at"].isoformat(),
+                "status": summary["status"],
+            } for summary in page],
+            "next_cursor": page.next_cursor,
+        })
+    return render(request, "auctions/my_bids.html", {
+        "summaries": page
+    })
@@ -0,0 +1,30 @@
+from django.db import IntegrityError, transaction
+
+from .models import Watchlist
+from .trending import record_activity
+
+
+def set_watched(user, listing_id, active):
+    """Add a listing to the user's watchlist or take it off.
+
+    Writes first rather than reading then writing: on SQLite a transaction
+    that reads before writing fails at once under contention instead of
+    waiting. Only adding a listing that was not being watched counts towards
+    its trending score.
+    """
+    watched = Watchlist.objects.filter(user=user, listing_id=listing_id)
+    if watched.exclude(active=active).update(active=active):
+        added = active
+    elif watched.exists():
+        added = False
+    else:
+        try:
+            with transaction.atomic():
+                Watchlist.objects.create(user=user, listing_id=listing_id, active=active)
+            added = active
+        except IntegrityError:
+            # A concurrent toggle created it first
+            watched.update(active=active)
+            added = False
+    if added:
+        record_activity(listing_id, "watch")
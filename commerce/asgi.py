@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'commerce.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once the app registry is ready
+from auctions.streams import stream_application  # noqa: E402
+
+# Live listing feeds (/listings/<id>/stream) are served here; everything else goes to Django
+application = stream_application(django_application)
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'auctions.perf.PerfMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,7 +55,8 @@ ROOT_URLCONF = 'commerce.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timed for the perf middleware
+        'BACKEND': 'auctions.perf.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -74,15 +76,183 @@ WSGI_APPLICATION = 'commerce.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+# Everything below can be set from the environment. DATABASE_ENGINE=postgresql
+# switches from the SQLite file to PostgreSQL.
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite3')
+
+# Seconds a connection is kept open between requests (0 reconnects every request)
+DATABASE_CONN_MAX_AGE = int(os.environ.get('DATABASE_CONN_MAX_AGE', 60))
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'commerce'),
+            'USER': os.environ.get('DATABASE_USER', ''),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', ''),
+            'PORT': os.environ.get('DATABASE_PORT', ''),
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+            # Transaction pooling (PgBouncer) cannot keep a server-side cursor
+            # open across transactions
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DATABASE_POOLER') == 'pgbouncer',
+        }
+    }
+    # Views marked read_only (see auctions.db) read from this host
+    if os.environ.get('DATABASE_REPLICA_HOST'):
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'HOST': os.environ['DATABASE_REPLICA_HOST'],
+            'PORT': os.environ.get('DATABASE_REPLICA_PORT', DATABASES['default']['PORT']),
+            'TEST': {'MIRROR': 'default'},
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DATABASE_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+            # A file (rather than in-memory) test database lets concurrency tests
+            # open one connection per thread
+            'TEST': {
+                'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+            },
+        }
     }
+
+DATABASE_ROUTERS = ['auctions.db.ReplicaRouter']
+
+# Applied to each new SQLite connection by auctions.db.configure_sqlite
+SQLITE_PRAGMAS = {
+    # Readers keep going while a write transaction is open
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'wal'),
+    # Safe with WAL: a power loss can drop the last commits but not corrupt the file
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'normal'),
+    # Milliseconds a writer waits for the lock before "database is locked"
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
 }
 
 AUTH_USER_MODEL = 'auctions.User'
 
+# Sessions and authentication (see auctions.auth)
+
+# cached_db reads sessions from the cache and writes them through to the
+# database; signed_cookies keeps them in a signed cookie and off the database
+# altogether; db is Django's default. The auctions.E002 check rejects cached_db
+# with a per-process cache, so it is only the default once CACHE_BACKEND names
+# a shared one
+SESSION_ENGINE = 'django.contrib.sessions.backends.' + os.environ.get(
+    'SESSION_STORE', 'cached_db' if os.environ.get('CACHE_BACKEND') else 'db'
+)
+
+# Cache alias holding sessions and signed-in users. It must be shared by every
+# server process: with a per-process cache a changed password or name is only
+# seen by the process that saved it until its cached copy expires
+SESSION_CACHE_ALIAS = 'default'
+USER_CACHE = 'default'
+
+# Loads request.user from USER_CACHE, invalidated when the user is saved. The
+# auctions.E001 check rejects it with a per-process cache, so it is only used
+# once CACHE_BACKEND names a shared one
+AUTHENTICATION_BACKENDS = [
+    'auctions.auth.CachedUserBackend' if os.environ.get('CACHE_BACKEND') else 'django.contrib.auth.backends.ModelBackend'
+]
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache with
+# CACHE_LOCATION=redis://... (or memcached) shares the cache between processes
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+# Request instrumentation (see auctions.perf)
+
+# Recent requests per view that percentiles are computed over
+PERF_WINDOW = 1000
+
+# Set to a directory to keep cProfile dumps of requests to views that are
+# running slower than their 99th percentile
+PERF_PROFILE_DIR = os.environ.get('PERF_PROFILE_DIR')
+
+# How many requests to a view are profiled after one of them was that slow,
+# and how many seconds must pass before the view can be profiled again
+PERF_PROFILE_NEXT = 5
+PERF_PROFILE_INTERVAL = 60
+
+# Listing images (see auctions.images)
+
+# Thumbnails, named by the sha256 of the original image
+IMAGE_STORE_DIR = os.environ.get('IMAGE_STORE_DIR', os.path.join(BASE_DIR, 'image_store'))
+
+# Least recently served thumbnails are deleted beyond this size
+IMAGE_STORE_MAX_BYTES = int(os.environ.get('IMAGE_STORE_MAX_BYTES', 512 * 2 ** 20))
+
+IMAGE_FETCHER = 'auctions.images.fetch_url'
+IMAGE_FETCH_TIMEOUT = 5
+IMAGE_MAX_BYTES = 10 * 2 ** 20
+
+# Fetch on a background thread pool rather than in the saving request
+IMAGE_FETCH_ASYNC = True
+
+# Set to X-Sendfile (Apache) or X-Accel-Redirect (nginx) to let the web server
+# send thumbnails; X-Accel-Redirect paths start with IMAGE_SENDFILE_PREFIX
+IMAGE_SENDFILE_HEADER = os.environ.get('IMAGE_SENDFILE_HEADER')
+IMAGE_SENDFILE_PREFIX = '/protected/images/'
+
+# Write throttling (see auctions.throttle)
+
+# Cache alias holding rate limit buckets and idempotency keys; it must be shared
+# by every server process for the limits to hold across them
+RATE_LIMIT_CACHE = 'default'
+
+# Scope -> (burst, seconds per extra token): a user may make `burst` writes at
+# once, then one more every `seconds per extra token`. Scopes left out are unlimited
+RATE_LIMITS = {
+    'bid': (5, 2),
+    'comment': (5, 10),
+    'watchlist': (10, 1),
+}
+
+# Bidding (see auctions.bidding)
+
+# Step by which proxy bids outbid each other
+BID_INCREMENT = os.environ.get('BID_INCREMENT', '1.00')
+
+# Notifications (see auctions.outbox and auctions.notifications)
+
+# Delivers each batch of notifications; any class with a send(notifications) method
+NOTIFICATION_BACKEND = 'auctions.notifications.EmailBackend'
+
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'auctions@localhost')
+
+# Prefix of the listing links in notifications
+SITE_URL = os.environ.get('SITE_URL', 'http://localhost:8000')
+
+# Trending (see auctions.trending)
+
+# Activity counts half as much after this many hours
+TRENDING_HALF_LIFE_HOURS = 6
+
+# What each kind of activity adds to a listing's score
+TRENDING_WEIGHTS = {"bid": 3.0, "watch": 2.0, "comment": 1.0}
+
+# Listings kept per category by the refresh_trending command
+TRENDING_SIZE = 20
+
+# Archival (see auctions.archive)
+
+# Closed listings that ended longer ago than this are moved to the archive
+# tables by the archive_listings command
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 90))
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 